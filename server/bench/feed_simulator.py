@@ -0,0 +1,197 @@
+"""
+Local stand-in for the MTA's GTFS-RT endpoints, for load and integration
+testing without network access.
+
+Serves every feed in FEED_PATHS under one base url. A new version of each feed
+is published every `cadence` seconds, either synthesized from the stations
+file (`scale` times the default trip count) or taken from the next cycle of a
+recorded archive with its times shifted to the present. Responses can be
+delayed, fail with a 503 or be cut short.
+
+    uv run python -m bench.feed_simulator --port 8081 --scale 10
+    # then set Config.feed_base_url = "http://127.0.0.1:8081/"
+"""
+
+import argparse, json, logging, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator, Optional
+
+from bench.fixtures import shift_feed
+from src.mtapi.feed_archive import ArchiveReader, ReplayCycle
+from src.mtapi.mtapi import FEED_PATHS, feed_name
+from src.mtaproto.synthetic import routes_for_feed, synthetic_feed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRIPS_PER_ROUTE = 40
+
+
+class FeedSimulator:
+    def __init__(
+        self,
+        stations_file: Path,
+        archive_dir: Optional[Path] = None,
+        scale: float = 1,
+        cadence: float = 30,
+        latency: float = 0,
+        latency_jitter: float = 0,
+        error_rate: float = 0,
+        truncate_rate: float = 0,
+        seed: int = 0,
+    ):
+        self.scale = scale
+        self.cadence = cadence
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.published = 0
+        self._rng = random.Random(seed)
+        self._payloads: dict[str, bytes] = {}
+        self._stop = threading.Event()
+
+        with open(stations_file) as f:
+            stations = json.load(f)
+        self._stop_ids = sorted(stop for s in stations.values() for stop in s["stops"])
+        self._cycles: Optional[Iterator[ReplayCycle]] = (
+            self._loop_cycles(ArchiveReader(archive_dir)) if archive_dir else None
+        )
+
+    @staticmethod
+    def _loop_cycles(reader: ArchiveReader) -> Iterator[ReplayCycle]:
+        while True:
+            found = False
+            for cycle in reader.cycles():
+                found = True
+                yield cycle
+            if not found:
+                raise ValueError(f"No archived cycles in {reader.archive_dir}")
+
+    def publish(self):
+        """Replace every feed with its next version."""
+        now = int(time.time())
+        if self._cycles:
+            cycle = next(self._cycles)
+            shift = now - int(cycle.started_at)
+            payloads = {
+                feed_name(url): shift_feed(p, shift)
+                for url, p in cycle.payloads.items()
+            }
+        else:
+            trips = max(1, round(DEFAULT_TRIPS_PER_ROUTE * self.scale))
+            payloads = {
+                path: synthetic_feed(
+                    self._stop_ids,
+                    routes_for_feed(path),
+                    now,
+                    trips,
+                    seed=self.published * len(FEED_PATHS) + i,
+                )
+                for i, path in enumerate(FEED_PATHS)
+            }
+        self._payloads = payloads
+        self.published += 1
+        logger.info(
+            "Published version %d, %d bytes",
+            self.published,
+            sum(len(p) for p in payloads.values()),
+        )
+
+    def run_publisher(self):
+        while not self._stop.wait(self.cadence):
+            self.publish()
+
+    def stop(self):
+        self._stop.set()
+
+    def respond(self, path: str) -> tuple[int, bytes]:
+        """Status and body for a request, after the configured delay."""
+        delay = self.latency + self._rng.uniform(0, self.latency_jitter)
+        if delay:
+            time.sleep(delay)
+
+        payload = self._payloads.get(path.strip("/").split("?", 1)[0])
+        if payload is None:
+            return 404, b""
+        if self._rng.random() < self.error_rate:
+            return 503, b""
+        if self._rng.random() < self.truncate_rate:
+            return 200, payload[: self._rng.randrange(len(payload))]
+        return 200, payload
+
+
+class _FeedHandler(BaseHTTPRequestHandler):
+    server: "_FeedServer"
+
+    def do_GET(self):
+        status, body = self.server.simulator.respond(self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-protobuf")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+class _FeedServer(ThreadingHTTPServer):
+    simulator: FeedSimulator
+
+
+def start_feed_simulator(
+    simulator: FeedSimulator, host: str = "127.0.0.1", port: int = 0
+) -> tuple[str, ThreadingHTTPServer]:
+    """Publish the first version of the feeds and serve them on `port` (a free
+    one by default). Returns the feed base url and the server."""
+    simulator.publish()
+    threading.Thread(target=simulator.run_publisher, daemon=True).start()
+
+    server = _FeedServer((host, port), _FeedHandler)
+    server.simulator = simulator
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://{host}:{server.server_port}/", server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stations", type=Path, default=Path("data/stations.json"))
+    parser.add_argument("--archive", type=Path, help="serve recorded cycles")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument(
+        "--scale", type=float, default=1, help="synthetic feed size multiplier"
+    )
+    parser.add_argument(
+        "--cadence", type=float, default=30, help="seconds between publishes"
+    )
+    parser.add_argument("--latency", type=float, default=0, help="response delay")
+    parser.add_argument("--jitter", type=float, default=0, help="extra random delay")
+    parser.add_argument("--error-rate", type=float, default=0, help="503 fraction")
+    parser.add_argument(
+        "--truncate-rate", type=float, default=0, help="cut short fraction"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    simulator = FeedSimulator(
+        args.stations,
+        archive_dir=args.archive,
+        scale=args.scale,
+        cadence=args.cadence,
+        latency=args.latency,
+        latency_jitter=args.jitter,
+        error_rate=args.error_rate,
+        truncate_rate=args.truncate_rate,
+    )
+    base_url, server = start_feed_simulator(simulator, args.host, args.port)
+    logger.info("Serving feeds at %s", base_url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import csv, io, json, time, zipfile
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Optional
+
+from src.mtapi.feed_archive import ArchiveReader
+from src.mtapi.mtapi import Mtapi
+from src.mtaproto import nyct_subway_pb2
+from src.mtaproto.synthetic import NYCT_FEED_ROUTES, routes_for_feed, synthetic_feed
+
+
+def shift_feed(payload: bytes, seconds: int) -> bytes:
+    """Move every timestamp in a feed by `seconds`, so recorded feeds look
+    current to Mtapi.update."""
+    message = nyct_subway_pb2.gtfs__realtime__pb2.FeedMessage()
+    message.ParseFromString(payload)
+    message.header.timestamp += seconds
+    for entity in message.entity:
+        for update in entity.trip_update.stop_time_update:
+            if update.arrival.time:
+                update.arrival.time += seconds
+            if update.departure.time:
+                update.departure.time += seconds
+    return message.SerializeToString()
+
+
+def load_fixtures(
+    stations_file: Path,
+    archive_dir: Optional[Path] = None,
+    trips_per_route: int = 40,
+) -> dict[str, bytes]:
+    """Feed url -> payload. Uses the latest cycle of a recorded archive when
+    given, otherwise synthesizes feeds from the stations file."""
+    now = int(time.time())
+
+    if archive_dir:
+        cycle = None
+        for cycle in ArchiveReader(archive_dir).cycles():
+            pass
+        if cycle is None:
+            raise ValueError(f"No archived cycles in {archive_dir}")
+        shift = now - int(cycle.started_at)
+        return {url: shift_feed(p, shift) for url, p in cycle.payloads.items()}
+
+    with open(stations_file) as f:
+        stations = json.load(f)
+    stop_ids = sorted(stop for s in stations.values() for stop in s["stops"])
+    return {
+        url: synthetic_feed(
+            stop_ids, routes_for_feed(url), now, trips_per_route, seed=i
+        )
+        for i, url in enumerate(Mtapi._FEED_URLS)
+    }
+
+
+def write_synthetic_gtfs(
+    stations_file: Path,
+    out_path: Path,
+    headway_minutes: int = 6,
+    seconds_between_stops: int = 90,
+):
+    """A static GTFS zip with every route of the synthetic feeds running
+    both ways over the stops sharing its first character, every
+    `headway_minutes` from 05:00 to 25:00, on every day around today."""
+    with open(stations_file) as f:
+        stations = json.load(f)
+    stop_ids = sorted(stop for s in stations.values() for stop in s["stops"])
+    locations = {
+        stop: loc for s in stations.values() for stop, loc in s["stops"].items()
+    }
+
+    def table(header: list[str], rows) -> str:
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+        return out.getvalue()
+
+    stops = []
+    for stop in stop_ids:
+        lat, lng = locations[stop]
+        stops.append((stop, stop, lat, lng, ""))
+        stops += [(stop + d, stop + d, lat, lng, stop) for d in "NS"]
+
+    routes = [
+        route for feed_routes in NYCT_FEED_ROUTES.values() for route in feed_routes
+    ]
+    trips = []
+    stop_times = []
+    for route in routes:
+        route_stops = [s for s in stop_ids if s[0] == route[0]][:40]
+        if len(route_stops) < 2:
+            continue
+        for direction, sequence in (("N", route_stops), ("S", route_stops[::-1])):
+            for start in range(5 * 3600, 25 * 3600, headway_minutes * 60):
+                trip_id = f"SYN-Daily_{start // 36:06d}_{route}..{direction}"
+                trips.append((route, "Daily", trip_id, int(direction == "S")))
+                for i, stop in enumerate(sequence):
+                    t = start + i * seconds_between_stops
+                    clock = f"{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}"
+                    stop_times.append((trip_id, clock, clock, stop + direction, i + 1))
+
+    today = date.today()
+    first, last = today - timedelta(days=7), today + timedelta(days=7)
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(
+            "stops.txt",
+            table(
+                ["stop_id", "stop_name", "stop_lat", "stop_lon", "parent_station"],
+                stops,
+            ),
+        )
+        z.writestr(
+            "routes.txt", table(["route_id", "route_color"], [(r, "") for r in routes])
+        )
+        z.writestr(
+            "trips.txt",
+            table(["route_id", "service_id", "trip_id", "direction_id"], trips),
+        )
+        z.writestr(
+            "calendar.txt",
+            table(
+                [
+                    "service_id",
+                    "monday",
+                    "tuesday",
+                    "wednesday",
+                    "thursday",
+                    "friday",
+                    "saturday",
+                    "sunday",
+                    "start_date",
+                    "end_date",
+                ],
+                [
+                    (
+                        "Daily",
+                        *[1] * 7,
+                        first.strftime("%Y%m%d"),
+                        last.strftime("%Y%m%d"),
+                    )
+                ],
+            ),
+        )
+        z.writestr(
+            "stop_times.txt",
+            table(
+                [
+                    "trip_id",
+                    "arrival_time",
+                    "departure_time",
+                    "stop_id",
+                    "stop_sequence",
+                ],
+                stop_times,
+            ),
+        )
@@ -0,0 +1,67 @@
+import json, math, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WALKING_METERS_PER_SECOND = 1.4
+
+
+def _meters(a: list[float], b: list[float]) -> int:
+    dlat = (b[0] - a[0]) * 111_000
+    dlng = (b[1] - a[1]) * 111_000 * math.cos(math.radians(a[0]))
+    return int(math.hypot(dlat, dlng))
+
+
+class _DistanceMatrixHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)  # type: ignore
+        query = parse_qs(urlparse(self.path.strip()).query)
+        origins = [
+            [float(v) for v in o.split(",")] for o in query["origins"][0].split("|")
+        ]
+        destinations = [
+            [float(v) for v in d.split(",")]
+            for d in query["destinations"][0].split("|")
+        ]
+        rows = []
+        for origin in origins:
+            elements = []
+            for destination in destinations:
+                meters = _meters(origin, destination)
+                seconds = int(meters / WALKING_METERS_PER_SECOND)
+                elements.append(
+                    {
+                        "distance": {"text": f"{meters} m", "value": meters},
+                        "duration": {"text": f"{seconds} s", "value": seconds},
+                        "status": "OK",
+                    }
+                )
+            rows.append({"elements": elements})
+
+        body = json.dumps(
+            {
+                "destination_addresses": ["" for _ in destinations],
+                "origin_addresses": ["" for _ in origins],
+                "rows": rows,
+                "status": "OK",
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+def start_google_maps_standin(
+    latency: float = 0,
+) -> tuple[str, ThreadingHTTPServer]:
+    """Serve a fake Distance Matrix API on a free local port. Walking times are
+    straight line distance at walking speed, answered after `latency`
+    seconds."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _DistanceMatrixHandler)
+    server.latency = latency  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/distancematrix/json", server
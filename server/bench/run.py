@@ -0,0 +1,305 @@
+"""
+Offline benchmarks for the feed ingestion and query hot paths.
+
+    uv run python -m bench.run --out bench.json
+
+Feeds come from bench.fixtures (synthetic, or the latest cycle of a recorded
+archive with --archive) and walking times from a local Distance Matrix
+stand-in, so no network access is needed. Journeys are planned over a
+synthetic timetable unless one is given with --timetable. Results are written as JSON to
+compare between commits.
+"""
+
+import argparse, json, logging, os, platform, random, statistics, subprocess, sys, time
+import tempfile, tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from bench.fixtures import load_fixtures, write_synthetic_gtfs
+from bench.google_maps_standin import start_google_maps_standin
+from src.gtfs_static.timetable import Timetable, write_timetable
+from src.journey_planner import JourneyPlanner
+from src.mtapi.mtapi import Mtapi
+from src.mtaproto.feed_scanner import scan_feed
+from src.mtaproto.feedresponse import FeedResponse
+
+CONCURRENCY = [1, 4, 16]
+
+
+def _summarize(latencies: list[float], elapsed: float) -> dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "calls": len(latencies),
+        "throughput_per_second": len(latencies) / elapsed,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def _timed(fn: Callable[[int], Any], calls: int, concurrency: int) -> dict[str, float]:
+    def call(i: int) -> float:
+        t = time.perf_counter()
+        fn(i)
+        return time.perf_counter() - t
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        latencies = [call(i) for i in range(calls)]
+    else:
+        with ThreadPoolExecutor(concurrency) as pool:
+            latencies = list(pool.map(call, range(calls)))
+    return _summarize(latencies, time.perf_counter() - start)
+
+
+def bench_feed_parse(fixtures: dict[str, bytes], rounds: int) -> dict[str, Any]:
+    out: dict[str, Any] = {}
+    for url, payload in fixtures.items():
+        name = url.rsplit("/", 1)[-1]
+        out[name] = {
+            "bytes": len(payload),
+            **_timed(lambda _: FeedResponse(payload), rounds, 1),
+            "selective": _timed(lambda _: scan_feed(payload), rounds, 1),
+        }
+    return out
+
+
+def bench_update(mtapi: Mtapi, rounds: int) -> dict[str, Any]:
+    wall = _timed(lambda _: mtapi.update(), rounds, 1)
+
+    tracemalloc.start()
+    mtapi.update()
+    current, peak = tracemalloc.get_traced_memory()
+    # What the published snapshot's stations and arrivals hold
+    stations = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(True, "*/mtapi/mtapi.py")]
+    )
+    tracemalloc.stop()
+    return {
+        **wall,
+        "retained_bytes": current,
+        "peak_bytes": peak,
+        "station_snapshot_bytes": sum(s.size for s in stations.statistics("filename")),
+    }
+
+
+def _sample_points(mtapi: Mtapi, count: int) -> list[tuple[float, float]]:
+    rng = random.Random(0)
+    stations = list(mtapi._station_info.values())
+    points: list[tuple[float, float]] = []
+    for _ in range(count):
+        lat, lng = rng.choice(stations).location
+        points.append(
+            (lat + rng.uniform(-0.005, 0.005), lng + rng.uniform(-0.005, 0.005))
+        )
+    return points
+
+
+def bench_queries(mtapi: Mtapi, calls: int) -> dict[str, Any]:
+    points = _sample_points(mtapi, 64)
+    routes = sorted(mtapi.get_routes())
+    station_ids = sorted(mtapi._stations)
+    queries: dict[str, Callable[[int], Any]] = {
+        "get_by_point": lambda i: mtapi.get_by_point(points[i % len(points)], 5),
+        "get_stations_of_route": lambda i: mtapi.get_stations_of_route(
+            routes[i % len(routes)]
+        ),
+        "get_by_id": lambda i: mtapi.get_by_id(
+            [station_ids[(i * 7 + k) % len(station_ids)] for k in range(5)]
+        ),
+    }
+    return {
+        name: {f"concurrency_{c}": _timed(fn, calls, c) for c in CONCURRENCY}
+        for name, fn in queries.items()
+    }
+
+
+def bench_journeys(
+    mtapi: Mtapi, stations_file: Path, timetable_file: Optional[Path], calls: int
+) -> dict[str, Any]:
+    if timetable_file is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            gtfs_zip = Path(tmp) / "gtfs.zip"
+            timetable_file = Path(tmp) / "timetable.bin"
+            write_synthetic_gtfs(stations_file, gtfs_zip)
+            write_timetable(gtfs_zip, timetable_file)
+            timetable = Timetable.open(timetable_file)
+    else:
+        timetable = Timetable.open(timetable_file)
+
+    planner = JourneyPlanner(timetable, mtapi)
+    rng = random.Random(0)
+    station_ids = sorted(mtapi._stations)
+    pairs = [rng.sample(station_ids, 2) for _ in range(64)]
+
+    start = time.perf_counter()
+    planner.plan({pairs[0][0]: 0}, {pairs[0][1]: 0})
+    return {
+        "first_plan_seconds": time.perf_counter() - start,
+        "stop_times": timetable.counts["stop_times"],
+        "plan": _timed(
+            lambda i: planner.plan(
+                {pairs[i % len(pairs)][0]: 0}, {pairs[i % len(pairs)][1]: 0}
+            ),
+            calls,
+            1,
+        ),
+    }
+
+
+def bench_endpoints(fixtures: dict[str, bytes], calls: int) -> dict[str, Any]:
+    from fastapi.testclient import TestClient
+
+    # main builds its Mtapi on import, so the network has to be stubbed first
+    Mtapi._fetch_mta_feed = lambda self, feed_url: fixtures.get(feed_url)  # type: ignore
+    os.environ.setdefault("GOOGLE_MAPS_API_KEY", "bench")
+    import main
+
+    standin_url, standin = start_google_maps_standin()
+    main.google_maps_service.base_url = standin_url
+    # Measured without the Distance Matrix call budget, which would turn
+    # most cache misses into degraded responses
+    main.google_maps_service.budget = None
+
+    points = _sample_points(main.mta, 64)
+    routes = sorted(main.mta.get_routes())
+    endpoints: dict[str, Callable[[TestClient, int], str]] = {
+        "/by-location": lambda c, i: c.get(
+            "/by-location",
+            params={
+                "lat": points[i % len(points)][0],
+                "lng": points[i % len(points)][1],
+            },
+        ).text,
+        "/by-location/renderable": lambda c, i: c.get(
+            "/by-location/renderable",
+            params={
+                "lat": points[i % len(points)][0],
+                "lng": points[i % len(points)][1],
+            },
+        ).text,
+        "/by-route/{route}": lambda c, i: c.get(
+            f"/by-route/{routes[i % len(routes)]}"
+        ).text,
+        "/routes": lambda c, i: c.get("/routes").text,
+    }
+
+    out: dict[str, Any] = {}
+    try:
+        for name, endpoint in endpoints.items():
+            out[name] = {}
+            for concurrency in CONCURRENCY:
+                clients = [TestClient(main.app) for _ in range(concurrency)]
+                out[name][f"concurrency_{concurrency}"] = _timed(
+                    lambda i: endpoint(clients[i % concurrency], i), calls, concurrency
+                )
+    finally:
+        standin.shutdown()
+    return out
+
+
+def bench_overload(calls: int, concurrency: int = 64) -> dict[str, Any]:
+    """/by-location/renderable under a spike of `concurrency` clients, every
+    walking time a cache miss answered in 50 ms. Requests admission control
+    sheds are summarized apart from those served. Run after bench_endpoints,
+    which imports main."""
+    from fastapi.testclient import TestClient
+    import main
+
+    standin_url, standin = start_google_maps_standin(latency=0.05)
+    main.google_maps_service.base_url = standin_url
+    main.google_maps_service.budget = None
+
+    rng = random.Random(1)
+    points = [
+        (40.6 + rng.random() * 0.2, -74.0 + rng.random() * 0.1) for _ in range(calls)
+    ]
+    clients = [TestClient(main.app) for _ in range(concurrency)]
+
+    def call(i: int) -> tuple[int, float]:
+        t = time.perf_counter()
+        status = (
+            clients[i % concurrency]
+            .get(
+                "/by-location/renderable",
+                params={"lat": points[i][0], "lng": points[i][1]},
+            )
+            .status_code
+        )
+        return status, time.perf_counter() - t
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(call, range(calls)))
+    finally:
+        standin.shutdown()
+    elapsed = time.perf_counter() - start
+
+    out: dict[str, Any] = {"concurrency": concurrency}
+    for name, statuses in (("served", {200}), ("shed", {503})):
+        latencies = [t for status, t in results if status in statuses]
+        if latencies:
+            out[name] = _summarize(latencies, elapsed)
+    out["errors"] = sum(status not in (200, 503) for status, _ in results)
+    return out
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MTAPI server offline.")
+    parser.add_argument("--stations", type=Path, default=Path("data/stations.json"))
+    parser.add_argument("--archive", type=Path, help="Recorded feed archive to use")
+    parser.add_argument("--trips-per-route", type=int, default=40)
+    parser.add_argument(
+        "--timetable", type=Path, help="Timetable for the journey planner"
+    )
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--out", type=Path, help="Defaults to stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    fixtures = load_fixtures(args.stations, args.archive, args.trips_per_route)
+    mtapi = Mtapi(args.stations, expires_seconds=0, block_on_first_update=False)
+    mtapi._fetch_mta_feed = fixtures.get  # type: ignore
+
+    results: dict[str, Any] = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "fixtures": {
+            "source": str(args.archive) if args.archive else "synthetic",
+            "feeds": len(fixtures),
+            "bytes": sum(len(p) for p in fixtures.values()),
+        },
+        "feed_parse": bench_feed_parse(fixtures, args.rounds),
+        "update": bench_update(mtapi, args.rounds),
+        "queries": bench_queries(mtapi, args.calls),
+        "journeys": bench_journeys(mtapi, args.stations, args.timetable, args.calls),
+    }
+    if not args.skip_endpoints:
+        results["endpoints"] = bench_endpoints(fixtures, args.calls)
+        results["overload"] = bench_overload(args.calls)
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        args.out.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+# Given a static GTFS zip (stops.txt, trips.txt, stop_times.txt, routes.txt), creates a packed route table
+# with each route's stop sequences, termini and color, plus the stop to parent station mapping.
+# With --timetable, also writes the packed timetable the journey planner searches.
+
+import argparse, logging, sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.gtfs_static.route_table import write_route_table
+from src.gtfs_static.schedule import load_static_schedule
+from src.gtfs_static.timetable import write_timetable
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate the binary route table for MtaSanitize server."
+    )
+    parser.add_argument("gtfs_zip", type=Path)
+    parser.add_argument("-o", "--output", type=Path, default=Path("routes.bin"))
+    parser.add_argument(
+        "--timetable", type=Path, help="Also write a packed timetable to this path"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    schedule = load_static_schedule(args.gtfs_zip)
+    write_route_table(schedule, args.output)
+    print(
+        f"Wrote {len(schedule.routes)} routes and {len(schedule.stops)} stops to {args.output}",
+        file=sys.stderr,
+    )
+
+    if args.timetable:
+        counts = write_timetable(args.gtfs_zip, args.timetable)
+        print(
+            f"Wrote {counts['trips']} trips in {counts['patterns']} patterns to {args.timetable}",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 # Given stations.csv, creates a stations.json of stop groupings where each group's lat/lon is the average of its member stops.
+# With --binary, also writes the same groupings as a packed station table the server can mmap.
 
 import argparse, csv, json, sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.mtapi.station_table import write_station_table
 
 ID_LENGTH = 4
 
@@ -10,6 +16,9 @@ def main():
         description="Generate stations JSON file for MtaSanitize server."
     )
     parser.add_argument("stations_file", default="stations.json")
+    parser.add_argument(
+        "--binary", type=Path, help="Also write a packed station table to this path"
+    )
     args = parser.parse_args()
 
     # group stations by parent_id
@@ -40,6 +49,9 @@ def main():
         ]
         stations[id] = station
 
+    if args.binary:
+        write_station_table(stations, args.binary)
+
     json.dump(stations, sys.stdout, sort_keys=True, indent=4, separators=(",", ": "))
 
 
@@ -11,22 +11,49 @@ Expose the MTA's real-time subway feed as a json api
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Literal, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from src.env_loader import DotEnvConfig
-from src.google_maps_api.google_maps_api import GoogleMapsService, TravelDelta
+from src.gtfs_static.route_table import RouteTable
+from src.google_maps_api.google_maps_api import (
+    CallBudget,
+    GoogleMapsService,
+    TravelDelta,
+)
 from src.mtapi.mtapi import (
+    MTA_FEED_BASE_URL,
     Location,
     Mtapi,
     SerializedStation,
+    StationQuery,
     Train,
 )
-import logging
-from fastapi import FastAPI, HTTPException
+from src.metrics import CONTENT_TYPE, REGISTRY, Gauge, Histogram
+from src.request_timing import (
+    TimedRoute,
+    phase,
+    record as record_phases,
+    server_timing,
+    start_request,
+)
+from src.admission import DEFAULT_ENDPOINT_CLASSES, AdmissionController, EndpointClass
+from src.profiler import SamplingProfiler
+from src.location_registry import LocationRegistry
+from src.journey_planner import Journey, JourneyPlanner, estimated_walking_seconds
+from src.isochrone import IsochroneService
+from src.gtfs_static.timetable import Timetable
+from src.response_cache import ResponseCache
+from src.mtapi.feed_archive import FeedArchiver
+from src.mtapi.feed_source import load_feed_sources
+from src.mtaproto.feedresponse import normalize_route_id
+import logging, math, signal, threading, time
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime, timedelta, timezone
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
 origins = ["*"]
@@ -40,6 +67,36 @@ app.add_middleware(
 )
 
 
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route",
+    ["method", "route", "status"],
+)
+SNAPSHOT_AGE_SECONDS = Gauge(
+    "mtapi_snapshot_age_seconds", "Seconds since the served snapshot was built"
+)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    timings = start_request() if config.request_timing else None
+    response = await call_next(request)
+    route = request.scope.get("route")
+    route_path = route.path if route else "unmatched"
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        request.method,
+        route_path,
+        str(response.status_code),
+    )
+    if timings:
+        phases = timings.finish()
+        response.headers["Server-Timing"] = server_timing(phases)
+        record_phases(route_path, phases)
+    return response
+
+
 dotenv = DotEnvConfig.load()
 
 
@@ -49,12 +106,78 @@ class Config:
     max_minutes: int = 30
     cache_seconds: int = 60
     threaded: bool = True
-    stations_file: Path = Path("./data/stations.json")
+    # When False, the server starts serving before the first feed refresh lands
+    block_on_first_update: bool = True
+    # Each snapshot is saved here and served, flagged stale, right after a
+    # restart while the first refresh runs in the background
+    checkpoint_file: Optional[Path] = None
+    # Arrivals kept per station, route and direction for headway stats. 0 disables
+    arrival_history_size: int = 32
+    # Raw feeds are archived here for replay when set
+    archive_dir: Optional[Path] = None
+    archive_partition_seconds: int = 3600
+    # Point at a local feed simulator (bench/feed_simulator.py) for offline runs
+    feed_base_url: str = MTA_FEED_BASE_URL
+    # Other agencies' GTFS-realtime feeds, see src/mtapi/feed_source.py
+    feed_sources_file: Optional[Path] = None
+    # Feed downloads slower than this count as failures for the circuit breaker
+    feed_timeout_seconds: float = 10
+    # Decode feeds in this many worker processes. 0 decodes in the server
+    decode_processes: int = 0
+    # Most locations accepted by /by-location/renderable/batch
+    max_batch_locations: int = 100
+    # Named fixed locations with precomputed walking times, see
+    # src/location_registry.py
+    locations_file: Optional[Path] = None
+    location_refresh_seconds: int = 24 * 3600
+    # First retry of walking times that couldn't be fetched, doubling after
+    location_retry_seconds: int = 60
+    # Requests of each endpoint class served at once and queued before the
+    # rest get a fast 503, see src/admission.py. Empty disables the limits
+    endpoint_classes: tuple[EndpointClass, ...] = DEFAULT_ENDPOINT_CLASSES
+    # Distance Matrix calls allowed per minute, and saved up for a burst.
+    # Past them /by-location/renderable is served without walking times. 0
+    # is unlimited
+    google_calls_per_minute: float = 120
+    google_call_burst: int = 20
+    # Longest a Distance Matrix call may take before it counts as failed
+    google_timeout_seconds: float = 5
+    # Encoded bodies of /by-route, /by-id and /routes kept per snapshot
+    response_cache_entries: int = 512
+    # A packed table from make_stations_json.py --binary, or stations.json.
+    # The stations.json beside a missing table is used instead
+    stations_file: Path = Path("./data/stations.bin")
+    # Built by data/make_route_table.py; ROUTE_MAP is used when missing
+    routes_file: Path = Path("./data/routes.bin")
+    # Built by data/make_route_table.py --timetable; /journey is disabled
+    # when missing
+    timetable_file: Path = Path("./data/timetable.bin")
+    # Minimum time to change trains within a station
+    transfer_seconds: int = 120
+    # Most trains a /journey may take, and the most its max_rides may ask for
+    max_rides: int = 5
+    # /isochrone snaps origins to square cells of this size, and keeps the
+    # results of this many (cell, minutes) pairs per snapshot
+    isochrone_cell_degrees: float = 0.002
+    isochrone_cache_entries: int = 1024
+    max_isochrone_minutes: int = 90
+    # Time the phases of every request (nearest station search, Distance
+    # Matrix calls, response building, ...), returned in a Server-Timing
+    # header and recorded in http_request_phase_seconds
+    request_timing: bool = False
+    # Enables /admin/profile and profiling on SIGUSR1
+    enable_profiler: bool = False
+    profile_dir: Path = Path("./profiles")
+    profile_seconds: int = 30
 
 
 # Override this config
 config = Config(max_trains=1)
 
+if config.request_timing:
+    # Routes declared from here on mark when their endpoint returns
+    app.router.route_class = TimedRoute
+
 # set debug logging
 if app.debug:
     logging.basicConfig(
@@ -63,12 +186,45 @@ if app.debug:
     )
 
 
+def _stations_file(stations_file: Path) -> Path:
+    if stations_file.suffix == ".bin" and not stations_file.exists():
+        fallback = stations_file.with_suffix(".json")
+        logger.warning("No station table at %s, using %s", stations_file, fallback)
+        return fallback
+    return stations_file
+
+
+def open_route_table(routes_file: Path) -> Optional[RouteTable]:
+    try:
+        return RouteTable.open(routes_file)
+    except FileNotFoundError:
+        logger.warning("No route table at %s, using ROUTE_MAP", routes_file)
+        return None
+
+
+route_table = open_route_table(config.routes_file)
+
 mta = Mtapi(
-    stations_file=config.stations_file,
+    stations_file=_stations_file(config.stations_file),
     max_trains=config.max_trains,
     max_minutes=config.max_minutes,
     expires_seconds=config.cache_seconds,
     threaded=config.threaded,
+    block_on_first_update=config.block_on_first_update,
+    history_size=config.arrival_history_size,
+    archiver=(
+        FeedArchiver(config.archive_dir, config.archive_partition_seconds)
+        if config.archive_dir
+        else None
+    ),
+    feed_timeout=config.feed_timeout_seconds,
+    decode_processes=config.decode_processes,
+    checkpoint_file=config.checkpoint_file,
+    feed_base_url=config.feed_base_url,
+    feed_sources=(
+        load_feed_sources(config.feed_sources_file) if config.feed_sources_file else ()
+    ),
+    route_table=route_table,
 )
 
 
@@ -89,6 +245,9 @@ class StationWithDistanceResponse(StationResponse):
 class WrappedResponse[T: StationResponse](BaseModel):
     data: list[T]
     last_updated: datetime
+    # Every feed was served from its last good data, such as the checkpoint
+    # restored on start up, rather than fetched by the latest refresh
+    stale: bool = False
 
 
 class CloseTrain(BaseModel):
@@ -113,6 +272,34 @@ class CloseTrain(BaseModel):
 class CloseTrains(BaseModel):
     close_trains: list[CloseTrain]
     last_updated: datetime
+    # Some walking times were left out because the Distance Matrix budget is
+    # spent; those trains have no when_to_leave
+    degraded: bool = False
+
+
+class LocationRequest(BaseModel):
+    lat: float
+    lng: float
+
+
+class BatchLocationsRequest(BaseModel):
+    locations: list[LocationRequest] = Field(max_length=config.max_batch_locations)
+
+
+class BatchCloseTrains(BaseModel):
+    results: list[CloseTrains]
+
+
+class LocationResponse(BaseModel):
+    id: str
+    name: str
+    lat: float
+    lng: float
+    walking_times_ready: bool
+
+
+class LocationsResponse(BaseModel):
+    locations: list[LocationResponse]
 
 
 class RoutesResponse(BaseModel):
@@ -120,7 +307,194 @@ class RoutesResponse(BaseModel):
     last_updated: datetime
 
 
-google_maps_service = GoogleMapsService(dotenv.GOOGLE_MAPS_API_KEY)
+class HeadwayStatsResponse(BaseModel):
+    station_id: str
+    route: str
+    direction: str
+    samples: int
+    mean_headway_seconds: Optional[float]
+    headway_stdev_seconds: Optional[float]
+    mean_drift_seconds: Optional[float]
+    last_arrival: datetime
+
+
+class HeadwaysResponse(BaseModel):
+    data: list[HeadwayStatsResponse]
+    last_updated: datetime
+
+
+class ProfileResponse(BaseModel):
+    running: bool
+    path: Optional[str]
+    seconds_remaining: Optional[float]
+
+
+class UnknownStopResponse(BaseModel):
+    stop_id: str
+    total: int
+    last_refresh: int
+    last_seen: datetime
+
+
+class UnknownStopsResponse(BaseModel):
+    data: list[UnknownStopResponse]
+    last_updated: datetime
+
+
+class FeedStatusResponse(BaseModel):
+    feed: str
+    source: str
+    state: str
+    consecutive_failures: int
+    retry_in: Optional[float]
+    feed_time: Optional[datetime]
+    last_success: Optional[datetime]
+    stale: bool
+
+
+class FeedsResponse(BaseModel):
+    data: list[FeedStatusResponse]
+    last_updated: datetime
+
+
+class TripStopResponse(BaseModel):
+    station_id: str
+    name: str
+    time: datetime
+
+
+class TripResponse(BaseModel):
+    trip_id: str
+    route: str
+    direction: str
+    next_stop: Optional[TripStopResponse]
+    stops: list[TripStopResponse]
+    last_updated: datetime
+
+
+class TravelTimeResponse(BaseModel):
+    trip_id: str
+    origin: str
+    destination: str
+    departure_time: datetime
+    arrival_time: datetime
+    travel_time_seconds: float
+    last_updated: datetime
+
+
+class JourneyLegResponse(BaseModel):
+    mode: Literal["walk", "ride"]
+    from_station: Optional[str]
+    from_name: Optional[str]
+    to_station: Optional[str]
+    to_name: Optional[str]
+    departure: datetime
+    arrival: datetime
+    route: Optional[str]
+    trip_id: Optional[str]
+    realtime: bool
+
+
+class JourneyResponse(BaseModel):
+    departure: datetime
+    arrival: datetime
+    duration_seconds: float
+    rides: int
+    legs: list[JourneyLegResponse]
+
+
+class JourneysResponse(BaseModel):
+    data: list[JourneyResponse]
+    last_updated: datetime
+
+
+class ReachableStationResponse(BaseModel):
+    id: str
+    name: str
+    lat: float
+    lng: float
+    minutes: float
+    walk_only: bool
+
+
+class IsochroneResponse(BaseModel):
+    # Center of the cell the search started from
+    lat: float
+    lng: float
+    minutes: int
+    data: list[ReachableStationResponse]
+    last_updated: datetime
+
+
+google_maps_service = GoogleMapsService(
+    dotenv.GOOGLE_MAPS_API_KEY,
+    budget=(
+        CallBudget(config.google_calls_per_minute, config.google_call_burst)
+        if config.google_calls_per_minute
+        else None
+    ),
+    timeout=config.google_timeout_seconds,
+)
+
+admission = AdmissionController(config.endpoint_classes)
+
+response_cache = ResponseCache(config.response_cache_entries)
+
+location_registry = LocationRegistry(
+    (
+        LocationRegistry.load_locations(config.locations_file)
+        if config.locations_file
+        else {}
+    ),
+    mta,
+    google_maps_service,
+    refresh_seconds=config.location_refresh_seconds,
+    retry_seconds=config.location_retry_seconds,
+)
+if location_registry.locations:
+    location_registry.start()
+
+
+def load_journey_planner(timetable_file: Path) -> Optional[JourneyPlanner]:
+    try:
+        timetable = Timetable.open(timetable_file)
+    except FileNotFoundError:
+        logger.warning("No timetable at %s, /journey is disabled", timetable_file)
+        return None
+    return JourneyPlanner(
+        timetable,
+        mta,
+        transfer_seconds=config.transfer_seconds,
+        max_rides=config.max_rides,
+    )
+
+
+journey_planner = load_journey_planner(config.timetable_file)
+
+isochrones = IsochroneService(
+    mta, config.isochrone_cell_degrees, config.isochrone_cache_entries
+)
+
+SNAPSHOT_AGE_SECONDS.set_function(
+    lambda: (datetime.now(timezone.utc) - mta.last_update()).total_seconds()
+)
+
+profiler = SamplingProfiler(config.profile_dir)
+
+
+def _toggle_profiler(signum, frame):
+    if profiler.is_running():
+        threading.Thread(target=profiler.stop, daemon=True).start()
+    else:
+        profiler.start(config.profile_seconds)
+
+
+if config.enable_profiler:
+    try:
+        signal.signal(signal.SIGUSR1, _toggle_profiler)
+    except (AttributeError, ValueError):
+        # No SIGUSR1 on Windows, and handlers can only be set on the main thread
+        logger.warning("Couldn't install the SIGUSR1 profiler handler")
 
 
 @app.get("/")
@@ -131,9 +505,90 @@ def index():
     }
 
 
-@app.get("/by-location")
-def by_location(lat: float, lng: float) -> WrappedResponse[StationWithDistanceResponse]:
-    nearby_stations = mta.get_by_point((lat, lng), 5)
+@app.get("/metrics")
+def metrics() -> Response:
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+def _profile_status() -> ProfileResponse:
+    running = profiler.is_running()
+    return ProfileResponse(
+        running=running,
+        path=str(profiler.out_path) if profiler.out_path else None,
+        seconds_remaining=(
+            max(profiler.deadline - time.monotonic(), 0)
+            if running and profiler.deadline
+            else None
+        ),
+    )
+
+
+@app.get("/admin/profile")
+def profile_status() -> ProfileResponse:
+    if not config.enable_profiler:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    return _profile_status()
+
+
+@app.post("/admin/profile")
+def start_profile(seconds: float = 30) -> ProfileResponse:
+    if not config.enable_profiler:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    if not 0 < seconds <= 600:
+        raise HTTPException(status_code=422, detail="seconds must be in (0, 600]")
+    if not profiler.start(seconds):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return _profile_status()
+
+
+@app.delete("/admin/profile")
+def stop_profile() -> ProfileResponse:
+    if not config.enable_profiler:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    profiler.stop()
+    return _profile_status()
+
+
+def station_query(
+    routes: Optional[str] = None,
+    direction: Optional[Literal["N", "S"]] = None,
+    horizon_minutes: Optional[int] = Query(None, ge=0),
+) -> Optional[StationQuery]:
+    """Query parameters narrowing the trains returned by the station
+    endpoints. `routes` is comma separated."""
+    if routes is None and direction is None and horizon_minutes is None:
+        return None
+    return StationQuery(
+        routes=(
+            frozenset(normalize_route_id(r.strip().upper()) for r in routes.split(","))
+            if routes
+            else None
+        ),
+        direction=direction,
+        horizon=(
+            timedelta(minutes=horizon_minutes) if horizon_minutes is not None else None
+        ),
+    )
+
+
+def _walking_times_unavailable() -> HTTPException:
+    if google_maps_service.budget and google_maps_service.budget_exhausted():
+        retry_after = google_maps_service.budget.seconds_until_available()
+        return HTTPException(
+            status_code=503,
+            detail="Walking times are unavailable, try again shortly",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    return HTTPException(status_code=500, detail="Could not fetch any walking times")
+
+
+@app.get("/by-location", dependencies=[Depends(admission.limit("walking"))])
+def by_location(
+    lat: float, lng: float, query: Optional[StationQuery] = Depends(station_query)
+) -> WrappedResponse[StationWithDistanceResponse]:
+    nearby_stations = mta.get_by_point((lat, lng), 5, query)
+    if not nearby_stations:
+        return WrappedResponse(data=[], last_updated=mta.last_update())
 
     travel_destinations: list[Location] = [
         (station["lat"], station["lng"]) for station in nearby_stations
@@ -145,11 +600,12 @@ def by_location(lat: float, lng: float) -> WrappedResponse[StationWithDistanceRe
     )
 
     if not any(walking_times):
-        raise HTTPException(status_code=500, detail="Could not fetch any walking times")
+        raise _walking_times_unavailable()
 
-    output: WrappedResponse[StationWithDistanceResponse] = (
-        _wrap_station_data_with_last_updated_time(nearby_stations, (lat, lng), walking_times)  # type: ignore
-    )
+    with phase("station_responses"):
+        output: WrappedResponse[StationWithDistanceResponse] = (
+            _wrap_station_data_with_last_updated_time(nearby_stations, (lat, lng), walking_times)  # type: ignore
+        )
 
     return output
 
@@ -323,27 +779,76 @@ ROUTE_MAP: dict[str, Route] = {
 }
 
 
+def load_route_map(route_table: Optional[RouteTable]) -> dict[str, Route]:
+    """Overlay colors and termini from the static GTFS route table onto the
+    hand-kept ROUTE_MAP."""
+    route_map = dict(ROUTE_MAP)
+    if not route_table:
+        return route_map
+
+    for route_id in route_table.route_ids():
+        record = route_table.get(route_id)
+        if not record:
+            continue
+        route_id = normalize_route_id(route_id)
+        fallback = route_map.get(route_id)
+        route_map[route_id] = Route(
+            color=record.color or (fallback.color if fallback else GREY),
+            final_northbound_stop=record.termini.get("N")
+            or (fallback.final_northbound_stop if fallback else ""),
+            final_southbound_stop=record.termini.get("S")
+            or (fallback.final_southbound_stop if fallback else ""),
+        )
+
+    return route_map
+
+
+route_map = load_route_map(route_table)
+
+# Routes missing from route_map that have been logged
+_unmapped_routes: set[str] = set()
+
+
+def _route_data(route: str, trip_id: str) -> Route:
+    """The route's entry in route_map. Routes missing from it, such as other
+    agencies' or SI without a route table, get a neutral color and the last
+    stop of the train's own trip as their terminus."""
+    route_data = route_map.get(route)
+    if route_data:
+        return route_data
+
+    if route not in _unmapped_routes:
+        _unmapped_routes.add(route)
+        logger.warning("Route %s is not in the route map, using defaults", route)
+    timeline = mta.get_trip(trip_id)
+    terminus = (
+        mta.get_station_name(timeline.station_ids[-1])
+        if timeline and timeline.station_ids
+        else ""
+    )
+    return Route(
+        color=GREY, final_northbound_stop=terminus, final_southbound_stop=terminus
+    )
+
+
 def compute_when_to_leave(
     train_arrival_time: datetime, walking_time_seconds: float
 ) -> datetime:
     return train_arrival_time - timedelta(seconds=walking_time_seconds, minutes=1)
 
 
-@app.get("/by-location/renderable")
-def by_location_renderable(lat: float, lng: float) -> CloseTrains:
-    nearby_stations = mta.get_by_point((lat, lng), 5)
-
-    travel_destinations: list[Location] = [
-        (station["lat"], station["lng"]) for station in nearby_stations
-    ]
-
-    # Find walking time
-    walking_times: list[TravelDelta | None] = google_maps_service.walking_times(
-        (lat, lng), travel_destinations
-    )
-
+def _close_trains(
+    nearby_stations: list[SerializedStation],
+    walking_times: list[TravelDelta | None],
+    degraded: bool = False,
+) -> CloseTrains:
+    """Trains the user can still walk to. When `degraded`, trains at
+    stations without a walking time are kept, without when_to_leave."""
+    now = datetime.now(timezone.utc)
     close_trains: list[CloseTrain] = []
-    last_updated = nearby_stations[0]["last_update"]
+    last_updated = (
+        nearby_stations[0]["last_update"] if nearby_stations else mta.last_update()
+    )
     for station_index, nearby_station in enumerate(nearby_stations):
         if nearby_station["last_update"] > last_updated:
             last_updated = nearby_station["last_update"]
@@ -355,11 +860,7 @@ def by_location_renderable(lat: float, lng: float) -> CloseTrains:
             # Find the soonest train I can make
             for train in trains:
                 route = train["name"]
-                if route not in ROUTE_MAP:
-                    raise HTTPException(
-                        500, f"Route '{train["name"]}' not found in ROUTE_TO_COLOR_MAP"
-                    )
-                route_data = ROUTE_MAP[route]
+                route_data = _route_data(route, train["trip_id"])
                 route_color = route_data.color
 
                 final_stop = (
@@ -377,7 +878,10 @@ def by_location_renderable(lat: float, lng: float) -> CloseTrains:
                     walking_time_seconds = None
                     when_to_leave = None
 
-                if not when_to_leave or when_to_leave < datetime.now(timezone.utc):
+                if when_to_leave is None and degraded:
+                    if train["time"] < now:
+                        continue
+                elif not when_to_leave or when_to_leave < now:
                     continue
 
                 close_train = CloseTrain(
@@ -397,32 +901,391 @@ def by_location_renderable(lat: float, lng: float) -> CloseTrains:
 
     # TODO: Order by relevence
 
-    return CloseTrains(close_trains=close_trains, last_updated=last_updated)
+    return CloseTrains(
+        close_trains=close_trains, last_updated=last_updated, degraded=degraded
+    )
+
+
+@app.get("/by-location/renderable", dependencies=[Depends(admission.limit("walking"))])
+def by_location_renderable(
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    location_id: Optional[str] = None,
+) -> CloseTrains:
+    if location_id is not None:
+        if location_id not in location_registry.locations:
+            raise HTTPException(status_code=404, detail="Location not found")
+        precomputed = location_registry.walking_times(location_id)
+        if precomputed:
+            station_ids, walking_times = precomputed
+            stations = mta.get_by_id(station_ids)
+            degraded = False
+            if not all(walking_times):
+                # Missing from the last refresh; those fetched since are cached
+                walking_times = google_maps_service.walking_times(
+                    location_registry.locations[location_id].location,
+                    [(station["lat"], station["lng"]) for station in stations],
+                )
+                degraded = not all(walking_times) and google_maps_service.unavailable()
+            with phase("close_trains"):
+                return _close_trains(stations, walking_times, degraded)
+        # Walking times aren't computed yet
+        lat, lng = location_registry.locations[location_id].location
+    elif lat is None or lng is None:
+        raise HTTPException(
+            status_code=422, detail="Either lat and lng or location_id is required"
+        )
+
+    nearby_stations = mta.get_by_point((lat, lng), 5)
+
+    travel_destinations: list[Location] = [
+        (station["lat"], station["lng"]) for station in nearby_stations
+    ]
+
+    # Find walking time
+    walking_times: list[TravelDelta | None] = google_maps_service.walking_times(
+        (lat, lng), travel_destinations
+    )
+
+    degraded = not all(walking_times) and google_maps_service.unavailable()
+    with phase("close_trains"):
+        return _close_trains(nearby_stations, walking_times, degraded)
+
+
+@app.get("/locations")
+def locations() -> LocationsResponse:
+    return LocationsResponse(
+        locations=[
+            LocationResponse(
+                id=l.id,
+                name=l.name,
+                lat=l.location[0],
+                lng=l.location[1],
+                walking_times_ready=location_registry.walking_times(l.id) is not None,
+            )
+            for l in location_registry.locations.values()
+        ]
+    )
 
 
-@app.get("/by-route/{route}")
-def by_route(route: str) -> WrappedResponse[StationResponse]:
+@app.post(
+    "/by-location/renderable/batch",
+    dependencies=[Depends(admission.limit("walking"))],
+)
+def by_location_renderable_batch(batch: BatchLocationsRequest) -> BatchCloseTrains:
+    points: list[Location] = [(l.lat, l.lng) for l in batch.locations]
+    nearby_stations = mta.get_by_points(points, 5)
+
+    # Walking times of every location are resolved together
+    walking_times = google_maps_service.walking_times_batch(
+        [
+            (point, [(station["lat"], station["lng"]) for station in stations])
+            for point, stations in zip(points, nearby_stations)
+        ]
+    )
+
+    unavailable = google_maps_service.unavailable()
+    with phase("close_trains"):
+        results = [
+            _close_trains(stations, times, degraded=unavailable and not all(times))
+            for stations, times in zip(nearby_stations, walking_times)
+        ]
+    return BatchCloseTrains(results=results)
+
+
+def _cached_response(request: Request, render: Callable[[], BaseModel]) -> Response:
+    mta.refresh_if_expired()
+    return response_cache.respond(request, mta.generation(), render)
+
+
+@app.get(
+    "/by-route/{route}",
+    response_model=WrappedResponse[StationResponse],
+    dependencies=[Depends(admission.limit("stations"))],
+)
+def by_route(
+    request: Request,
+    route: str,
+    query: Optional[StationQuery] = Depends(station_query),
+) -> Response:
     route = route.upper()
-    try:
-        data = mta.get_stations_of_route(route)
-        return _wrap_station_data_with_last_updated_time(data)
-    except KeyError:
-        raise HTTPException(status_code=404, detail="Station not found")
 
+    def render() -> WrappedResponse[StationResponse]:
+        try:
+            data = mta.get_stations_of_route(route, query)
+            return _wrap_station_data_with_last_updated_time(data)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Station not found")
+
+    return _cached_response(request, render)
+
+
+@app.get(
+    "/by-id/{id_string}",
+    response_model=WrappedResponse[StationResponse],
+    dependencies=[Depends(admission.limit("stations"))],
+)
+def by_index(
+    request: Request,
+    id_string: str,
+    query: Optional[StationQuery] = Depends(station_query),
+) -> Response:
+    def render() -> WrappedResponse[StationResponse]:
+        try:
+            data = mta.get_by_id(id_string.split(","), query)
+            return _wrap_station_data_with_last_updated_time(data)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Station not found")
+
+    return _cached_response(request, render)
+
+
+@app.get(
+    "/routes",
+    response_model=RoutesResponse,
+    dependencies=[Depends(admission.limit("stations"))],
+)
+def routes(request: Request) -> Response:
+    return _cached_response(
+        request,
+        lambda: RoutesResponse(
+            routes=sorted(mta.get_routes()), last_updated=mta.last_update()
+        ),
+    )
+
+
+@app.get("/trips/{trip_id}", dependencies=[Depends(admission.limit("stations"))])
+def trip(trip_id: str) -> TripResponse:
+    timeline = mta.get_trip(trip_id)
+    if not timeline:
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+    stops = [
+        TripStopResponse(
+            station_id=stop.station_id,
+            name=mta.get_station_name(stop.station_id),
+            time=datetime.fromtimestamp(stop.epoch, timezone.utc),
+        )
+        for stop in timeline.stops()
+    ]
+    next_stop = timeline.next_stop_index(int(datetime.now(timezone.utc).timestamp()))
+    return TripResponse(
+        trip_id=timeline.trip_id,
+        route=timeline.route_id,
+        direction=timeline.direction,
+        next_stop=stops[next_stop] if next_stop is not None else None,
+        stops=stops,
+        last_updated=mta.last_update(),
+    )
+
+
+@app.get(
+    "/trips/{trip_id}/travel-time",
+    dependencies=[Depends(admission.limit("stations"))],
+)
+def trip_travel_time(trip_id: str, origin: str, destination: str) -> TravelTimeResponse:
+    times = mta.get_travel_time(trip_id, origin, destination)
+    if not times:
+        raise HTTPException(
+            status_code=404,
+            detail="Trip does not stop at origin and then destination",
+        )
+
+    departure_time, arrival_time = times
+    return TravelTimeResponse(
+        trip_id=trip_id,
+        origin=origin,
+        destination=destination,
+        departure_time=departure_time,
+        arrival_time=arrival_time,
+        travel_time_seconds=(arrival_time - departure_time).total_seconds(),
+        last_updated=mta.last_update(),
+    )
 
-@app.get("/by-id/<id_string>")
-def by_index(ids: list[str]):
-    try:
-        data = mta.get_by_id(ids)
-        return _wrap_station_data_with_last_updated_time(data)
-    except KeyError:
-        raise HTTPException(status_code=404, detail="Station not found")
+
+def _journey_end(
+    station: Optional[str], lat: Optional[float], lng: Optional[float], end: str
+) -> dict[str, int]:
+    """Station id -> walking seconds for one end of a journey, given either a
+    station or a point."""
+    if station is not None:
+        return {station: 0}
+    if lat is None or lng is None:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Give either {end}_station or {end}_lat and {end}_lng",
+        )
+
+    station_ids = mta.get_nearest_station_ids((lat, lng), 5)
+    locations = [mta.get_station_location(id) for id in station_ids]
+    walking_times = google_maps_service.walking_times((lat, lng), locations)
+    # Stations Distance Matrix has no time for are estimated
+    return {
+        id: (
+            int(walking_time.duration.total_seconds())
+            if walking_time
+            else estimated_walking_seconds((lat, lng), location)
+        )
+        for id, location, walking_time in zip(station_ids, locations, walking_times)
+    }
+
+
+def _journey_response(journey: Journey) -> JourneyResponse:
+    return JourneyResponse(
+        departure=journey.departure,
+        arrival=journey.arrival,
+        duration_seconds=(journey.arrival - journey.departure).total_seconds(),
+        rides=journey.rides,
+        legs=[
+            JourneyLegResponse(
+                mode=leg.mode,
+                from_station=leg.from_station,
+                from_name=(
+                    mta.get_station_name(leg.from_station)
+                    if leg.from_station and mta.has_station(leg.from_station)
+                    else None
+                ),
+                to_station=leg.to_station,
+                to_name=(
+                    mta.get_station_name(leg.to_station)
+                    if leg.to_station and mta.has_station(leg.to_station)
+                    else None
+                ),
+                departure=leg.departure,
+                arrival=leg.arrival,
+                route=leg.route,
+                trip_id=leg.trip_id,
+                realtime=leg.realtime,
+            )
+            for leg in journey.legs
+        ],
+    )
 
 
-@app.get("/routes")
-def routes() -> RoutesResponse:
-    return RoutesResponse(
-        routes=sorted(mta.get_routes()), last_updated=mta.last_update()
+@app.get("/journey", dependencies=[Depends(admission.limit("planning"))])
+def journey(
+    from_station: Optional[str] = None,
+    from_lat: Optional[float] = None,
+    from_lng: Optional[float] = None,
+    to_station: Optional[str] = None,
+    to_lat: Optional[float] = None,
+    to_lng: Optional[float] = None,
+    depart_at: Optional[datetime] = None,
+    max_rides: Optional[int] = Query(None, ge=1, le=config.max_rides),
+) -> JourneysResponse:
+    if journey_planner is None:
+        raise HTTPException(status_code=503, detail="No timetable loaded")
+
+    # Before any walking times are fetched for the other end
+    for station_id in (from_station, to_station):
+        if station_id is not None and not mta.has_station(station_id):
+            raise HTTPException(status_code=404, detail="Station not found")
+    origins = _journey_end(from_station, from_lat, from_lng, "from")
+    destinations = _journey_end(to_station, to_lat, to_lng, "to")
+
+    with phase("journey_plan"):
+        journeys = journey_planner.plan(origins, destinations, depart_at, max_rides)
+    if not journeys:
+        raise HTTPException(status_code=404, detail="No journey found")
+    return JourneysResponse(
+        data=[_journey_response(j) for j in journeys],
+        last_updated=mta.last_update(),
+    )
+
+
+@app.get("/isochrone", dependencies=[Depends(admission.limit("planning"))])
+def isochrone(lat: float, lng: float, minutes: int = 30) -> IsochroneResponse:
+    if not 0 < minutes <= config.max_isochrone_minutes:
+        raise HTTPException(
+            status_code=422,
+            detail=f"minutes must be in (0, {config.max_isochrone_minutes}]",
+        )
+
+    with phase("isochrone"):
+        reachable = isochrones.reachable(lat, lng, minutes * 60)
+    center_lat, center_lng = isochrones.cell_center(lat, lng)
+    data: list[ReachableStationResponse] = []
+    for station in reachable:
+        station_lat, station_lng = mta.get_station_location(station.station_id)
+        data.append(
+            ReachableStationResponse(
+                id=station.station_id,
+                name=mta.get_station_name(station.station_id),
+                lat=station_lat,
+                lng=station_lng,
+                minutes=round(station.seconds / 60, 1),
+                walk_only=station.walk_only,
+            )
+        )
+    return IsochroneResponse(
+        lat=center_lat,
+        lng=center_lng,
+        minutes=minutes,
+        data=data,
+        last_updated=mta.last_update(),
+    )
+
+
+@app.get("/stats/headways", dependencies=[Depends(admission.limit("stations"))])
+def headways(
+    station_id: Optional[str] = None,
+    route: Optional[str] = None,
+    direction: Optional[Literal["N", "S"]] = None,
+) -> HeadwaysResponse:
+    stats = mta.get_headway_stats(
+        station_id, route.upper() if route else None, direction
+    )
+    return HeadwaysResponse(
+        data=[
+            HeadwayStatsResponse(
+                station_id=s.station_id,
+                route=s.route,
+                direction=s.direction,
+                samples=s.samples,
+                mean_headway_seconds=s.mean_headway_seconds,
+                headway_stdev_seconds=s.headway_stdev_seconds,
+                mean_drift_seconds=s.mean_drift_seconds,
+                last_arrival=datetime.fromtimestamp(s.last_arrival, timezone.utc),  # type: ignore
+            )
+            for s in stats
+        ],
+        last_updated=mta.last_update(),
+    )
+
+
+@app.get("/diagnostics/unknown-stops")
+def unknown_stops(limit: int = 20) -> UnknownStopsResponse:
+    return UnknownStopsResponse(
+        data=[
+            UnknownStopResponse(
+                stop_id=s.stop_id,
+                total=s.total,
+                last_refresh=s.last_refresh,
+                last_seen=datetime.fromtimestamp(s.last_seen, timezone.utc),
+            )
+            for s in mta.get_unknown_stops(limit)
+        ],
+        last_updated=mta.last_update(),
+    )
+
+
+@app.get("/feeds")
+def feeds() -> FeedsResponse:
+    return FeedsResponse(
+        data=[
+            FeedStatusResponse(
+                feed=f.feed,
+                source=f.source,
+                state=f.state.value,
+                consecutive_failures=f.consecutive_failures,
+                retry_in=f.retry_in,
+                feed_time=f.feed_time,
+                last_success=f.last_success,
+                stale=f.stale,
+            )
+            for f in mta.get_feed_status()
+        ],
+        last_updated=mta.last_update(),
     )
 
 
@@ -431,7 +1294,7 @@ def _wrap_station_data_with_last_updated_time(
     distance: Optional[Location] = None,
     walking_times: Optional[list[TravelDelta | None]] = None,
 ) -> WrappedResponse[StationResponse]:
-    last_updated = data[0]["last_update"]
+    last_updated = data[0]["last_update"] if data else mta.last_update()
     station_responses: list[StationResponse] = []
     for i, d in enumerate(data):
         if distance and walking_times:
@@ -455,4 +1318,8 @@ def _wrap_station_data_with_last_updated_time(
         if d["last_update"] > last_updated:
             last_updated = d["last_update"]
 
-    return WrappedResponse(data=station_responses, last_updated=last_updated)
+    return WrappedResponse(
+        data=station_responses,
+        last_updated=last_updated,
+        stale=any(d["stale"] for d in data),
+    )
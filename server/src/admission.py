@@ -0,0 +1,159 @@
+"""
+Admission control for endpoint classes.
+
+Each class serves at most `concurrency` requests at once and queues up to
+`queue` more. A request that finds the queue full, or waits in it longer
+than `queue_timeout`, is turned away right away with a 503 and Retry-After,
+so a spike sheds load at the door instead of stretching every request's
+latency until the process falls over.
+
+Limits are taken by an async dependency, on the event loop, before the
+endpoint takes a worker thread, so queued requests hold no thread.
+"""
+
+import asyncio, logging, threading, time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Iterable
+
+from fastapi import HTTPException
+
+from src.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_REQUESTS = Counter(
+    "http_admission_requests_total",
+    "Requests by endpoint class and admission result",
+    ["endpoint_class", "result"],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "http_admission_wait_seconds",
+    "Time queued requests waited for a slot",
+    ["endpoint_class"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "http_admission_in_flight", "Requests being served", ["endpoint_class"]
+)
+ADMISSION_QUEUED = Gauge(
+    "http_admission_queued", "Requests waiting for a slot", ["endpoint_class"]
+)
+
+
+@dataclass(frozen=True)
+class EndpointClass:
+    name: str
+    concurrency: int
+    queue: int
+    # Longest a request waits for a slot before it is shed
+    queue_timeout: float = 1.0
+
+
+DEFAULT_ENDPOINT_CLASSES = (
+    # Nearest station search and Distance Matrix calls
+    EndpointClass("walking", concurrency=8, queue=16),
+    # Journey planning and isochrones
+    EndpointClass("planning", concurrency=4, queue=8),
+    # Snapshot reads, mostly served from the response cache
+    EndpointClass("stations", concurrency=32, queue=64, queue_timeout=0.5),
+)
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class _Limiter:
+    """Slots and a FIFO queue of one endpoint class. A freed slot passes
+    straight to the oldest waiter, which may be on another event loop."""
+
+    def __init__(self, endpoint_class: EndpointClass):
+        self.endpoint_class = endpoint_class
+        self.active = 0
+        self._waiters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> bool:
+        name = self.endpoint_class.name
+        with self._lock:
+            if self.active < self.endpoint_class.concurrency and not self._waiters:
+                self.active += 1
+                self._report()
+                ADMISSION_REQUESTS.inc(name, "admitted")
+                return True
+            if len(self._waiters) >= self.endpoint_class.queue:
+                ADMISSION_REQUESTS.inc(name, "rejected")
+                return False
+
+            loop = asyncio.get_running_loop()
+            entry = (loop, loop.create_future())
+            self._waiters.append(entry)
+            self._report()
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(entry[1]), self.endpoint_class.queue_timeout
+            )
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                handed_over = entry not in self._waiters
+                if not handed_over:
+                    self._waiters.remove(entry)
+                    self._report()
+            if handed_over:
+                # Given a slot as the wait ended; pass it on
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            ADMISSION_REQUESTS.inc(name, "timed_out")
+            return False
+        finally:
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, name)
+
+        ADMISSION_REQUESTS.inc(name, "queued")
+        return True
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                loop, waiter = self._waiters.popleft()
+                loop.call_soon_threadsafe(_wake, waiter)
+            else:
+                self.active -= 1
+            self._report()
+
+    def _report(self):
+        name = self.endpoint_class.name
+        ADMISSION_IN_FLIGHT.set(self.active, name)
+        ADMISSION_QUEUED.set(len(self._waiters), name)
+
+
+class AdmissionController:
+    def __init__(self, endpoint_classes: Iterable[EndpointClass]):
+        self._limiters = {c.name: _Limiter(c) for c in endpoint_classes}
+
+    def limit(self, name: str) -> Callable[[], AsyncIterator[None]]:
+        """A dependency holding a slot of endpoint class `name` while the
+        request is served. Classes missing from the configuration are
+        unlimited."""
+        limiter = self._limiters.get(name)
+
+        async def admit() -> AsyncIterator[None]:
+            if limiter is None:
+                yield
+                return
+            if not await limiter.acquire():
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy, try again shortly",
+                    headers={"Retry-After": "1"},
+                )
+            try:
+                yield
+            finally:
+                limiter.release()
+
+        return admit
@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass, fields
 from pathlib import Path
 from typing import Optional
@@ -12,7 +13,8 @@ class DotEnvConfig:
     @staticmethod
     def load(dotenv_path: Optional[Path] = None) -> "DotEnvConfig":
         vals = {}
-        env = dotenv_values(dotenv_path=dotenv_path)
+        # Values in .env take precedence over the process environment
+        env = {**os.environ, **dotenv_values(dotenv_path=dotenv_path)}
         for field in fields(DotEnvConfig):
             f: Field = field  # type: ignore
             field_name = f.name  # type: ignore
@@ -1,9 +1,13 @@
 from dataclasses import dataclass
 from datetime import timedelta
 from pydantic import BaseModel
-from requests import get
+from requests import RequestException, Timeout, get
 from typing import Optional, TypeAlias
 from json import loads
+import threading, time
+
+from src.metrics import Counter, Histogram
+from src.request_timing import phase
 
 Location: TypeAlias = list[float] | tuple[float, float]
 
@@ -49,54 +53,184 @@ class DistanceMatrixResponse(BaseModel):
     ]
 
 
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+
+WALKING_TIME_LOOKUPS = Counter(
+    "google_maps_walking_time_lookups_total",
+    "Walking time lookups by cache result",
+    ["result"],
+)
+DISTANCE_MATRIX_SECONDS = Histogram(
+    "google_maps_distance_matrix_seconds", "Time to call the Distance Matrix API"
+)
+DISTANCE_MATRIX_OVER_BUDGET = Counter(
+    "google_maps_distance_matrix_over_budget_total",
+    "Distance Matrix calls skipped because the call budget was spent",
+)
+DISTANCE_MATRIX_FAILURES = Counter(
+    "google_maps_distance_matrix_failures_total",
+    "Distance Matrix calls that failed, by reason",
+    ["reason"],
+)
+
+
+# Distance Matrix request limits
+MAX_MATRIX_DIMENSION = 25
+MAX_MATRIX_ELEMENTS = 100
+
+
+def _format_locations(locations: list[Location]) -> str:
+    return "%7C".join(f"{l[0]},{l[1]}" for l in locations)
+
+
+class CallBudget:
+    """Token bucket of Distance Matrix calls: `per_minute` calls refill
+    steadily, up to `burst` saved for a spike."""
+
+    def __init__(self, per_minute: float, burst: int):
+        self._rate = per_minute / 60
+        self._burst = burst
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._refilled) * self._rate
+        )
+        self._refilled = now
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def seconds_until_available(self) -> float:
+        """0 while a call can be made now."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                return 0
+            return (1 - self._tokens) / self._rate if self._rate else float("inf")
+
+
 class GoogleMapsService:
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = DISTANCE_MATRIX_URL,
+        budget: Optional[CallBudget] = None,
+        timeout: float = 5,
+    ):
+        """Past `budget`, walking times missing from the cache are returned
+        as None instead of being fetched. A call taking longer than `timeout`
+        seconds is abandoned and counts as failed."""
         self.api_key: str = api_key
+        self.base_url: str = base_url
+        self.budget: Optional[CallBudget] = budget
+        self.timeout = timeout
+        # Whether the last Distance Matrix call failed
+        self._failing = False
         self.walking_times_cache: dict[tuple[Location, Location], TravelDelta] = {}
 
+    def _cached(self, from_: Location, to: Location) -> Optional[TravelDelta]:
+        return self.walking_times_cache.get(
+            (from_, to)
+        ) or self.walking_times_cache.get((to, from_))
+
     def walking_times(
         self, from_: tuple[float, float], tos: list[Location]
     ) -> list[Optional[TravelDelta]]:
-        out: list[TravelDelta | None] = [None] * len(tos)
-        to_find: list[Location] = []
-        for i, to in enumerate(tos):
-            if (from_, to) in self.walking_times_cache:
-                out[i] = self.walking_times_cache[(from_, to)]
-            elif (to, from_) in self.walking_times_cache:
-                out[i] = self.walking_times_cache[(to, from_)]
-            else:
-                to_find.append(to)
-
-        if not to_find:
-            return out
-
-        destination_string = ""
-        for i, destination in enumerate(to_find):
-            end = "" if i == len(to_find) - 1 else "%7C"
-            destination_string += f"{destination[0]},{destination[1]}{end}"
-
-        url = f"""
-        https://maps.googleapis.com/maps/api/distancematrix/json?origins={from_[0]},{from_[1]}&destinations={destination_string}&units=imperial&key={self.api_key}&mode=walking
-        """
-        res = get(url)
+        return self.walking_times_batch([(from_, tos)])[0]
+
+    def walking_times_batch(
+        self, lookups: list[tuple[Location, list[Location]]], refresh: bool = False
+    ) -> list[list[Optional[TravelDelta]]]:
+        """Walking times for several origins, each with its own destinations.
+        Cache misses across all origins are resolved together, in as few
+        Distance Matrix calls as its request limits allow. `refresh` fetches
+        every walking time again."""
+        missing: dict[Location, set[Location]] = {}
+        lookup_count = 0
+        for from_, tos in lookups:
+            lookup_count += len(tos)
+            for to in tos:
+                if refresh or not self._cached(from_, to):
+                    missing.setdefault(from_, set()).add(to)
+
+        miss_count = sum(len(tos) for tos in missing.values())
+        WALKING_TIME_LOOKUPS.inc("hit", amount=lookup_count - miss_count)
+        if missing:
+            WALKING_TIME_LOOKUPS.inc("miss", amount=miss_count)
+            self._resolve(missing)
+
+        return [[self._cached(from_, to) for to in tos] for from_, tos in lookups]
+
+    def _resolve(self, missing: dict[Location, set[Location]]):
+        # Every origin in a call is paired with every destination in it, so
+        # each destination chunk is only sent with the origins that need it
+        destinations = sorted(set().union(*missing.values()))
+        for i in range(0, len(destinations), MAX_MATRIX_DIMENSION):
+            chunk = destinations[i : i + MAX_MATRIX_DIMENSION]
+            chunk_set = set(chunk)
+            origins = [o for o, tos in missing.items() if not tos.isdisjoint(chunk_set)]
+            per_call = min(MAX_MATRIX_DIMENSION, MAX_MATRIX_ELEMENTS // len(chunk))
+            for j in range(0, len(origins), per_call):
+                self._fetch_matrix(origins[j : j + per_call], chunk)
+
+    def budget_exhausted(self) -> bool:
+        return bool(self.budget and self.budget.seconds_until_available())
+
+    def unavailable(self) -> bool:
+        """Whether walking times missing from the cache can't be fetched now,
+        because the budget is spent or the last call failed."""
+        return self._failing or self.budget_exhausted()
+
+    def _failed(self, reason: str):
+        DISTANCE_MATRIX_FAILURES.inc(reason)
+        self._failing = True
+
+    def _fetch_matrix(self, origins: list[Location], destinations: list[Location]):
+        if self.budget and not self.budget.try_spend():
+            DISTANCE_MATRIX_OVER_BUDGET.inc()
+            return
+
+        url = (
+            f"{self.base_url}?origins={_format_locations(origins)}"
+            f"&destinations={_format_locations(destinations)}"
+            f"&units=imperial&key={self.api_key}&mode=walking"
+        )
+        start = time.perf_counter()
+        try:
+            with phase("distance_matrix"):
+                res = get(url, timeout=self.timeout)
+        except Timeout:
+            self._failed("timeout")
+            return
+        except RequestException:
+            self._failed("error")
+            return
+        finally:
+            DISTANCE_MATRIX_SECONDS.observe(time.perf_counter() - start)
         if res.status_code != 200:
-            return out
+            self._failed("error")
+            return
 
         data = DistanceMatrixResponse.model_validate(loads(res.content.decode()))
-
-        op = 0
-        for row in data.rows:
-            for element in row.elements:
-                while out[op]:
-                    op += 1
-                if element.status != "OK":
-                    op += 1
-                else:
-                    travel_delta = TravelDelta(
+        if data.status != "OK":
+            self._failed("error")
+            return
+        self._failing = False
+
+        for from_, row in zip(origins, data.rows):
+            for to, element in zip(destinations, row.elements):
+                if element.status == "OK":
+                    self.walking_times_cache[(from_, to)] = TravelDelta(
                         timedelta(seconds=element.duration.value),
                         element.distance.value,
                     )
-                    out[op] = travel_delta
-                    self.walking_times_cache[(from_, tos[op])] = travel_delta
-
-        return out
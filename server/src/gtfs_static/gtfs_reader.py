@@ -0,0 +1,41 @@
+import csv, io
+import zipfile
+from pathlib import Path
+from typing import Iterator
+
+
+class GtfsArchive:
+    """Streams rows out of a static GTFS zip without extracting or loading
+    whole files into memory."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+
+    def __enter__(self) -> "GtfsArchive":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    def has_file(self, name: str) -> bool:
+        return name in self._zip.namelist()
+
+    def iter_columns(self, name: str, *columns: str) -> Iterator[tuple[str, ...]]:
+        """Yield the requested columns of every row in `name`. Missing optional
+        columns are yielded as empty strings."""
+        with self._zip.open(name) as raw:
+            text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+            reader = csv.reader(text)
+            try:
+                header = [h.strip() for h in next(reader)]
+            except StopIteration:
+                return
+            indexes = [header.index(c) if c in header else -1 for c in columns]
+            for row in reader:
+                if not row:
+                    continue
+                yield tuple(row[i] if 0 <= i < len(row) else "" for i in indexes)
@@ -0,0 +1,168 @@
+"""
+Packed binary route table built from a static GTFS schedule.
+
+Layout (little endian):
+    header
+    route records   fixed width, in route_id order
+    stop records    fixed width, sorted by stop_id for binary search
+    sequences       u32 indexes into the stop records
+    string pool     utf-8, referenced by (offset, length)
+"""
+
+import mmap, struct
+from bisect import bisect_left
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from src.gtfs_static.schedule import DIRECTIONS, Direction, StaticSchedule
+from src.string_pool import StringPoolWriter, read_string
+
+MAGIC = b"MRTB"
+VERSION = 1
+NO_COLOR = 0xFFFFFFFF
+
+# magic, version, route count, stop count, sequence length, pool size
+HEADER = struct.Struct("<4sHHIII")
+# route id, color, then per direction: terminus name, sequence start, sequence length
+ROUTE = struct.Struct("<IHI" + "IHIH" * len(DIRECTIONS))
+# stop id, parent station id, name
+STOP = struct.Struct("<IHIHIH")
+SEQUENCE_ENTRY = struct.Struct("<I")
+
+
+@dataclass(frozen=True)
+class RouteRecord:
+    route_id: str
+    color: Optional[str]
+    termini: dict[Direction, str]
+    stop_sequences: dict[Direction, list[str]]
+
+
+def write_route_table(schedule: StaticSchedule, out_path: Path):
+    pool = StringPoolWriter()
+
+    stop_ids = sorted(schedule.stops)
+    stop_index = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+    stop_records = bytearray()
+    for stop_id in stop_ids:
+        stop = schedule.stops[stop_id]
+        stop_records += STOP.pack(
+            *pool.add(stop_id), *pool.add(stop.parent_station), *pool.add(stop.name)
+        )
+
+    route_records = bytearray()
+    sequences: list[int] = []
+    route_ids = sorted(schedule.routes)
+    for route_id in route_ids:
+        route = schedule.routes[route_id]
+        color = int(route.color[1:], 16) if route.color else NO_COLOR
+        per_direction: list[int] = []
+        for direction in DIRECTIONS:
+            sequence = [
+                s for s in route.stop_sequences.get(direction, []) if s in stop_index
+            ]
+            terminus = route.terminus(direction)
+            name = schedule.station_name(terminus) if terminus in schedule.stops else ""
+            per_direction += [*pool.add(name), len(sequences), len(sequence)]
+            sequences += (stop_index[s] for s in sequence)
+        route_records += ROUTE.pack(*pool.add(route_id), color, *per_direction)
+
+    pool_data = pool.getvalue()
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                len(route_ids),
+                len(stop_ids),
+                len(sequences),
+                len(pool_data),
+            )
+        )
+        f.write(route_records)
+        f.write(stop_records)
+        f.write(struct.pack(f"<{len(sequences)}I", *sequences))
+        f.write(pool_data)
+    tmp_path.replace(out_path)
+
+
+class RouteTable:
+    """Read-only view over a route table file. Records are decoded on access."""
+
+    def __init__(self, buf: mmap.mmap | bytes):
+        self._buf = buf
+        magic, version, self._route_count, self._stop_count, sequence_count, _ = (
+            HEADER.unpack_from(buf, 0)
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a version %d route table" % VERSION)
+        self._routes_start = HEADER.size
+        self._stops_start = self._routes_start + self._route_count * ROUTE.size
+        self._sequences_start = self._stops_start + self._stop_count * STOP.size
+        self._pool_start = self._sequences_start + sequence_count * SEQUENCE_ENTRY.size
+        self._route_index: Optional[dict[str, int]] = None
+
+    @staticmethod
+    def open(path: Path) -> "RouteTable":
+        with open(path, "rb") as f:
+            return RouteTable(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _string(self, offset: int, length: int) -> str:
+        return read_string(self._buf, self._pool_start, offset, length)
+
+    def _stop_id(self, i: int) -> str:
+        return self._string(
+            *STOP.unpack_from(self._buf, self._stops_start + i * STOP.size)[:2]
+        )
+
+    def _stop_parent(self, i: int) -> str:
+        return self._string(
+            *STOP.unpack_from(self._buf, self._stops_start + i * STOP.size)[2:4]
+        )
+
+    def route_ids(self) -> list[str]:
+        return list(self._routes())
+
+    def _routes(self) -> dict[str, int]:
+        if self._route_index is None:
+            self._route_index = {}
+            for i in range(self._route_count):
+                offset = self._routes_start + i * ROUTE.size
+                ref = ROUTE.unpack_from(self._buf, offset)[:2]
+                self._route_index[self._string(*ref)] = offset
+        return self._route_index
+
+    def get(self, route_id: str) -> Optional[RouteRecord]:
+        offset = self._routes().get(route_id)
+        if offset is None:
+            return None
+
+        values = ROUTE.unpack_from(self._buf, offset)
+        color = values[2]
+        termini: dict[Direction, str] = {}
+        stop_sequences: dict[Direction, list[str]] = {}
+        for i, direction in enumerate(DIRECTIONS):
+            name_offset, name_length, start, length = values[3 + 4 * i : 7 + 4 * i]
+            if name_length:
+                termini[direction] = self._string(name_offset, name_length)
+            indexes = struct.unpack_from(
+                f"<{length}I",
+                self._buf,
+                self._sequences_start + start * SEQUENCE_ENTRY.size,
+            )
+            stop_sequences[direction] = [self._stop_id(s) for s in indexes]
+
+        return RouteRecord(
+            route_id=route_id,
+            color=None if color == NO_COLOR else f"#{color:06X}",
+            termini=termini,
+            stop_sequences=stop_sequences,
+        )
+
+    def parent_station(self, stop_id: str) -> Optional[str]:
+        lo = bisect_left(range(self._stop_count), stop_id, key=self._stop_id)
+        if lo < self._stop_count and self._stop_id(lo) == stop_id:
+            return self._stop_parent(lo)
+        return None
@@ -0,0 +1,124 @@
+import logging
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Literal, Optional
+
+from src.gtfs_static.gtfs_reader import GtfsArchive
+
+logger = logging.getLogger(__name__)
+
+Direction = Literal["N", "S"]
+DIRECTIONS: tuple[Direction, Direction] = ("N", "S")
+
+
+@dataclass
+class StopInfo:
+    stop_id: str
+    name: str
+    # The stop's own id when it is already a parent station
+    parent_station: str
+
+
+@dataclass
+class RoutePattern:
+    route_id: str
+    color: Optional[str]
+    # Parent station ids of the most frequently run stopping pattern
+    stop_sequences: dict[Direction, list[str]] = field(default_factory=dict)
+
+    def terminus(self, direction: Direction) -> Optional[str]:
+        sequence = self.stop_sequences.get(direction)
+        return sequence[-1] if sequence else None
+
+
+@dataclass
+class StaticSchedule:
+    stops: dict[str, StopInfo]
+    routes: dict[str, RoutePattern]
+
+    def station_name(self, stop_id: str) -> str:
+        return self.stops[self.stops[stop_id].parent_station].name
+
+
+def _direction(stop_id: str, direction_id: str) -> Direction:
+    # NYCT platform ids carry the direction as a suffix, eg. 101N
+    if stop_id[-1:] in DIRECTIONS:
+        return stop_id[-1]  # type: ignore
+    return "N" if direction_id != "1" else "S"
+
+
+def _parse_color(color: str) -> Optional[str]:
+    color = color.strip().lstrip("#")
+    if len(color) != 6:
+        return None
+    return f"#{color.upper()}"
+
+
+def load_static_schedule(gtfs_zip: Path) -> StaticSchedule:
+    with GtfsArchive(gtfs_zip) as gtfs:
+        stops: dict[str, StopInfo] = {}
+        for stop_id, name, parent in gtfs.iter_columns(
+            "stops.txt", "stop_id", "stop_name", "parent_station"
+        ):
+            stops[stop_id] = StopInfo(stop_id, name, parent or stop_id)
+
+        routes: dict[str, RoutePattern] = {}
+        for route_id, color in gtfs.iter_columns(
+            "routes.txt", "route_id", "route_color"
+        ):
+            routes[route_id] = RoutePattern(route_id, _parse_color(color))
+
+        trip_routes: dict[str, tuple[str, str]] = {}
+        for trip_id, route_id, direction_id in gtfs.iter_columns(
+            "trips.txt", "trip_id", "route_id", "direction_id"
+        ):
+            trip_routes[trip_id] = (route_id, direction_id)
+
+        patterns: defaultdict[tuple[str, Direction], Counter[tuple[str, ...]]] = (
+            defaultdict(Counter)
+        )
+        finished_trips: set[str] = set()
+        current_trip: Optional[str] = None
+        current_stops: list[tuple[int, str]] = []
+
+        def finish_trip():
+            if current_trip is None or current_trip not in trip_routes:
+                return
+            route_id, direction_id = trip_routes[current_trip]
+            current_stops.sort()
+            stations: list[str] = []
+            for _, stop_id in current_stops:
+                station = stops[stop_id].parent_station if stop_id in stops else stop_id
+                if not stations or stations[-1] != station:
+                    stations.append(station)
+            direction = _direction(current_stops[0][1], direction_id)
+            patterns[(route_id, direction)][tuple(stations)] += 1
+
+        # stop_times.txt is by far the largest file, so only the trip being
+        # read is kept in memory. This relies on rows being grouped by trip.
+        for trip_id, stop_id, stop_sequence in gtfs.iter_columns(
+            "stop_times.txt", "trip_id", "stop_id", "stop_sequence"
+        ):
+            if trip_id != current_trip:
+                finish_trip()
+                if trip_id in finished_trips:
+                    raise ValueError(
+                        f"stop_times.txt is not grouped by trip_id (trip {trip_id})"
+                    )
+                if current_trip is not None:
+                    finished_trips.add(current_trip)
+                current_trip = trip_id
+                current_stops = []
+            current_stops.append((int(stop_sequence), stop_id))
+        finish_trip()
+
+    for (route_id, direction), counter in patterns.items():
+        if route_id not in routes:
+            logger.warning("Trips reference unknown route %s", route_id)
+            routes[route_id] = RoutePattern(route_id, None)
+        # Most frequently run pattern wins, longest pattern breaks ties
+        pattern, _ = max(counter.items(), key=lambda p: (p[1], len(p[0])))
+        routes[route_id].stop_sequences[direction] = list(pattern)
+
+    return StaticSchedule(stops=stops, routes=routes)
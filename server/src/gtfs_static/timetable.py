@@ -0,0 +1,354 @@
+"""
+Packed timetable built from a static GTFS schedule, the input of the journey
+planner.
+
+Trips are grouped into patterns: trips of one route calling at the same
+sequence of parent stations. Within a pattern trips are ordered by their
+first departure and their times are stored trip by trip.
+
+Layout (little endian): a header with the count of every table, then each
+column below in order as a packed array, then the string pool.
+"""
+
+import logging, struct
+from array import array
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Optional
+
+from src.gtfs_static.gtfs_reader import GtfsArchive
+from src.string_pool import StringPoolWriter, read_string
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MTTB"
+VERSION = 1
+
+# magic, version, then the row count of each table in TABLES, pool size
+TABLES = (
+    "stops",
+    "routes",
+    "services",
+    "exceptions",
+    "patterns",
+    "pattern_stops",
+    "trips",
+    "stop_times",
+    "transfers",
+)
+HEADER = struct.Struct("<4sH" + "I" * len(TABLES) + "I")
+
+# column, typecode, table
+COLUMNS = (
+    ("stop_offsets", "I", "stops"),
+    ("stop_lengths", "H", "stops"),
+    ("route_offsets", "I", "routes"),
+    ("route_lengths", "H", "routes"),
+    ("service_offsets", "I", "services"),
+    ("service_lengths", "H", "services"),
+    # bit 0 is monday
+    ("service_weekdays", "B", "services"),
+    # yyyymmdd
+    ("service_starts", "I", "services"),
+    ("service_ends", "I", "services"),
+    ("exception_services", "I", "exceptions"),
+    ("exception_dates", "I", "exceptions"),
+    # 1 adds service on the date, 2 removes it, as in calendar_dates.txt
+    ("exception_types", "B", "exceptions"),
+    ("pattern_routes", "I", "patterns"),
+    ("pattern_stop_starts", "I", "patterns"),
+    ("pattern_stop_counts", "I", "patterns"),
+    ("pattern_trip_starts", "I", "patterns"),
+    ("pattern_trip_counts", "I", "patterns"),
+    ("pattern_time_starts", "I", "patterns"),
+    ("pattern_stops", "I", "pattern_stops"),
+    ("trip_offsets", "I", "trips"),
+    ("trip_lengths", "H", "trips"),
+    ("trip_services", "I", "trips"),
+    # Seconds after noon minus 12h of the service day, as in stop_times.txt
+    ("arrivals", "i", "stop_times"),
+    ("departures", "i", "stop_times"),
+    ("transfer_from", "I", "transfers"),
+    ("transfer_to", "I", "transfers"),
+    ("transfer_seconds", "I", "transfers"),
+)
+
+WEEKDAYS = (
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+)
+
+
+def _date_int(d: date) -> int:
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def parse_time(value: str) -> int:
+    """Seconds of a GTFS HH:MM:SS time, which may be past 24:00:00."""
+    hours, minutes, seconds = value.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+@dataclass
+class _Pattern:
+    route: int
+    stops: tuple[int, ...]
+    # (first departure, trip id, service, arrivals, departures)
+    trips: list[tuple[int, str, int, list[int], list[int]]] = field(
+        default_factory=list
+    )
+
+
+def write_timetable(gtfs_zip: Path, out_path: Path) -> dict[str, int]:
+    """Build a timetable file from a static GTFS zip. Returns the row count of
+    every table."""
+    with GtfsArchive(gtfs_zip) as gtfs:
+        parents: dict[str, str] = {}
+        for stop_id, parent in gtfs.iter_columns(
+            "stops.txt", "stop_id", "parent_station"
+        ):
+            parents[stop_id] = parent or stop_id
+
+        stop_index: dict[str, int] = {}
+        route_index: dict[str, int] = {}
+        service_index: dict[str, int] = {}
+
+        def index(table: dict[str, int], key: str) -> int:
+            i = table.get(key)
+            if i is None:
+                i = table[key] = len(table)
+            return i
+
+        services: list[tuple[int, int, int]] = []
+        if gtfs.has_file("calendar.txt"):
+            for row in gtfs.iter_columns(
+                "calendar.txt", "service_id", *WEEKDAYS, "start_date", "end_date"
+            ):
+                index(service_index, row[0])
+                weekdays = sum(1 << i for i, v in enumerate(row[1:8]) if v == "1")
+                services.append((weekdays, int(row[8]), int(row[9])))
+
+        exceptions: list[tuple[int, int, int]] = []
+        if gtfs.has_file("calendar_dates.txt"):
+            for service_id, day, exception_type in gtfs.iter_columns(
+                "calendar_dates.txt", "service_id", "date", "exception_type"
+            ):
+                if service_id not in service_index:
+                    index(service_index, service_id)
+                    services.append((0, 0, 0))
+                exceptions.append(
+                    (service_index[service_id], int(day), int(exception_type))
+                )
+
+        trips: dict[str, tuple[int, int]] = {}
+        for trip_id, route_id, service_id in gtfs.iter_columns(
+            "trips.txt", "trip_id", "route_id", "service_id"
+        ):
+            if service_id not in service_index:
+                logger.warning("Trip %s has no calendar, skipping it", trip_id)
+                continue
+            trips[trip_id] = (index(route_index, route_id), service_index[service_id])
+
+        patterns: dict[tuple[int, tuple[int, ...]], _Pattern] = {}
+        finished_trips: set[str] = set()
+        current_trip: Optional[str] = None
+        current_stops: list[tuple[int, str, int, int]] = []
+
+        def finish_trip():
+            if current_trip is None or current_trip not in trips:
+                return
+            route, service = trips[current_trip]
+            current_stops.sort()
+            stops: list[int] = []
+            arrivals: list[int] = []
+            departures: list[int] = []
+            for _, stop_id, arrival, departure in current_stops:
+                stop = index(stop_index, parents.get(stop_id, stop_id))
+                if stops and stops[-1] == stop:
+                    # Two platforms of one station, kept as a single call
+                    departures[-1] = departure
+                    continue
+                stops.append(stop)
+                arrivals.append(arrival)
+                departures.append(departure)
+            if len(stops) < 2:
+                return
+
+            key = (route, tuple(stops))
+            pattern = patterns.get(key)
+            if pattern is None:
+                pattern = patterns[key] = _Pattern(route, key[1])
+            pattern.trips.append(
+                (departures[0], current_trip, service, arrivals, departures)
+            )
+
+        # Rows must be grouped by trip, as load_static_schedule requires.
+        # Missing times (untimed stops) repeat the previous stop's.
+        last_time = 0
+        for trip_id, stop_id, stop_sequence, arrival, departure in gtfs.iter_columns(
+            "stop_times.txt",
+            "trip_id",
+            "stop_id",
+            "stop_sequence",
+            "arrival_time",
+            "departure_time",
+        ):
+            if trip_id != current_trip:
+                finish_trip()
+                if trip_id in finished_trips:
+                    raise ValueError(
+                        f"stop_times.txt is not grouped by trip_id (trip {trip_id})"
+                    )
+                if current_trip is not None:
+                    finished_trips.add(current_trip)
+                current_trip = trip_id
+                current_stops = []
+                last_time = 0
+            arrival_time = parse_time(arrival) if arrival else last_time
+            departure_time = parse_time(departure) if departure else arrival_time
+            last_time = departure_time
+            current_stops.append(
+                (int(stop_sequence), stop_id, arrival_time, departure_time)
+            )
+        finish_trip()
+
+        transfers: list[tuple[int, int, int]] = []
+        if gtfs.has_file("transfers.txt"):
+            for from_id, to_id, seconds in gtfs.iter_columns(
+                "transfers.txt", "from_stop_id", "to_stop_id", "min_transfer_time"
+            ):
+                from_stop = parents.get(from_id, from_id)
+                to_stop = parents.get(to_id, to_id)
+                if from_stop == to_stop or not seconds:
+                    continue
+                if from_stop in stop_index and to_stop in stop_index:
+                    transfers.append(
+                        (stop_index[from_stop], stop_index[to_stop], int(seconds))
+                    )
+
+    pool = StringPoolWriter()
+    columns: dict[str, array] = {name: array(code) for name, code, _ in COLUMNS}
+
+    def add_strings(prefix: str, strings):
+        for s in strings:
+            offset, length = pool.add(s)
+            columns[prefix + "_offsets"].append(offset)
+            columns[prefix + "_lengths"].append(length)
+
+    add_strings("stop", stop_index)
+    add_strings("route", route_index)
+    add_strings("service", service_index)
+    for weekdays, start, end in services:
+        columns["service_weekdays"].append(weekdays)
+        columns["service_starts"].append(start)
+        columns["service_ends"].append(end)
+    for service, day, exception_type in exceptions:
+        columns["exception_services"].append(service)
+        columns["exception_dates"].append(day)
+        columns["exception_types"].append(exception_type)
+
+    for pattern in patterns.values():
+        pattern.trips.sort()
+        columns["pattern_routes"].append(pattern.route)
+        columns["pattern_stop_starts"].append(len(columns["pattern_stops"]))
+        columns["pattern_stop_counts"].append(len(pattern.stops))
+        columns["pattern_trip_starts"].append(len(columns["trip_services"]))
+        columns["pattern_trip_counts"].append(len(pattern.trips))
+        columns["pattern_time_starts"].append(len(columns["arrivals"]))
+        columns["pattern_stops"].extend(pattern.stops)
+        for _, trip_id, service, arrivals, departures in pattern.trips:
+            add_strings("trip", (trip_id,))
+            columns["trip_services"].append(service)
+            columns["arrivals"].extend(arrivals)
+            columns["departures"].extend(departures)
+
+    for from_stop, to_stop, seconds in transfers:
+        columns["transfer_from"].append(from_stop)
+        columns["transfer_to"].append(to_stop)
+        columns["transfer_seconds"].append(seconds)
+
+    counts = {table: 0 for table in TABLES}
+    for name, _, table in COLUMNS:
+        counts[table] = len(columns[name])
+
+    pool_data = pool.getvalue()
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(
+            HEADER.pack(MAGIC, VERSION, *(counts[t] for t in TABLES), len(pool_data))
+        )
+        for name, _, _ in COLUMNS:
+            f.write(columns[name].tobytes())
+        f.write(pool_data)
+    tmp_path.replace(out_path)
+    return counts
+
+
+class Timetable:
+    """A timetable file loaded into arrays. Strings are decoded on access."""
+
+    def __init__(self, buf: bytes):
+        values = HEADER.unpack_from(buf, 0)
+        magic, version = values[:2]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a version %d timetable" % VERSION)
+        self.counts = dict(zip(TABLES, values[2:]))
+
+        pos = HEADER.size
+        for name, code, table in COLUMNS:
+            column = array(code)
+            size = column.itemsize * self.counts[table]
+            column.frombytes(buf[pos : pos + size])
+            pos += size
+            setattr(self, name, column)
+        self._pool = buf[pos:]
+
+        self.stop_ids = self._strings("stop")
+        self.route_ids = self._strings("route")
+        self.service_ids = self._strings("service")
+
+    @staticmethod
+    def open(path: Path) -> "Timetable":
+        with open(path, "rb") as f:
+            return Timetable(f.read())
+
+    def _strings(self, prefix: str) -> list[str]:
+        return [
+            read_string(self._pool, 0, offset, length)
+            for offset, length in zip(
+                getattr(self, prefix + "_offsets"), getattr(self, prefix + "_lengths")
+            )
+        ]
+
+    def trip_id(self, trip: int) -> str:
+        return read_string(
+            self._pool, 0, self.trip_offsets[trip], self.trip_lengths[trip]
+        )
+
+    def active_services(self, day: date) -> set[int]:
+        """Indexes of the services running on `day`."""
+        day_int = _date_int(day)
+        weekday = 1 << day.weekday()
+        active = {
+            i
+            for i, (weekdays, start, end) in enumerate(
+                zip(self.service_weekdays, self.service_starts, self.service_ends)
+            )
+            if weekdays & weekday and start <= day_int <= end
+        }
+        for service, exception_date, exception_type in zip(
+            self.exception_services, self.exception_dates, self.exception_types
+        ):
+            if exception_date != day_int:
+                continue
+            if exception_type == 1:
+                active.add(service)
+            elif exception_type == 2:
+                active.discard(service)
+        return active
@@ -0,0 +1,194 @@
+"""
+Isochrones: every station reachable from a point within a time budget.
+
+Stations near the point are reached on foot, at an estimated walking pace,
+and the search expands from them over the network of the current snapshot.
+Each route and direction contributes ride edges between consecutive
+stations, timed by the median of its trips' live run times, and boarding
+waits half the route's current median headway at that station. The graph is
+built once per snapshot.
+
+Results are cached per origin cell: origins are snapped to the center of a
+square cell, so nearby requests, as when panning a map, share one search.
+"""
+
+import logging, math, statistics, threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from heapq import heappop, heappush
+from typing import Optional
+
+from src.journey_planner import estimated_walking_seconds
+from src.metrics import Counter
+from src.mtapi.mtapi import Mtapi
+from src.mtapi.trip_index import TripIndex
+
+logger = logging.getLogger(__name__)
+
+ISOCHRONE_CACHE_REQUESTS = Counter(
+    "isochrone_cache_requests_total", "Isochrone requests by cache result", ["result"]
+)
+
+# Stations considered for the walk from the origin
+ACCESS_STATIONS = 8
+# Wait assumed for a route seen only once in the snapshot
+DEFAULT_HEADWAY_SECONDS = 20 * 60
+
+
+@dataclass(frozen=True)
+class ReachableStation:
+    station_id: str
+    seconds: int
+    # Reached on foot from the origin, without riding
+    walk_only: bool
+
+
+class _Network:
+    """Ride edges and boarding waits of one snapshot."""
+
+    def __init__(self, trips: TripIndex, generation: int):
+        self.generation = generation
+        run_times: defaultdict[tuple[str, str, str, str], list[int]] = defaultdict(list)
+        arrivals: defaultdict[tuple[str, str, str], list[int]] = defaultdict(list)
+        for timeline in trips:
+            line = (timeline.route_id, timeline.direction)
+            stations = timeline.station_ids
+            epochs = timeline.epochs
+            for i, station_id in enumerate(stations):
+                arrivals[(station_id, *line)].append(epochs[i])
+                if i + 1 < len(stations) and stations[i + 1] != station_id:
+                    run_times[(*line, station_id, stations[i + 1])].append(
+                        epochs[i + 1] - epochs[i]
+                    )
+
+        # (route, direction, station) -> [(next station, seconds)]
+        self.rides: defaultdict[tuple[str, str, str], list[tuple[str, int]]] = (
+            defaultdict(list)
+        )
+        # station -> [(route, direction, wait seconds)]
+        self.boardings: defaultdict[str, list[tuple[str, str, int]]] = defaultdict(list)
+        for (route, direction, from_id, to_id), seconds in run_times.items():
+            self.rides[(route, direction, from_id)].append(
+                (to_id, int(statistics.median(seconds)))
+            )
+        for (station_id, route, direction), epochs in arrivals.items():
+            if (route, direction, station_id) not in self.rides:
+                continue
+            epochs.sort()
+            gaps = [b - a for a, b in zip(epochs, epochs[1:]) if b > a]
+            headway = statistics.median(gaps) if gaps else DEFAULT_HEADWAY_SECONDS
+            self.boardings[station_id].append((route, direction, int(headway / 2)))
+
+
+class IsochroneService:
+    def __init__(
+        self,
+        mtapi: Mtapi,
+        cell_degrees: float = 0.002,
+        max_entries: int = 1024,
+    ):
+        self._mtapi = mtapi
+        self._cell_degrees = cell_degrees
+        self._max_entries = max_entries
+        self._network: Optional[_Network] = None
+        self._lock = threading.Lock()
+        # (cell, budget seconds) -> stations, for the network's generation
+        self._cache: OrderedDict[
+            tuple[tuple[int, int], int], list[ReachableStation]
+        ] = OrderedDict()
+
+    def cell_center(self, lat: float, lng: float) -> tuple[float, float]:
+        """The point every origin in the same cell is searched from."""
+        size = self._cell_degrees
+        return (
+            (math.floor(lat / size) + 0.5) * size,
+            (math.floor(lng / size) + 0.5) * size,
+        )
+
+    def _current_network(self) -> _Network:
+        generation = self._mtapi.generation()
+        network = self._network
+        if network is not None and network.generation == generation:
+            return network
+
+        # Built outside the lock, which get_trips may hold for a refresh.
+        # Concurrent requests may each build one; the newest is kept
+        network = _Network(self._mtapi.get_trips(), generation)
+        with self._lock:
+            if self._network is None or self._network.generation < generation:
+                self._network = network
+                self._cache.clear()
+            return self._network
+
+    def reachable(
+        self, lat: float, lng: float, budget_seconds: int
+    ) -> list[ReachableStation]:
+        """Stations reachable from the cell of (lat, lng) within the budget,
+        soonest first."""
+        network = self._current_network()
+        size = self._cell_degrees
+        key = ((math.floor(lat / size), math.floor(lng / size)), budget_seconds)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and network is self._network:
+                self._cache.move_to_end(key)
+                ISOCHRONE_CACHE_REQUESTS.inc("hit")
+                return cached
+        ISOCHRONE_CACHE_REQUESTS.inc("miss")
+
+        stations = self._search(network, self.cell_center(lat, lng), budget_seconds)
+        with self._lock:
+            if network is self._network:
+                self._cache[key] = stations
+                if len(self._cache) > self._max_entries:
+                    self._cache.popitem(last=False)
+        return stations
+
+    def _search(
+        self, network: _Network, origin: tuple[float, float], budget: int
+    ) -> list[ReachableStation]:
+        # Labels are either a station or a (route, direction, station) ride
+        best: dict = {}
+        walked: dict[str, int] = {}
+        heap: list[tuple[int, int, object]] = []
+        # Breaks ties between labels, which don't compare across kinds
+        order = 0
+        for station_id in self._mtapi.get_nearest_station_ids(origin, ACCESS_STATIONS):
+            seconds = estimated_walking_seconds(
+                origin, self._mtapi.get_station_location(station_id)
+            )
+            if seconds <= budget and seconds < best.get(station_id, budget + 1):
+                best[station_id] = walked[station_id] = seconds
+                heappush(heap, (seconds, order, station_id))
+                order += 1
+
+        reached: dict[str, int] = {}
+        while heap:
+            seconds, _, label = heappop(heap)
+            if seconds > best.get(label, budget):
+                continue
+            if isinstance(label, str):
+                if label in reached:
+                    continue
+                reached[label] = seconds
+                edges = [
+                    ((route, direction, label), wait)
+                    for route, direction, wait in network.boardings.get(label, ())
+                ]
+            else:
+                # Alighting is free; riding on continues the same trip
+                edges = [(label[2], 0)] + [
+                    ((label[0], label[1], to_id), run)
+                    for to_id, run in network.rides.get(label, ())
+                ]
+            for to_label, cost in edges:
+                total = seconds + cost
+                if total <= budget and total < best.get(to_label, budget + 1):
+                    best[to_label] = total
+                    heappush(heap, (total, order, to_label))
+                    order += 1
+
+        return [
+            ReachableStation(station_id, seconds, walked.get(station_id) == seconds)
+            for station_id, seconds in reached.items()
+        ]
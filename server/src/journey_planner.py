@@ -0,0 +1,543 @@
+"""
+Journey planning over the static timetable with live arrivals applied.
+
+The search is RAPTOR (Delling et al., "Round-Based Public Transit Routing"):
+round k finds the earliest arrival at every station using at most k trips,
+by scanning each pattern that calls at a station improved in round k - 1,
+then relaxing transfer footpaths. Each round whose arrival at the
+destination beats every earlier round adds a journey, so the result is the
+Pareto set of arrival time against number of trips.
+
+Planner stops are Mtapi stations, so platforms of one station complex are a
+single stop and changing between them costs `transfer_seconds`.
+
+Times are epochs. The timetable of a service day is laid out per pattern as
+one array per stop position, indexed by trip, so the earliest catchable trip
+is a bisection. Live arrivals overwrite the times of the trips they match in
+copies of the touched columns, rebuilt once per snapshot.
+"""
+
+import logging, math, threading
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Literal, Optional
+
+from src.gtfs_static.timetable import Timetable
+from src.mtapi.mtapi import Location, Mtapi
+from src.mtapi.trip_index import TripIndex, TripTimeline
+from src.mtaproto.feedresponse import TZ, normalize_route_id
+
+logger = logging.getLogger(__name__)
+
+INFINITY = 1 << 62
+
+WALKING_METERS_PER_SECOND = 1.4
+# Streets are rarely a straight line to the station
+WALKING_DETOUR = 1.3
+EARTH_RADIUS_METERS = 6_371_000
+
+
+def estimated_walking_seconds(a: Location, b: Location) -> int:
+    lat1, lng1, lat2, lng2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    meters = 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(h))
+    return int(meters * WALKING_DETOUR / WALKING_METERS_PER_SECOND)
+
+
+def static_trip_keys(trip_id: str) -> tuple[str, ...]:
+    """Keys a static trip is matched to realtime trip ids by. NYCT static ids
+    carry the realtime id after a service prefix, eg.
+    AFA23GEN-1038-Weekday-00_048850_1..S03R, and realtime ids may drop the
+    path after the direction."""
+    _, _, rest = trip_id.partition("_")
+    key = rest if ".." in rest else trip_id
+    short = realtime_short_key(key)
+    return (key, short) if short != key else (key,)
+
+
+def realtime_short_key(trip_id: str) -> str:
+    i = trip_id.find("..")
+    return trip_id[: i + 3] if i >= 0 else trip_id
+
+
+def _service_day_start(day: date) -> int:
+    # GTFS times count from noon minus 12h, which is midnight except on
+    # daylight saving changes
+    noon = TZ.localize(datetime(day.year, day.month, day.day, 12))
+    return int(noon.timestamp()) - 12 * 3600
+
+
+@dataclass
+class JourneyLeg:
+    mode: Literal["walk", "ride"]
+    # None for the journey's start or end point
+    from_station: Optional[str]
+    to_station: Optional[str]
+    departure: datetime
+    arrival: datetime
+    route: Optional[str] = None
+    trip_id: Optional[str] = None
+    # Ride times come from the live feeds rather than the timetable
+    realtime: bool = False
+
+
+@dataclass
+class Journey:
+    departure: datetime
+    arrival: datetime
+    rides: int
+    legs: list[JourneyLeg] = field(default_factory=list)
+
+
+class _DaySchedule:
+    """Every trip running on one service day, plus the previous day's trips
+    still running after midnight and the next day's early trips."""
+
+    def __init__(
+        self, timetable: Timetable, stop_nodes: list[int], node_count: int, day: date
+    ):
+        self.day = day
+        start = _service_day_start(day)
+        window = (start, start + 30 * 3600)
+        days = [
+            (timetable.active_services(d), _service_day_start(d))
+            for d in (day - timedelta(days=1), day, day + timedelta(days=1))
+        ]
+
+        self.nodes: list[list[int]] = []
+        self.routes: list[str] = []
+        # (timetable trip, service day start) of each trip, by departure
+        self.trips: list[list[tuple[int, int]]] = []
+        self.arrivals: list[list[array]] = []
+        self.departures: list[list[array]] = []
+        # Patterns where a later trip can reach a stop before an earlier one
+        self.overtaking: set[int] = set()
+        # static_trip_keys -> (pattern, trip)
+        self.trip_keys: dict[str, list[tuple[int, int]]] = {}
+
+        for p in range(timetable.counts["patterns"]):
+            stop_start = timetable.pattern_stop_starts[p]
+            n = timetable.pattern_stop_counts[p]
+            first_trip = timetable.pattern_trip_starts[p]
+            time_start = timetable.pattern_time_starts[p]
+
+            running: list[tuple[int, int, int]] = []
+            for t in range(timetable.pattern_trip_counts[p]):
+                trip = first_trip + t
+                times = time_start + t * n
+                for services, day_start in days:
+                    if timetable.trip_services[trip] not in services:
+                        continue
+                    first = day_start + timetable.departures[times]
+                    last = day_start + timetable.arrivals[times + n - 1]
+                    if last >= window[0] and first <= window[1]:
+                        running.append((first, trip, day_start))
+            if not running:
+                continue
+            running.sort()
+
+            pattern = len(self.nodes)
+            self.nodes.append(
+                [
+                    stop_nodes[s]
+                    for s in timetable.pattern_stops[stop_start : stop_start + n]
+                ]
+            )
+            self.routes.append(
+                normalize_route_id(timetable.route_ids[timetable.pattern_routes[p]])
+            )
+            self.trips.append([(trip, day_start) for _, trip, day_start in running])
+            arrival_columns = [array("q") for _ in range(n)]
+            departure_columns = [array("q") for _ in range(n)]
+            for i, (_, trip, day_start) in enumerate(running):
+                times = time_start + (trip - first_trip) * n
+                for pos in range(n):
+                    arrival_columns[pos].append(
+                        day_start + timetable.arrivals[times + pos]
+                    )
+                    departure_columns[pos].append(
+                        day_start + timetable.departures[times + pos]
+                    )
+                for key in static_trip_keys(timetable.trip_id(trip)):
+                    self.trip_keys.setdefault(key, []).append((pattern, i))
+            self.arrivals.append(arrival_columns)
+            self.departures.append(departure_columns)
+            if not _first_in_first_out(departure_columns):
+                self.overtaking.add(pattern)
+
+        # node -> (pattern, position) of every call a trip can be boarded at
+        self.patterns_by_node: list[list[tuple[int, int]]] = [
+            [] for _ in range(node_count)
+        ]
+        for pattern, nodes in enumerate(self.nodes):
+            for pos, node in enumerate(nodes[:-1]):
+                self.patterns_by_node[node].append((pattern, pos))
+
+
+def _first_in_first_out(columns: list[array]) -> bool:
+    return all(all(a <= b for a, b in zip(column, column[1:])) for column in columns)
+
+
+class _LiveSchedule:
+    """A day schedule with the live times of one snapshot. Columns of
+    patterns without live trips are shared with the day schedule."""
+
+    def __init__(
+        self, day: _DaySchedule, trips: TripIndex, node_ids: list[str], generation: int
+    ):
+        self.day = day
+        self.generation = generation
+        self.arrivals = list(day.arrivals)
+        self.departures = list(day.departures)
+        self.overtaking = set(day.overtaking)
+        # (pattern, trip) -> realtime trip id
+        self.realtime: dict[tuple[int, int], str] = {}
+
+        copied: set[int] = set()
+        for timeline in trips:
+            candidates = day.trip_keys.get(timeline.trip_id) or day.trip_keys.get(
+                realtime_short_key(timeline.trip_id)
+            )
+            if not candidates:
+                continue
+
+            # A static trip runs on several service days; the live trip is
+            # the run closest to its timetable
+            matched: Optional[tuple[int, int, list[Optional[int]]]] = None
+            smallest = INFINITY
+            for pattern, trip in candidates:
+                delays = self._delays(pattern, trip, timeline, node_ids)
+                known = next((d for d in delays if d is not None), None)
+                if known is not None and abs(known) < smallest:
+                    smallest = abs(known)
+                    matched = (pattern, trip, delays)
+            if matched is None:
+                continue
+
+            pattern, trip, delays = matched
+            if pattern not in copied:
+                copied.add(pattern)
+                self.arrivals[pattern] = [array("q", c) for c in day.arrivals[pattern]]
+                self.departures[pattern] = [
+                    array("q", c) for c in day.departures[pattern]
+                ]
+            self._apply(pattern, trip, delays)
+            self.realtime[(pattern, trip)] = timeline.trip_id
+
+        for pattern in copied:
+            if not _first_in_first_out(self.departures[pattern]):
+                self.overtaking.add(pattern)
+
+    def _delays(
+        self, pattern: int, trip: int, timeline: TripTimeline, node_ids: list[str]
+    ) -> list[Optional[int]]:
+        delays: list[Optional[int]] = []
+        after = -1
+        arrivals = self.day.arrivals[pattern]
+        for pos, node in enumerate(self.day.nodes[pattern]):
+            i = timeline.position_of(node_ids[node], after)
+            if i is None:
+                delays.append(None)
+            else:
+                delays.append(timeline.epochs[i] - arrivals[pos][trip])
+                after = i
+        return delays
+
+    def _apply(self, pattern: int, trip: int, delays: list[Optional[int]]):
+        # Stops without a live time keep the delay of the last stop before
+        # them that has one, or of the first stop after
+        delay = next(d for d in delays if d is not None)
+        arrivals = self.arrivals[pattern]
+        departures = self.departures[pattern]
+        for pos, known in enumerate(delays):
+            if known is not None:
+                delay = known
+            arrival = arrivals[pos][trip] + delay
+            arrivals[pos][trip] = arrival
+            departures[pos][trip] = max(departures[pos][trip] + delay, arrival)
+
+
+class JourneyPlanner:
+    def __init__(
+        self,
+        timetable: Timetable,
+        mtapi: Mtapi,
+        transfer_seconds: int = 120,
+        max_rides: int = 5,
+    ):
+        self._timetable = timetable
+        self._mtapi = mtapi
+        self._transfer_seconds = transfer_seconds
+        self._max_rides = max_rides
+        self._lock = threading.Lock()
+        self._days: dict[date, _DaySchedule] = {}
+        self._live: Optional[_LiveSchedule] = None
+
+        # Timetable stops of one Mtapi station share a node. Stops missing
+        # from the stations file are nodes of their own.
+        self._node_ids: list[str] = []
+        self._nodes: dict[str, int] = {}
+        self._stop_nodes: list[int] = []
+        for stop_id in timetable.stop_ids:
+            node_id = mtapi.get_station_of_stop(stop_id) or stop_id
+            node = self._nodes.get(node_id)
+            if node is None:
+                node = self._nodes[node_id] = len(self._node_ids)
+                self._node_ids.append(node_id)
+            self._stop_nodes.append(node)
+
+        footpaths: dict[tuple[int, int], int] = {}
+        for from_stop, to_stop, seconds in zip(
+            timetable.transfer_from, timetable.transfer_to, timetable.transfer_seconds
+        ):
+            key = (self._stop_nodes[from_stop], self._stop_nodes[to_stop])
+            if key[0] != key[1]:
+                footpaths[key] = min(seconds, footpaths.get(key, seconds))
+        self._footpaths: list[list[tuple[int, int]]] = [[] for _ in self._node_ids]
+        for (from_node, to_node), seconds in footpaths.items():
+            self._footpaths[from_node].append((to_node, seconds))
+
+    def _schedule(self, now: datetime) -> _LiveSchedule:
+        day = now.astimezone(TZ).date()
+        generation = self._mtapi.generation()
+        with self._lock:
+            live = self._live
+            if live and live.day.day == day and live.generation == generation:
+                return live
+
+            schedule = self._days.get(day)
+            if schedule is None:
+                schedule = _DaySchedule(
+                    self._timetable, self._stop_nodes, len(self._node_ids), day
+                )
+                # Only today's is needed, but keep yesterday's around midnight
+                self._days = {
+                    d: s for d, s in self._days.items() if d >= day - timedelta(days=1)
+                }
+                self._days[day] = schedule
+            live = self._live = _LiveSchedule(
+                schedule, self._mtapi.get_trips(), self._node_ids, generation
+            )
+            return live
+
+    def plan(
+        self,
+        origins: dict[str, int],
+        destinations: dict[str, int],
+        depart_at: Optional[datetime] = None,
+        max_rides: Optional[int] = None,
+    ) -> list[Journey]:
+        """Journeys from any of `origins` to any of `destinations`, both
+        station id -> walking seconds between the station and the end point,
+        fewest rides first. Each journey arrives earlier than every journey
+        with fewer rides."""
+        depart_at = depart_at or datetime.now(TZ)
+        if depart_at.tzinfo is None:
+            depart_at = TZ.localize(depart_at)
+        start = int(depart_at.timestamp())
+        schedule = self._schedule(depart_at)
+        day = schedule.day
+        patterns_by_node = day.patterns_by_node
+        change = self._transfer_seconds
+        rounds = min(
+            max_rides if max_rides is not None else self._max_rides, self._max_rides
+        )
+
+        size = len(self._node_ids)
+        best = [INFINITY] * size
+        arrival = [INFINITY] * size
+        ready = [INFINITY] * size
+        # Per round, node -> how its label was set: ("access", seconds),
+        # ("walk", from node, seconds) or ("ride", pattern, trip, board, alight)
+        via: list[dict[int, tuple]] = [{}]
+        arrivals: list[list[int]] = []
+
+        marked: set[int] = set()
+        for station_id, seconds in origins.items():
+            node = self._nodes.get(station_id)
+            if node is None or start + seconds >= best[node]:
+                continue
+            best[node] = arrival[node] = ready[node] = start + seconds
+            via[0][node] = ("access", seconds)
+            marked.add(node)
+        self._walk(marked, arrival, ready, best, via[0], INFINITY)
+        arrivals.append(arrival[:])
+
+        targets = [
+            (self._nodes[station_id], seconds)
+            for station_id, seconds in destinations.items()
+            if station_id in self._nodes
+        ]
+        bound = INFINITY
+        found: list[tuple[int, int, int]] = []
+        for node, seconds in targets:
+            if arrival[node] + seconds < bound:
+                bound = arrival[node] + seconds
+                found = [(0, node, bound)]
+
+        for k in range(1, rounds + 1):
+            if not marked:
+                break
+            queue: dict[int, int] = {}
+            for node in marked:
+                for pattern, pos in patterns_by_node[node]:
+                    if pos < queue.get(pattern, INFINITY):
+                        queue[pattern] = pos
+
+            previous_ready = ready[:]
+            round_via: dict[int, tuple] = {}
+            marked = set()
+            for pattern, first in queue.items():
+                nodes = day.nodes[pattern]
+                pattern_arrivals = schedule.arrivals[pattern]
+                pattern_departures = schedule.departures[pattern]
+                overtaking = pattern in schedule.overtaking
+                trip = -1
+                board = 0
+                for pos in range(first, len(nodes)):
+                    node = nodes[pos]
+                    if trip >= 0:
+                        t = pattern_arrivals[pos][trip]
+                        if t < best[node] and t < bound:
+                            best[node] = arrival[node] = t
+                            ready[node] = t + change
+                            round_via[node] = ("ride", pattern, trip, board, pos)
+                            marked.add(node)
+
+                    r = previous_ready[node]
+                    if r == INFINITY or pos == len(nodes) - 1:
+                        continue
+                    column = pattern_departures[pos]
+                    if trip >= 0 and r > column[trip]:
+                        continue
+                    if overtaking:
+                        catchable = [i for i, d in enumerate(column) if d >= r]
+                        candidate = (
+                            min(catchable, key=column.__getitem__)
+                            if catchable
+                            else len(column)
+                        )
+                    else:
+                        candidate = bisect_left(column, r)
+                    if candidate < len(column) and (
+                        trip < 0 or column[candidate] < column[trip]
+                    ):
+                        trip = candidate
+                        board = pos
+
+            self._walk(marked, arrival, ready, best, round_via, bound)
+            via.append(round_via)
+            arrivals.append(arrival[:])
+
+            for node, seconds in targets:
+                if arrival[node] + seconds < bound:
+                    bound = arrival[node] + seconds
+                    if found and found[-1][0] == k:
+                        found[-1] = (k, node, bound)
+                    else:
+                        found.append((k, node, bound))
+
+        return [
+            self._journey(schedule, via, arrivals, k, node, destinations, start)
+            for k, node, _ in found
+        ]
+
+    def _walk(self, marked, arrival, ready, best, round_via, bound):
+        """Relax footpaths from the stations reached by a ride this round."""
+        for node in list(marked):
+            for to_node, seconds in self._footpaths[node]:
+                t = arrival[node] + seconds
+                if t < best[to_node] and t < bound:
+                    best[to_node] = arrival[to_node] = ready[to_node] = t
+                    round_via[to_node] = ("walk", node, seconds)
+                    marked.add(to_node)
+
+    def _journey(
+        self,
+        schedule: _LiveSchedule,
+        via: list[dict[int, tuple]],
+        arrivals: list[list[int]],
+        k: int,
+        node: int,
+        destinations: dict[str, int],
+        start: int,
+    ) -> Journey:
+        day = schedule.day
+        node_ids = self._node_ids
+        egress = destinations[node_ids[node]]
+        end = arrivals[k][node] + egress
+
+        legs: list[JourneyLeg] = []
+        if egress:
+            legs.append(
+                JourneyLeg(
+                    "walk", node_ids[node], None, _time(end - egress), _time(end)
+                )
+            )
+
+        while True:
+            while node not in via[k]:
+                k -= 1
+            label = via[k][node]
+            if label[0] == "access":
+                if label[1]:
+                    legs.append(
+                        JourneyLeg(
+                            "walk",
+                            None,
+                            node_ids[node],
+                            _time(start),
+                            _time(start + label[1]),
+                        )
+                    )
+                break
+            if label[0] == "walk":
+                _, from_node, seconds = label
+                departure = arrivals[k][from_node]
+                legs.append(
+                    JourneyLeg(
+                        "walk",
+                        node_ids[from_node],
+                        node_ids[node],
+                        _time(departure),
+                        _time(departure + seconds),
+                    )
+                )
+                node = from_node
+                continue
+
+            _, pattern, trip, board, alight = label
+            realtime_id = schedule.realtime.get((pattern, trip))
+            board_node = day.nodes[pattern][board]
+            legs.append(
+                JourneyLeg(
+                    "ride",
+                    node_ids[board_node],
+                    node_ids[node],
+                    _time(schedule.departures[pattern][board][trip]),
+                    _time(schedule.arrivals[pattern][alight][trip]),
+                    route=day.routes[pattern],
+                    trip_id=realtime_id
+                    or self._timetable.trip_id(day.trips[pattern][trip][0]),
+                    realtime=realtime_id is not None,
+                )
+            )
+            node = board_node
+            k -= 1
+
+        legs.reverse()
+        return Journey(
+            departure=legs[0].departure if legs else _time(start),
+            arrival=_time(end),
+            rides=sum(1 for leg in legs if leg.mode == "ride"),
+            legs=legs,
+        )
+
+
+def _time(epoch: int) -> datetime:
+    return datetime.fromtimestamp(epoch, TZ)
@@ -0,0 +1,159 @@
+"""
+Named fixed locations, such as offices and kiosks, with walking times to their
+nearest stations computed ahead of time.
+
+Locations are read from a json file of the form
+{"<id>": {"name": "...", "location": [lat, lng]}}. Walking times are fetched
+for every location together in a background thread and refreshed every
+`refresh_seconds`, so requests for a registered location need neither a
+nearest station search nor a Distance Matrix call. Walking times that
+couldn't be fetched are retried after `retry_seconds`, backing off up to
+`refresh_seconds`.
+"""
+
+import json, logging, threading
+from array import array
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
+
+from src.google_maps_api.google_maps_api import GoogleMapsService, TravelDelta
+from src.mtapi.mtapi import Mtapi
+
+logger = logging.getLogger(__name__)
+
+# Stored in place of a walking time that couldn't be fetched
+MISSING = 0xFFFFFFFF
+
+
+@dataclass(frozen=True)
+class FixedLocation:
+    id: str
+    name: str
+    location: tuple[float, float]
+
+
+class _WalkingTimes:
+    __slots__ = ("station_ids", "seconds", "meters")
+
+    def __init__(
+        self, station_ids: tuple[str, ...], times: list[Optional[TravelDelta]]
+    ):
+        self.station_ids = station_ids
+        self.seconds = array(
+            "I", (int(t.duration.total_seconds()) if t else MISSING for t in times)
+        )
+        self.meters = array("I", (t.distance_meters if t else MISSING for t in times))
+
+    def travel_deltas(self) -> list[Optional[TravelDelta]]:
+        return [
+            TravelDelta(timedelta(seconds=s), m) if s != MISSING else None
+            for s, m in zip(self.seconds, self.meters)
+        ]
+
+
+class LocationRegistry:
+    def __init__(
+        self,
+        locations: dict[str, FixedLocation],
+        mtapi: Mtapi,
+        google_maps_service: GoogleMapsService,
+        stations_per_location: int = 5,
+        refresh_seconds: float = 24 * 3600,
+        retry_seconds: float = 60,
+    ):
+        self.locations = locations
+        self._mtapi = mtapi
+        self._google_maps_service = google_maps_service
+        self._stations_per_location = stations_per_location
+        self._refresh_seconds = refresh_seconds
+        self._retry_seconds = retry_seconds
+        self._walking_times: dict[str, _WalkingTimes] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def load_locations(locations_file: Path) -> dict[str, FixedLocation]:
+        with open(locations_file) as f:
+            raw = json.load(f)
+        return {
+            id: FixedLocation(id, d["name"], (d["location"][0], d["location"][1]))
+            for id, d in raw.items()
+        }
+
+    def start(self):
+        """Compute walking times now and then every `refresh_seconds`, in a
+        background thread."""
+        self._thread = threading.Thread(
+            target=self._run, name="location-registry", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        refetch = True
+        retry_seconds = self._retry_seconds
+        while not self._stop.is_set():
+            try:
+                complete = self.refresh(refetch)
+            except Exception:
+                logger.exception("Couldn't refresh fixed location walking times")
+                complete = False
+
+            if complete:
+                refetch = True
+                retry_seconds = self._retry_seconds
+                self._stop.wait(self._refresh_seconds)
+            else:
+                # Only the missing walking times are fetched on a retry
+                refetch = False
+                self._stop.wait(min(retry_seconds, self._refresh_seconds))
+                retry_seconds *= 2
+
+    def refresh(self, refetch: bool = True) -> bool:
+        """Compute every location's walking times, fetching all of them again
+        when `refetch`, otherwise only those not cached. Returns whether none
+        are missing."""
+        station_ids = {
+            id: tuple(
+                self._mtapi.get_nearest_station_ids(
+                    l.location, self._stations_per_location
+                )
+            )
+            for id, l in self.locations.items()
+        }
+        times = self._google_maps_service.walking_times_batch(
+            [
+                (
+                    self.locations[id].location,
+                    [self._mtapi.get_station_location(s) for s in stations],
+                )
+                for id, stations in station_ids.items()
+            ],
+            refresh=refetch,
+        )
+        walking_times = {
+            id: _WalkingTimes(stations, location_times)
+            for (id, stations), location_times in zip(station_ids.items(), times)
+        }
+
+        missing = sum(w.seconds.count(MISSING) for w in walking_times.values())
+        if missing:
+            logger.warning("%d fixed location walking times missing", missing)
+
+        # Replaced whole, so readers never see a partial refresh
+        self._walking_times = walking_times
+        return not missing
+
+    def walking_times(
+        self, location_id: str
+    ) -> Optional[tuple[list[str], list[Optional[TravelDelta]]]]:
+        """Nearest station ids of a location and the walking time to each, or
+        None before the first refresh."""
+        entry = self._walking_times.get(location_id)
+        if entry is None:
+            return None
+        return list(entry.station_ids), entry.travel_deltas()
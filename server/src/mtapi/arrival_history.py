@@ -0,0 +1,183 @@
+import math, threading
+from array import array
+from dataclasses import dataclass
+from typing import Iterator, Literal, Optional, TypeAlias
+
+from src.mtapi.trip_index import TripIndex
+
+# station id, route id, direction
+HistoryKey: TypeAlias = tuple[str, str, Literal["N", "S"]]
+
+# A trip that vanishes from a station's predictions this close to (or after)
+# its last predicted arrival is taken to have arrived rather than been dropped
+ARRIVAL_GRACE_SECONDS = 120
+
+
+class RingBuffer:
+    """Fixed capacity buffer of floats. Storage grows up to `capacity` and is
+    then reused, so a series never holds more than `capacity` values."""
+
+    __slots__ = ("_values", "_capacity", "_next")
+
+    def __init__(self, capacity: int):
+        self._values: array[float] = array("d")
+        self._capacity = capacity
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __iter__(self) -> Iterator[float]:
+        """Oldest to newest."""
+        if len(self._values) < self._capacity:
+            return iter(self._values)
+        return iter(self._values[self._next :] + self._values[: self._next])
+
+    def push(self, value: float) -> Optional[float]:
+        """Append `value`, returning the value it evicted, if any."""
+        if len(self._values) < self._capacity:
+            self._values.append(value)
+            return None
+        evicted = self._values[self._next]
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self._capacity
+        return evicted
+
+
+class RollingStats:
+    """Mean and variance over the values of a RingBuffer, updated on push."""
+
+    __slots__ = ("values", "_sum", "_sum_sq")
+
+    def __init__(self, capacity: int):
+        self.values = RingBuffer(capacity)
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def push(self, value: float):
+        evicted = self.values.push(value)
+        self._sum += value
+        self._sum_sq += value * value
+        if evicted is not None:
+            self._sum -= evicted
+            self._sum_sq -= evicted * evicted
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def mean(self) -> Optional[float]:
+        n = len(self.values)
+        return self._sum / n if n else None
+
+    def variance(self) -> Optional[float]:
+        n = len(self.values)
+        if n < 2:
+            return None
+        mean = self._sum / n
+        return max(self._sum_sq / n - mean * mean, 0.0) * n / (n - 1)
+
+
+class HeadwaySeries:
+    """Observed arrivals of one route, in one direction, at one station."""
+
+    __slots__ = ("headways", "drifts", "last_arrival", "_pending")
+
+    def __init__(self, capacity: int):
+        self.headways = RollingStats(capacity)
+        # Last prediction minus first prediction of each arrived trip
+        self.drifts = RollingStats(capacity)
+        self.last_arrival: Optional[float] = None
+        # trip id -> (first predicted arrival, latest predicted arrival)
+        self._pending: dict[str, tuple[int, int]] = {}
+
+    def observe(self, snapshot_epoch: int, predictions: dict[str, int]):
+        for trip_id, (first, last) in self._pending.items():
+            if trip_id in predictions:
+                continue
+            if last <= snapshot_epoch + ARRIVAL_GRACE_SECONDS:
+                self._arrived(last, last - first)
+
+        self._pending = {
+            trip_id: (self._pending.get(trip_id, (epoch, epoch))[0], epoch)
+            for trip_id, epoch in predictions.items()
+        }
+
+    def _arrived(self, epoch: float, drift: float):
+        self.drifts.push(drift)
+        if self.last_arrival is not None and epoch > self.last_arrival:
+            self.headways.push(epoch - self.last_arrival)
+        if self.last_arrival is None or epoch > self.last_arrival:
+            self.last_arrival = epoch
+
+
+@dataclass(frozen=True)
+class HeadwayStats:
+    station_id: str
+    route: str
+    direction: Literal["N", "S"]
+    samples: int
+    mean_headway_seconds: Optional[float]
+    headway_stdev_seconds: Optional[float]
+    mean_drift_seconds: Optional[float]
+    last_arrival: Optional[float]
+
+
+class ArrivalHistory:
+    """Arrivals observed across snapshots, kept in fixed size ring buffers per
+    (station, route, direction)."""
+
+    def __init__(self, capacity: int = 32):
+        self._capacity = capacity
+        self._series: dict[HistoryKey, HeadwaySeries] = {}
+        self._lock = threading.Lock()
+
+    def record(self, snapshot_epoch: int, trips: TripIndex):
+        predictions: dict[HistoryKey, dict[str, int]] = {}
+        for timeline in trips:
+            for station_id, epoch in zip(timeline.station_ids, timeline.epochs):
+                key = (station_id, timeline.route_id, timeline.direction)
+                predictions.setdefault(key, {})[timeline.trip_id] = epoch
+
+        with self._lock:
+            for key, series in self._series.items():
+                if key not in predictions:
+                    series.observe(snapshot_epoch, {})
+            for key, trip_predictions in predictions.items():
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = HeadwaySeries(self._capacity)
+                series.observe(snapshot_epoch, trip_predictions)
+
+    def stats(
+        self,
+        station_id: Optional[str] = None,
+        route: Optional[str] = None,
+        direction: Optional[Literal["N", "S"]] = None,
+    ) -> list[HeadwayStats]:
+        out: list[HeadwayStats] = []
+        with self._lock:
+            for (s, r, d), series in self._series.items():
+                if (
+                    (station_id and s != station_id)
+                    or (route and r != route)
+                    or (direction and d != direction)
+                ):
+                    continue
+                if series.last_arrival is None:
+                    continue
+                variance = series.headways.variance()
+                out.append(
+                    HeadwayStats(
+                        station_id=s,
+                        route=r,
+                        direction=d,
+                        samples=len(series.headways),
+                        mean_headway_seconds=series.headways.mean(),
+                        headway_stdev_seconds=(
+                            math.sqrt(variance) if variance is not None else None
+                        ),
+                        mean_drift_seconds=series.drifts.mean(),
+                        last_arrival=series.last_arrival,
+                    )
+                )
+        return out
@@ -0,0 +1,132 @@
+"""
+Checkpoint of the last good partition of every feed, so a restarted server
+can serve its previous snapshot before the first feed refresh.
+
+Layout (little endian):
+    header           magic, version, save time, partition count
+    zlib compressed body, one entry per partition:
+        partition    url length, feed time, fetch time, entity count, stop
+                     update count, arrival count, string count, strings size
+        url          utf-8
+        strings      utf-8, newline separated
+        columns      stations, routes, trips, stops (u32), directions (u8),
+                     epochs (i64), one value per arrival
+"""
+
+import logging, struct, time, zlib
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from src.mtapi.feed_partition import ArrivalColumns, FeedPartition
+from src.mtaproto.feedresponse import TZ
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MCKP"
+VERSION = 1
+
+# magic, version, saved at, partition count
+HEADER = struct.Struct("<4sHdI")
+# url length, feed time, fetched at, entities, stop updates, arrivals,
+# string count, strings size
+PARTITION = struct.Struct("<HqdIIIII")
+
+_COLUMNS = ("stations", "routes", "trips", "stops", "directions", "epochs")
+
+
+def write_checkpoint(partitions: dict[str, FeedPartition], out_path: Path):
+    body = bytearray()
+    for url, partition in partitions.items():
+        arrivals = partition.arrivals
+        url_data = url.encode()
+        strings = "\n".join(arrivals.strings).encode()
+        body += PARTITION.pack(
+            len(url_data),
+            int(partition.feed_time.timestamp()),
+            partition.fetched_at,
+            partition.entities,
+            partition.stop_updates,
+            len(arrivals),
+            len(arrivals.strings),
+            len(strings),
+        )
+        body += url_data
+        body += strings
+        for column in _COLUMNS:
+            body += getattr(arrivals, column).tobytes()
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, time.time(), len(partitions)))
+        f.write(zlib.compress(body, 1))
+    tmp_path.replace(out_path)
+
+
+def read_checkpoint(path: Path) -> Optional[dict[str, FeedPartition]]:
+    """The checkpointed partitions, or None if there is no usable checkpoint."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, saved_at, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            logger.warning("Ignoring checkpoint %s with unknown format", path)
+            return None
+        partitions = _read_partitions(zlib.decompress(data[HEADER.size :]), count)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error, zlib.error) as e:
+        logger.warning("Couldn't read checkpoint %s: %s", path, e)
+        return None
+
+    logger.info(
+        "Loaded %d feeds from checkpoint saved at %s",
+        len(partitions),
+        datetime.fromtimestamp(saved_at, TZ),
+    )
+    return partitions
+
+
+def _read_partitions(body: bytes, count: int) -> dict[str, FeedPartition]:
+    partitions: dict[str, FeedPartition] = {}
+    pos = 0
+    for _ in range(count):
+        (
+            url_length,
+            feed_time,
+            fetched_at,
+            entities,
+            stop_updates,
+            arrival_count,
+            string_count,
+            strings_size,
+        ) = PARTITION.unpack_from(body, pos)
+        pos += PARTITION.size
+        url = body[pos : pos + url_length].decode()
+        pos += url_length
+        strings = body[pos : pos + strings_size].decode()
+        pos += strings_size
+
+        arrivals = ArrivalColumns()
+        arrivals.strings = strings.split("\n") if string_count else []
+        for column in _COLUMNS:
+            values = array(getattr(arrivals, column).typecode)
+            size = values.itemsize * arrival_count
+            values.frombytes(body[pos : pos + size])
+            pos += size
+            setattr(arrivals, column, values)
+
+        partitions[url] = FeedPartition(
+            feed_url=url,
+            feed_time=datetime.fromtimestamp(feed_time, TZ),
+            fetched_at=fetched_at,
+            arrivals=arrivals,
+            entities=entities,
+            stop_updates=stop_updates,
+        )
+
+    if pos != len(body):
+        raise ValueError("trailing data")
+    return partitions
@@ -0,0 +1,65 @@
+import time
+from enum import Enum
+from typing import Optional
+
+
+class BreakerState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops calling a failing feed for an exponentially growing backoff.
+
+    After `failure_threshold` consecutive failures the breaker opens. Once the
+    backoff has passed a single trial call is allowed (half open). Success
+    closes the breaker, and failure opens it again with double the backoff,
+    up to `max_backoff` seconds."""
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        base_backoff: float = 30,
+        max_backoff: float = 600,
+    ):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.state = BreakerState.CLOSED
+        self.consecutive_failures = 0
+        self._opened_count = 0
+        self._retry_at: Optional[float] = None
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        if self.state != BreakerState.OPEN:
+            return True
+        now = time.monotonic() if now is None else now
+        if self._retry_at is not None and now >= self._retry_at:
+            self.state = BreakerState.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self):
+        self.state = BreakerState.CLOSED
+        self.consecutive_failures = 0
+        self._opened_count = 0
+        self._retry_at = None
+
+    def record_failure(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self.consecutive_failures += 1
+        if (
+            self.state == BreakerState.HALF_OPEN
+            or self.consecutive_failures >= self.failure_threshold
+        ):
+            backoff = min(self.base_backoff * 2**self._opened_count, self.max_backoff)
+            self._opened_count += 1
+            self.state = BreakerState.OPEN
+            self._retry_at = now + backoff
+
+    def seconds_until_retry(self, now: Optional[float] = None) -> Optional[float]:
+        if self.state != BreakerState.OPEN or self._retry_at is None:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(self._retry_at - now, 0)
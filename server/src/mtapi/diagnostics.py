@@ -0,0 +1,61 @@
+import logging, threading, time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UnknownStop:
+    stop_id: str
+    total: int
+    last_refresh: int
+    last_seen: float
+
+
+class UnknownStopCollector:
+    """Aggregates stop time updates whose stop isn't in the stations file.
+
+    Mtapi.update counts misses per stop id in a local Counter and hands it over
+    once per refresh, which logs a single summary line. Totals are kept for at
+    most `max_stop_ids` stop ids, evicting the least frequent."""
+
+    def __init__(self, max_stop_ids: int = 1000):
+        self._max_stop_ids = max_stop_ids
+        self._totals: Counter[str] = Counter()
+        self._last_seen: dict[str, float] = {}
+        self._last_refresh: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, misses: Counter[str], now: Optional[float] = None):
+        now = now or time.time()
+        if misses:
+            logger.info(
+                "%d stop updates for %d unknown stops, most common: %s",
+                misses.total(),
+                len(misses),
+                ", ".join(f"{s} ({n})" for s, n in misses.most_common(5)),
+            )
+
+        with self._lock:
+            self._last_refresh = misses
+            self._totals.update(misses)
+            for stop_id in misses:
+                self._last_seen[stop_id] = now
+            if len(self._totals) > self._max_stop_ids:
+                for stop_id, _ in self._totals.most_common()[self._max_stop_ids :]:
+                    del self._totals[stop_id]
+                    del self._last_seen[stop_id]
+
+    def top(self, limit: int = 20) -> list[UnknownStop]:
+        with self._lock:
+            return [
+                UnknownStop(
+                    stop_id=stop_id,
+                    total=total,
+                    last_refresh=self._last_refresh.get(stop_id, 0),
+                    last_seen=self._last_seen[stop_id],
+                )
+                for stop_id, total in self._totals.most_common(limit)
+            ]
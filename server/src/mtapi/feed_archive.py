@@ -0,0 +1,173 @@
+"""
+Append-only archive of raw GTFS-RT payloads, and a driver that replays them
+through Mtapi.update.
+
+An archive is a directory of time partitioned segments. Each segment is a
+pair of files named after the partition's start epoch:
+    <start>.seg  records of (u16 url length, url, zlib compressed payload)
+    <start>.idx  fixed width (cycle start, fetch time, offset, length) rows
+"""
+
+import argparse, logging, struct, threading, time, zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, TYPE_CHECKING
+
+from src.mtaproto.feedresponse import TZ
+
+if TYPE_CHECKING:
+    from src.mtapi.mtapi import Mtapi
+
+logger = logging.getLogger(__name__)
+
+# cycle start, fetch time, offset into .seg, record length
+INDEX_ENTRY = struct.Struct("<ddQI")
+URL_LENGTH = struct.Struct("<H")
+
+
+class FeedArchiver:
+    def __init__(self, archive_dir: Path, partition_seconds: int = 3600):
+        self.archive_dir = archive_dir
+        self.partition_seconds = partition_seconds
+        self._partition: Optional[int] = None
+        self._segment: Optional[BinaryIO] = None
+        self._index: Optional[BinaryIO] = None
+        self._lock = threading.Lock()
+        archive_dir.mkdir(parents=True, exist_ok=True)
+
+    def append(
+        self, feed_url: str, cycle_started_at: float, fetched_at: float, payload: bytes
+    ):
+        url = feed_url.encode()
+        record = URL_LENGTH.pack(len(url)) + url + zlib.compress(payload)
+        with self._lock:
+            segment, index = self._files_for(fetched_at)
+            offset = segment.tell()
+            segment.write(record)
+            segment.flush()
+            index.write(
+                INDEX_ENTRY.pack(cycle_started_at, fetched_at, offset, len(record))
+            )
+            index.flush()
+
+    def _files_for(self, fetched_at: float) -> tuple[BinaryIO, BinaryIO]:
+        partition = int(fetched_at // self.partition_seconds * self.partition_seconds)
+        if partition != self._partition or not self._segment or not self._index:
+            self.close()
+            self._partition = partition
+            self._segment = open(self.archive_dir / f"{partition}.seg", "ab")
+            self._index = open(self.archive_dir / f"{partition}.idx", "ab")
+        return self._segment, self._index
+
+    def close(self):
+        for f in (self._segment, self._index):
+            if f:
+                f.close()
+        self._segment = self._index = None
+
+
+@dataclass
+class ReplayCycle:
+    started_at: float
+    # feed url -> raw payload
+    payloads: dict[str, bytes] = field(default_factory=dict)
+
+
+class ArchiveReader:
+    def __init__(self, archive_dir: Path):
+        self.archive_dir = archive_dir
+
+    def partitions(self) -> list[int]:
+        return sorted(int(p.stem) for p in self.archive_dir.glob("*.idx"))
+
+    def cycles(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Iterator[ReplayCycle]:
+        """Archived update cycles in time order, optionally limited to cycles
+        that started in [start, end)."""
+        current: Optional[ReplayCycle] = None
+        for partition in self.partitions():
+            index = (self.archive_dir / f"{partition}.idx").read_bytes()
+            with open(self.archive_dir / f"{partition}.seg", "rb") as segment:
+                # A torn trailing index row from a crash is ignored
+                usable = len(index) - len(index) % INDEX_ENTRY.size
+                for started_at, _, offset, length in INDEX_ENTRY.iter_unpack(
+                    index[:usable]
+                ):
+                    if (start is not None and started_at < start) or (
+                        end is not None and started_at >= end
+                    ):
+                        continue
+                    if current is None or current.started_at != started_at:
+                        if current is not None:
+                            yield current
+                        current = ReplayCycle(started_at)
+                    segment.seek(offset)
+                    record = segment.read(length)
+                    (url_length,) = URL_LENGTH.unpack_from(record)
+                    url_end = URL_LENGTH.size + url_length
+                    current.payloads[record[URL_LENGTH.size : url_end].decode()] = (
+                        zlib.decompress(record[url_end:])
+                    )
+        if current is not None:
+            yield current
+
+
+@dataclass
+class ReplayStats:
+    cycles: int = 0
+    update_seconds: list[float] = field(default_factory=list)
+
+
+def replay(
+    mtapi: "Mtapi",
+    reader: ArchiveReader,
+    speed: float = 10.0,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+) -> ReplayStats:
+    """Feed archived cycles through `mtapi.update`, `speed` times faster than
+    they were recorded. A speed of 0 replays as fast as possible."""
+    stats = ReplayStats()
+    previous: Optional[float] = None
+    for cycle in reader.cycles(start, end):
+        if speed and previous is not None:
+            time.sleep(max(cycle.started_at - previous, 0) / speed)
+        previous = cycle.started_at
+
+        t = time.perf_counter()
+        mtapi.update(
+            now=datetime.fromtimestamp(cycle.started_at, TZ), payloads=cycle.payloads
+        )
+        stats.update_seconds.append(time.perf_counter() - t)
+        stats.cycles += 1
+    return stats
+
+
+def main():
+    from src.mtapi.mtapi import Mtapi
+
+    parser = argparse.ArgumentParser(description="Replay an archive of MTA feeds.")
+    parser.add_argument("archive_dir", type=Path)
+    parser.add_argument("--stations", type=Path, default=Path("data/stations.json"))
+    parser.add_argument("--speed", type=float, default=10.0)
+    parser.add_argument("--start", type=float, help="Epoch seconds")
+    parser.add_argument("--end", type=float, help="Epoch seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    reader = ArchiveReader(args.archive_dir)
+    mtapi = Mtapi(args.stations, expires_seconds=0, block_on_first_update=False)
+    stats = replay(mtapi, reader, args.speed, args.start, args.end)
+    total = sum(stats.update_seconds)
+    print(
+        f"Replayed {stats.cycles} cycles, "
+        f"mean update {total / max(stats.cycles, 1) * 1000:.1f}ms, "
+        f"max update {max(stats.update_seconds, default=0) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterator, Literal, Optional, TypeAlias
+
+from src.mtapi.feed_source import FeedSource
+from src.mtaproto.feed_scanner import ScannedFeed, scan_feed
+from src.mtaproto.feedresponse import TZ
+
+# station id, route id, direction, arrival epoch, trip id, stop id
+Arrival: TypeAlias = tuple[str, str, Literal["N", "S"], int, str, str]
+
+_DIRECTIONS: tuple[Literal["N", "S"], Literal["N", "S"]] = ("N", "S")
+
+
+class ArrivalColumns:
+    """Arrivals stored column-wise: epochs in one array and every string as an
+    index into a shared table. Cheap to pickle out of a decoding process."""
+
+    __slots__ = (
+        "strings",
+        "stations",
+        "routes",
+        "trips",
+        "stops",
+        "directions",
+        "epochs",
+        "_index",
+    )
+
+    def __init__(self):
+        self.strings: list[str] = []
+        self.stations = array("I")
+        self.routes = array("I")
+        self.trips = array("I")
+        self.stops = array("I")
+        self.directions = array("B")
+        self.epochs = array("q")
+        self._index: dict[str, int] = {}
+
+    def _intern(self, s: str) -> int:
+        i = self._index.get(s)
+        if i is None:
+            i = self._index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def append(self, arrival: Arrival):
+        station_id, route_id, direction, epoch, trip_id, stop_id = arrival
+        self.stations.append(self._intern(station_id))
+        self.routes.append(self._intern(route_id))
+        self.trips.append(self._intern(trip_id))
+        self.stops.append(self._intern(stop_id))
+        self.directions.append(direction == "S")
+        self.epochs.append(epoch)
+
+    def __len__(self) -> int:
+        return len(self.epochs)
+
+    def __iter__(self) -> Iterator[Arrival]:
+        strings = self.strings
+        for station, route, direction, epoch, trip, stop in zip(
+            self.stations,
+            self.routes,
+            self.directions,
+            self.epochs,
+            self.trips,
+            self.stops,
+        ):
+            yield (
+                strings[station],
+                strings[route],
+                _DIRECTIONS[direction],
+                epoch,
+                strings[trip],
+                strings[stop],
+            )
+
+    def __getstate__(self):
+        # The intern index is only needed while appending
+        return (
+            self.strings,
+            self.stations,
+            self.routes,
+            self.trips,
+            self.stops,
+            self.directions,
+            self.epochs,
+        )
+
+    def __setstate__(self, state):
+        (
+            self.strings,
+            self.stations,
+            self.routes,
+            self.trips,
+            self.stops,
+            self.directions,
+            self.epochs,
+        ) = state
+        self._index = {}
+
+
+@dataclass
+class FeedPartition:
+    """Upcoming arrivals read from one feed. The last good partition of each
+    feed is reused while that feed is failing."""
+
+    feed_url: str
+    feed_time: datetime
+    fetched_at: float
+    arrivals: ArrivalColumns = field(default_factory=ArrivalColumns)
+    entities: int = 0
+    stop_updates: int = 0
+    unknown_stops: Counter[str] = field(default_factory=Counter)
+    parse_seconds: float = 0
+
+
+def extract_partition(
+    feed_url: str,
+    feed: ScannedFeed,
+    source: FeedSource,
+    stops_to_stations: dict[str, str],
+    now_epoch: int,
+    fetched_at: float,
+) -> FeedPartition:
+    """`stops_to_stations` is keyed by prefixed stop id, covering every
+    source."""
+    partition = FeedPartition(
+        feed_url, datetime.fromtimestamp(feed.timestamp, TZ), fetched_at
+    )
+    arrivals = partition.arrivals
+    unknown_stops = partition.unknown_stops
+    # Counted locally and stored once
+    stop_updates = 0
+    # Feed ids repeat across trips, so each is mapped once
+    stop_keys: dict[str, str] = {}
+    route_keys: dict[str, str] = {}
+    prefix = source.prefix
+
+    for trip in feed.trips:
+        trip_id, route_id, _, _, stops = trip
+        trip_id = prefix + trip_id
+        route = route_keys.get(route_id)
+        if route is None:
+            # Upper cased, as route lookups are
+            route = route_keys[route_id] = (prefix + source.route_id(route_id)).upper()
+        direction = source.direction(trip)
+        stop_updates += len(stops)
+
+        for stop_id, epoch in stops:
+            if epoch < now_epoch:
+                continue
+
+            key = stop_keys.get(stop_id)
+            if key is None:
+                key = stop_keys[stop_id] = prefix + source.stop_id(stop_id)
+            stop_id = key
+            station_id = stops_to_stations.get(stop_id)
+
+            if station_id is None:
+                unknown_stops[stop_id] += 1
+                continue
+
+            arrivals.append((station_id, route, direction, epoch, trip_id, stop_id))
+
+    partition.entities = feed.entity_count
+    partition.stop_updates = stop_updates
+    return partition
+
+
+# Set in each decoding process by init_decoder
+_decoder_stops_to_stations: dict[str, str] = {}
+_decoder_sources: dict[str, FeedSource] = {}
+
+
+def init_decoder(stops_to_stations: dict[str, str], sources: dict[str, FeedSource]):
+    """`sources` maps each feed url to its source."""
+    global _decoder_stops_to_stations, _decoder_sources
+    _decoder_stops_to_stations = stops_to_stations
+    _decoder_sources = sources
+
+
+def decode_partition(
+    feed_url: str,
+    payload: bytes,
+    now_epoch: int,
+    fetched_at: float,
+    stops_to_stations: Optional[dict[str, str]] = None,
+    source: Optional[FeedSource] = None,
+) -> FeedPartition:
+    """Parse a raw feed and extract its partition. Runs either in the server
+    process or in a decoding process set up by init_decoder. Raises if the
+    feed can't be parsed."""
+    start = time.perf_counter()
+    feed = scan_feed(payload)
+    parse_seconds = time.perf_counter() - start
+
+    partition = extract_partition(
+        feed_url,
+        feed,
+        source or _decoder_sources[feed_url],
+        (
+            stops_to_stations
+            if stops_to_stations is not None
+            else _decoder_stops_to_stations
+        ),
+        now_epoch,
+        fetched_at,
+    )
+    partition.parse_seconds = parse_seconds
+    return partition
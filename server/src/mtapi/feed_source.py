@@ -0,0 +1,156 @@
+"""
+Feed sources: an agency's GTFS-realtime feeds and how to read them.
+
+Every source goes through the same ingestion. A source only says where its
+feeds are, which stations file covers them and how its stop ids, route ids
+and trip directions map onto Mtapi's. The stop id, route and direction
+mappings are named in a sources file and looked up in the registries below.
+
+A sources file is a JSON list, e.g. for the LIRR:
+
+    [{"name": "lirr",
+      "base_url": "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/",
+      "feeds": ["lirr%2Fgtfs-lirr"],
+      "stations_file": "data/lirr_stations.json",
+      "prefix": "LIRR:"}]
+
+"stop_id", "route_id" and "direction" default to "gtfs".
+"""
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Literal, Optional, TypeAlias
+
+from src.mtaproto.feed_scanner import ScannedTrip
+from src.mtaproto.feedresponse import normalize_route_id
+
+MTA_FEED_BASE_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/"
+FEED_PATHS = [
+    "nyct%2Fgtfs",  # 1234567S
+    "nyct%2Fgtfs-l",  # L
+    "nyct%2Fgtfs-nqrw",  # NRQW
+    "nyct%2Fgtfs-bdfm",  # BDFM
+    "nyct%2Fgtfs-ace",  # ACE
+    "nyct%2Fgtfs-si",  # (SIR)
+    "nyct%2Fgtfs-jz",  # JZ
+    "nyct%2Fgtfs-g",  # G
+]
+
+# Feed stop id -> stop id in the source's stations file
+StopIdMapping: TypeAlias = Callable[[str], str]
+RouteNormalizer: TypeAlias = Callable[[str], str]
+DirectionExtractor: TypeAlias = Callable[[ScannedTrip], Literal["N", "S"]]
+
+
+def nyct_stop_id(stop_id: str) -> str:
+    # Platform suffixes (N/S) are dropped, as in TripStop.get_stop_id
+    return stop_id[:3]
+
+
+def gtfs_stop_id(stop_id: str) -> str:
+    return stop_id
+
+
+def gtfs_route_id(route_id: str) -> str:
+    return route_id
+
+
+def nyct_direction(trip: ScannedTrip) -> Literal["N", "S"]:
+    # The NYCT extension also defines EAST and WEST, which the subway feeds
+    # don't use. Stations only keep north and southbound trains, so such
+    # trips are now served as northbound rather than failing the update
+    return "S" if trip[2] == "S" else "N"
+
+
+def gtfs_direction(trip: ScannedTrip) -> Literal["N", "S"]:
+    # direction_id 0 is served as northbound, 1 as southbound. Trips
+    # without one are northbound.
+    return "S" if trip[3] == 1 else "N"
+
+
+STOP_ID_MAPPINGS: dict[str, StopIdMapping] = {
+    "nyct": nyct_stop_id,
+    "gtfs": gtfs_stop_id,
+}
+ROUTE_NORMALIZERS: dict[str, RouteNormalizer] = {
+    "nyct": normalize_route_id,
+    "gtfs": gtfs_route_id,
+}
+DIRECTION_EXTRACTORS: dict[str, DirectionExtractor] = {
+    "nyct": nyct_direction,
+    "gtfs": gtfs_direction,
+}
+
+
+@dataclass(frozen=True)
+class FeedSource:
+    name: str
+    base_url: str
+    feed_paths: tuple[str, ...]
+    # None for the stations file Mtapi is created with
+    stations_file: Optional[Path] = None
+    # Prepended to the source's station, stop, route and trip ids so they can't
+    # collide with another source's
+    prefix: str = ""
+    stop_id: StopIdMapping = gtfs_stop_id
+    route_id: RouteNormalizer = gtfs_route_id
+    direction: DirectionExtractor = gtfs_direction
+
+    @property
+    def feed_urls(self) -> list[str]:
+        return [self.base_url + path for path in self.feed_paths]
+
+
+def subway_source(base_url: str = MTA_FEED_BASE_URL) -> FeedSource:
+    return FeedSource(
+        "subway",
+        base_url,
+        tuple(FEED_PATHS),
+        stop_id=nyct_stop_id,
+        route_id=normalize_route_id,
+        direction=nyct_direction,
+    )
+
+
+def _lookup(registry: dict, name: str, kind: str, source: str):
+    try:
+        return registry[name]
+    except KeyError:
+        raise ValueError(
+            f"Feed source {source}: unknown {kind} {name!r}, "
+            f"expected one of {', '.join(registry)}"
+        )
+
+
+def load_feed_sources(path: Path) -> list[FeedSource]:
+    with open(path) as f:
+        entries = json.load(f)
+
+    sources: list[FeedSource] = []
+    for entry in entries:
+        name = entry["name"]
+        sources.append(
+            FeedSource(
+                name,
+                entry["base_url"],
+                tuple(entry["feeds"]),
+                stations_file=(
+                    Path(entry["stations_file"]) if "stations_file" in entry else None
+                ),
+                prefix=entry.get("prefix", ""),
+                stop_id=_lookup(
+                    STOP_ID_MAPPINGS, entry.get("stop_id", "gtfs"), "stop_id", name
+                ),
+                route_id=_lookup(
+                    ROUTE_NORMALIZERS, entry.get("route_id", "gtfs"), "route_id", name
+                ),
+                direction=_lookup(
+                    DIRECTION_EXTRACTORS,
+                    entry.get("direction", "gtfs"),
+                    "direction",
+                    name,
+                ),
+            )
+        )
+    return sources
@@ -1,19 +1,81 @@
 from pathlib import Path
-from time import sleep
-from typing import Literal, Optional, TypeAlias, TypedDict
-import contextlib, copy
+import time
+from types import MappingProxyType
+from typing import Iterable, Literal, Mapping, Optional, Sequence, TypeAlias, TypedDict
+import contextlib
 from urllib import request
-from collections import defaultdict
-from itertools import islice
-from operator import itemgetter
+from collections import Counter, defaultdict
+from bisect import bisect_right
+from heapq import merge, nsmallest
+from itertools import chain, islice
+from operator import attrgetter
 import math, json
 import threading
 import logging
-from src.mtaproto.feedresponse import FeedResponse, Trip, TripStop, TZ
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from src.gtfs_static.route_table import RouteTable
+from src.mtaproto.feedresponse import TZ, normalize_route_id
+from src.mtapi.arrival_history import ArrivalHistory, HeadwayStats
+from src.mtapi.checkpoint import read_checkpoint, write_checkpoint
+from src.mtapi.circuit_breaker import BreakerState, CircuitBreaker
+from src.mtapi.diagnostics import UnknownStop, UnknownStopCollector
+from src.mtapi.feed_archive import FeedArchiver
+from src.mtapi.feed_partition import FeedPartition, decode_partition, init_decoder
+from src.mtapi.feed_source import (
+    FEED_PATHS,
+    MTA_FEED_BASE_URL,
+    FeedSource,
+    subway_source,
+)
+from src.mtapi.spatial_index import GridIndex
+from src.mtapi.station_table import StationRecord, StationTable
+from src.mtapi.trip_index import TripIndex, TripTimeline
+from src.metrics import Counter as MetricCounter, Gauge, Histogram
+from src.request_timing import phase
+from dataclasses import dataclass
 from datetime import timedelta, datetime
 
 logger = logging.getLogger(__name__)
 
+UPDATE_SECONDS = Histogram("mtapi_update_seconds", "Time to rebuild the snapshot")
+FEED_FETCH_SECONDS = Histogram(
+    "mtapi_feed_fetch_seconds", "Time to download a feed", ["feed"]
+)
+FEED_PARSE_SECONDS = Histogram(
+    "mtapi_feed_parse_seconds",
+    "Time to parse a feed",
+    ["feed"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+FEED_ERRORS = MetricCounter(
+    "mtapi_feed_errors_total", "Feeds that failed to load", ["feed", "stage"]
+)
+FEED_ENTITIES = MetricCounter(
+    "mtapi_feed_entities_total", "Feed entities read", ["feed"]
+)
+STOP_TIME_UPDATES = MetricCounter(
+    "mtapi_stop_time_updates_total", "Stop time updates read", ["feed"]
+)
+UNKNOWN_STOPS = MetricCounter(
+    "mtapi_unknown_stops_total",
+    "Stop time updates for stops missing from the stations file",
+    ["feed"],
+)
+FEED_CIRCUIT_OPEN = Gauge(
+    "mtapi_feed_circuit_open", "1 while a feed's circuit breaker is open", ["feed"]
+)
+FEED_STALE = MetricCounter(
+    "mtapi_feed_stale_total",
+    "Refreshes that reused a feed's last good partition",
+    ["feed"],
+)
+
+
+def feed_name(feed_url: str) -> str:
+    # Without the query string, which may hold an api key
+    return feed_url.rsplit("/", 1)[-1].split("?", 1)[0]
+
 
 # List of pair: Lat, Lng
 Location: TypeAlias = list[float] | tuple[float, float]
@@ -33,6 +95,7 @@ class StationDict(TypedDict):
 class Train(TypedDict):
     name: str
     time: datetime
+    trip_id: str
 
 
 class SerializedStation(TypedDict):
@@ -43,65 +106,200 @@ class SerializedStation(TypedDict):
     southbound_trains: list[Train]
     routes: set[str]
     last_update: datetime
+    stale: bool
 
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class FeedStatus:
+    feed: str
+    source: str
+    state: BreakerState
+    consecutive_failures: int
+    retry_in: Optional[float]
+    # Header timestamp of the partition currently served, if any
+    feed_time: Optional[datetime]
+    last_success: Optional[datetime]
+    stale: bool
+
+
+@dataclass(frozen=True)
+class StationQuery:
+    """Narrows the trains serialized for each station. None leaves that
+    dimension unrestricted."""
+
+    routes: Optional[frozenset[str]] = None
+    direction: Optional[Literal["N", "S"]] = None
+    horizon: Optional[timedelta] = None
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class StationInfo:
+    """What the stations file says about a station. Loaded once and shared by
+    every snapshot."""
+
+    id: str
+    name: str
+    location: tuple[float, float]
+    stops: tuple[str, ...]
+
+    @staticmethod
+    def from_dict(d: StationDict, prefix: str = "") -> "StationInfo":
+        lat, lng = d["location"]
+        return StationInfo(
+            id=prefix + d["id"],
+            name=d["name"],
+            location=(lat, lng),
+            stops=tuple(prefix + stop for stop in d["stops"]),
+        )
+
+    @staticmethod
+    def from_record(r: StationRecord, prefix: str = "") -> "StationInfo":
+        return StationInfo(
+            id=prefix + r.id,
+            name=r.name,
+            location=r.location,
+            stops=tuple(prefix + stop for stop in r.stops) if prefix else r.stops,
+        )
+
+
+class Arrival:
+    """An upcoming train at a station. Trains are built from arrivals when a
+    station is serialized."""
+
+    __slots__ = ("route_id", "epoch", "trip_id")
+
+    def __init__(self, route_id: str, epoch: int, trip_id: str):
+        self.route_id = route_id
+        self.epoch = epoch
+        self.trip_id = trip_id
+
+    def train(self) -> Train:
+        return Train(
+            name=self.route_id,
+            time=datetime.fromtimestamp(self.epoch, TZ),
+            trip_id=self.trip_id,
+        )
+
+
+_EPOCH = attrgetter("epoch")
+
+# Shared by every station without arrivals, so most of a snapshot's stations
+# cost one small object
+_NO_TRAINS: Mapping[Literal["N", "S"], Sequence[Arrival]] = MappingProxyType(
+    {"N": (), "S": ()}
+)
+_NO_ROUTE_TRAINS: Mapping[tuple[str, Literal["N", "S"]], list[Arrival]] = (
+    MappingProxyType({})
+)
+
+
 class Station:
-    def __init__(self, d: StationDict):
-        self.d = d
-        self.trains: dict[Literal["N", "S"], list[Train]] = {}
-        self.clear_train_data()
-        self.routes: set[str] = set()
-        self.last_update: datetime
+    """A station's arrivals in one snapshot."""
+
+    __slots__ = (
+        "info",
+        "trains",
+        "route_trains",
+        "max_trains",
+        "last_update",
+        "stale",
+    )
+
+    def __init__(self, info: StationInfo, last_update: datetime):
+        self.info = info
+        self.trains = _NO_TRAINS
+        # Upcoming trains of each route and direction, soonest first
+        self.route_trains = _NO_ROUTE_TRAINS
+        self.max_trains = 0
+        self.last_update = last_update
+        # Set when no feed of the snapshot was fresh, such as a snapshot
+        # restored from a checkpoint before the first refresh
+        self.stale = False
+
+    @property
+    def routes(self) -> set[str]:
+        return {route_id for route_id, _ in self.route_trains}
 
     def add_train(
         self,
         route_id: str,
         direction: Literal["N", "S"],
-        train_time: datetime,
+        epoch: int,
         feed_time: datetime,
+        trip_id: str,
     ):
-        self.routes.add(route_id)
-        self.trains[direction].append(Train(name=route_id, time=train_time))
+        if self.route_trains is _NO_ROUTE_TRAINS:
+            self.route_trains = {}
+        self.route_trains.setdefault((route_id, direction), []).append(  # type: ignore
+            Arrival(route_id, epoch, trip_id)
+        )
         self.last_update = feed_time
 
-    def clear_train_data(self):
-        self.trains["N"] = []
-        self.trains["S"] = []
-        self.routes = set()
-        self.last_update = datetime.now()
-
     def sort_trains(self, max_trains: int):
-        self.trains["S"] = sorted(self.trains["S"], key=itemgetter("time"))[:max_trains]
-        self.trains["N"] = sorted(self.trains["N"], key=itemgetter("time"))[:max_trains]
+        self.max_trains = max_trains
+        if self.route_trains is _NO_ROUTE_TRAINS:
+            return
+        self.route_trains = {
+            key: sorted(trains, key=_EPOCH)[:max_trains]
+            for key, trains in self.route_trains.items()
+        }
+        self.trains = {
+            direction: self._merge_routes(
+                [r for r, d in self.route_trains if d == direction], direction
+            )
+            for direction in ("N", "S")
+        }
+
+    def _merge_routes(
+        self, routes: Iterable[str], direction: Literal["N", "S"]
+    ) -> list[Arrival]:
+        lists = (self.route_trains.get((r, direction), ()) for r in routes)
+        return list(islice(merge(*lists, key=_EPOCH), self.max_trains))
+
+    def select_trains(
+        self, direction: Literal["N", "S"], query: StationQuery, now: datetime
+    ) -> Sequence[Arrival]:
+        if query.direction and query.direction != direction:
+            return []
+
+        if query.routes is None:
+            trains = self.trains[direction]
+        else:
+            trains = self._merge_routes(query.routes, direction)
+
+        if query.horizon is not None:
+            until = (now + query.horizon).timestamp()
+            trains = trains[: bisect_right(trains, until, key=_EPOCH)]
+        return trains
+
+    def serialize(self, query: Optional[StationQuery] = None) -> SerializedStation:
+        if query:
+            now = datetime.now(TZ)
+            northbound = self.select_trains("N", query, now)
+            southbound = self.select_trains("S", query, now)
+        else:
+            northbound = self.trains["N"]
+            southbound = self.trains["S"]
 
-    def serialize(self) -> SerializedStation:
         out: SerializedStation = {
-            "name": self.d["name"],
-            "lat": self.d["location"][0],
-            "lng": self.d["location"][1],
-            "northbound_trains": self.trains["N"],
-            "southbound_trains": self.trains["S"],
+            "name": self.info.name,
+            "lat": self.info.location[0],
+            "lng": self.info.location[1],
+            "northbound_trains": [a.train() for a in northbound],
+            "southbound_trains": [a.train() for a in southbound],
             "routes": self.routes,
             "last_update": self.last_update,
+            "stale": self.stale,
         }
         return out
 
 
 class Mtapi(object):
 
-    _FEED_URLS = [
-        "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs",  # 1234567S
-        "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-l",  # L
-        "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-nqrw",  # NRQW
-        "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-bdfm",  # BDFM
-        "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-ace",  # ACE
-        "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-si",  # (SIR)
-        "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-jz",  # JZ
-        "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-g",  # G
-    ]
+    _FEED_URLS = [MTA_FEED_BASE_URL + path for path in FEED_PATHS]
 
     def __init__(
         self,
@@ -110,162 +308,627 @@ class Mtapi(object):
         max_trains: int = 10,
         max_minutes: int = 30,
         threaded: bool = False,
+        block_on_first_update: bool = True,
+        history_size: int = 32,
+        archiver: Optional[FeedArchiver] = None,
+        feed_timeout: float = 10,
+        decode_processes: int = 0,
+        checkpoint_file: Optional[Path] = None,
+        feed_base_url: str = MTA_FEED_BASE_URL,
+        feed_sources: Iterable[FeedSource] = (),
+        route_table: Optional[RouteTable] = None,
     ):
+        """`feed_sources` are other agencies' feeds, read alongside the
+        subway's from `feed_base_url`. `route_table` gives the stations of
+        each route by the static schedule."""
         self._MAX_TRAINS: int = max_trains
         self._MAX_MINUTES: int = max_minutes
         self._EXPIRES_SECONDS: int = expires_seconds
         self._THREADED: bool = threaded
+        self._FEED_TIMEOUT: float = feed_timeout
+        self._sources = [subway_source(feed_base_url), *feed_sources]
+        self._feed_sources: dict[str, FeedSource] = {
+            url: source for source in self._sources for url in source.feed_urls
+        }
+        self._FEED_URLS = list(self._feed_sources)
+        self._station_info: dict[str, StationInfo] = {}
+        # The current snapshot's arrivals of every station
         self._stations: dict[str, Station] = {}
         self._stops_to_stations: dict[str, str] = {}
         self._routes: dict[str, set[str]] = {}
+        # Route -> ids of the stations it currently serves
+        self._route_stations: dict[str, set[str]] = {}
+        # Route -> ids of every station on it by the static schedule
+        self._scheduled_route_stations: dict[str, set[str]] = {}
+        self._trips: TripIndex = TripIndex()
+        self._history: Optional[ArrivalHistory] = (
+            ArrivalHistory(history_size) if history_size else None
+        )
         self._read_lock: threading.RLock = threading.RLock()
+        self._archiver: Optional[FeedArchiver] = archiver
+        self._unknown_stops = UnknownStopCollector()
+        self._breakers = {url: CircuitBreaker() for url in self._FEED_URLS}
+        self._last_good: dict[str, FeedPartition] = {}
+        self._stale_feeds: set[str] = set()
+        # Every update takes the next generation when it starts. An update
+        # stops early once a newer one has started, and only publishes if no
+        # newer snapshot is already published.
+        self._started_generation = 0
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._checkpoint_file: Optional[Path] = checkpoint_file
+        # When the running update started, which archived feeds are grouped by
+        self._cycle_started_at: float = 0
 
         # initialize the stations database
-        unparsed_stations: dict[str, StationDict] = {}
         try:
-            with open(stations_file, "r") as f:
-                unparsed_stations = json.load(f)
-                for id in unparsed_stations:
-                    self._stations[id] = Station(unparsed_stations[id])
-                self._stops_to_stations = self._build_stops_index(self._stations)
-
-        except IOError:
-            print(f"Couldn't load stations file {str(stations_file)}")
+            self._station_info = self._load_stations(stations_file)
+            loaded = {(None, "")}
+            for source in self._sources:
+                if (source.stations_file, source.prefix) in loaded:
+                    continue
+                loaded.add((source.stations_file, source.prefix))
+                self._add_stations(
+                    self._load_stations(
+                        source.stations_file or stations_file, source.prefix
+                    ),
+                    source,
+                )
+            self._stops_to_stations = self._build_stops_index(self._station_info)
+
+        except IOError as e:
+            print(f"Couldn't load stations file {e.filename or str(stations_file)}")
             exit()
 
-        self.update()
+        if route_table:
+            self._scheduled_route_stations = self._build_route_stations(route_table)
+
+        # Station locations never change, so the index outlives snapshots
+        self._station_index = GridIndex(
+            (id, info.location) for id, info in self._station_info.items()
+        )
+        self._stations = {
+            id: Station(info, datetime.now(TZ))
+            for id, info in self._station_info.items()
+        }
+
+        # Feeds are decoded in worker processes when set, keeping the CPU
+        # work off the interpreter that serves requests
+        self._decoder: Optional[ProcessPoolExecutor] = (
+            ProcessPoolExecutor(
+                decode_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_decoder,
+                initargs=(self._stops_to_stations, self._feed_sources),
+            )
+            if decode_processes
+            else None
+        )
+
+        # Without a blocking first update, requests are served empty until the
+        # threader's first refresh finishes (or the data expires when unthreaded)
+        # A checkpointed snapshot is served, flagged stale, until the first
+        # refresh replaces it, which never blocks
+        restored = self._restore_checkpoint()
+        if not restored:
+            if block_on_first_update:
+                self.update()
+            else:
+                self._last_update = datetime.now(TZ)
 
         if threaded:
             self.threader = MtapiThreader(self, expires_seconds)
-            self.threader.start_timer()
+            self.threader.start_timer(
+                update_immediately=restored or not block_on_first_update
+            )
+        elif restored:
+            threading.Thread(
+                target=self.update, name="mtapi-update", daemon=True
+            ).start()
+
+    def _restore_checkpoint(self) -> bool:
+        if not self._checkpoint_file:
+            return False
+        partitions = read_checkpoint(self._checkpoint_file)
+        if not partitions:
+            return False
+
+        for partition in partitions.values():
+            arrivals = partition.arrivals
+            station_ids = {arrivals.strings[i] for i in set(arrivals.stations)}
+            if not station_ids <= self._station_info.keys():
+                logger.warning(
+                    "Checkpoint doesn't match the stations file, ignoring it"
+                )
+                return False
+
+        self._last_good = {
+            url: p for url, p in partitions.items() if url in self._breakers
+        }
+        # Without payloads every feed falls back to its last good partition
+        self.update(payloads={})
+        return True
+
+    def _write_checkpoint(self):
+        try:
+            write_checkpoint(dict(self._last_good), self._checkpoint_file)  # type: ignore
+        except OSError as e:
+            logger.error("Couldn't write checkpoint: " + str(e))
 
     @staticmethod
-    def _build_stops_index(stations: dict[str, Station]) -> dict[str, str]:
+    def _load_stations(stations_file: Path, prefix: str = "") -> dict[str, StationInfo]:
+        stations: Iterable[StationInfo]
+        if stations_file.suffix == ".bin":
+            stations = (
+                StationInfo.from_record(r, prefix)
+                for r in StationTable.open(stations_file)
+            )
+        else:
+            with open(stations_file, "r") as f:
+                unparsed_stations: dict[str, StationDict] = json.load(f)
+            stations = (
+                StationInfo.from_dict(d, prefix) for d in unparsed_stations.values()
+            )
+        return {info.id: info for info in stations}
+
+    def _add_stations(self, stations: dict[str, StationInfo], source: FeedSource):
+        clashes = stations.keys() & self._station_info.keys()
+        if clashes:
+            raise ValueError(
+                f"Stations of feed source {source.name} clash with another "
+                f"source's ({', '.join(sorted(clashes)[:5])}), give it a prefix"
+            )
+        self._station_info.update(stations)
+
+    @staticmethod
+    def _build_stops_index(stations: dict[str, StationInfo]) -> dict[str, str]:
         stops: dict[str, str] = {}
-        for station_id in stations.keys():
-            for stop_id in stations[station_id].d["stops"].keys():
+        for station_id, info in stations.items():
+            for stop_id in info.stops:
                 stops[stop_id] = station_id
 
         return stops
 
-    def _load_mta_feed(self, feed_url: str) -> Optional[FeedResponse]:
+    def _build_route_stations(self, route_table: RouteTable) -> dict[str, set[str]]:
+        route_stations: defaultdict[str, set[str]] = defaultdict(set)
+        for route_id in route_table.route_ids():
+            record = route_table.get(route_id)
+            if not record:
+                continue
+            station_ids = route_stations[normalize_route_id(route_id)]
+            for stop_id in chain.from_iterable(record.stop_sequences.values()):
+                # A stop the stations file doesn't list is looked up by its
+                # parent station
+                station_id = self._stops_to_stations.get(stop_id)
+                if station_id is None:
+                    parent = route_table.parent_station(stop_id)
+                    station_id = self._stops_to_stations.get(parent) if parent else None
+                if station_id is not None:
+                    station_ids.add(station_id)
+        return dict(route_stations)
+
+    def _fetch_mta_feed(self, feed_url: str) -> Optional[bytes]:
+        start = time.perf_counter()
         try:
             r = request.Request(feed_url)
-            with contextlib.closing(request.urlopen(r)) as r:
-                data: str = r.read()
-                return FeedResponse(data)
+            with contextlib.closing(
+                request.urlopen(r, timeout=self._FEED_TIMEOUT)
+            ) as r:
+                data: bytes = r.read()
 
         except Exception as e:
             logger.error("Couldn't connect to MTA server: " + str(e))
+            FEED_ERRORS.inc(feed_name(feed_url), "fetch")
+            return None
+        finally:
+            FEED_FETCH_SECONDS.observe(time.perf_counter() - start, feed_name(feed_url))
+
+        if self._archiver:
+            try:
+                self._archiver.append(
+                    feed_url, self._cycle_started_at, time.time(), data
+                )
+            except OSError as e:
+                logger.error("Couldn't archive feed: " + str(e))
+
+        return data
+
+    def _read_feed(
+        self, feed_url: str, payloads: Optional[dict[str, bytes]] = None
+    ) -> Optional[bytes]:
+        """The raw feed, or None if it failed or its breaker is open."""
+        if payloads is not None:
+            return payloads.get(feed_url)
+
+        breaker = self._breakers[feed_url]
+        if not breaker.allow():
             return None
 
-    def update(self):
-        logger.info("updating...")
-        self._last_update = datetime.now(TZ)
+        payload = self._fetch_mta_feed(feed_url)
+        if payload is None:
+            breaker.record_failure()
+        return payload
 
-        # create working copy for thread safety
-        stations = copy.deepcopy(self._stations)
+    def _decode(self, feed_url: str, payload: bytes, now_epoch: int) -> Future:
+        if self._decoder:
+            return self._decoder.submit(
+                decode_partition, feed_url, payload, now_epoch, time.time()
+            )
 
-        # clear old times
-        for id in stations:
-            stations[id].clear_train_data()
+        future: Future = Future()
+        try:
+            future.set_result(
+                decode_partition(
+                    feed_url,
+                    payload,
+                    now_epoch,
+                    time.time(),
+                    self._stops_to_stations,
+                    self._feed_sources[feed_url],
+                )
+            )
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _settle_partition(
+        self,
+        feed_url: str,
+        decoded: Optional[Future],
+        replaying: bool = False,
+    ) -> Optional[FeedPartition]:
+        """The feed's decoded partition. While the feed is failing or its
+        breaker is open, the last good partition is returned instead."""
+        feed = feed_name(feed_url)
+        partition = None
+        if decoded is not None:
+            try:
+                partition = decoded.result()
+            except Exception as e:
+                logger.error("Couldn't parse MTA feed: " + str(e))
+                FEED_ERRORS.inc(feed, "parse")
+
+        if not replaying:
+            breaker = self._breakers[feed_url]
+            if partition:
+                breaker.record_success()
+            elif decoded is not None:
+                breaker.record_failure()
+            FEED_CIRCUIT_OPEN.set(int(breaker.state == BreakerState.OPEN), feed)
+
+        if partition:
+            self._last_good[feed_url] = partition
+            self._stale_feeds.discard(feed_url)
+
+            FEED_PARSE_SECONDS.observe(partition.parse_seconds, feed)
+            FEED_ENTITIES.inc(feed, amount=partition.entities)
+            STOP_TIME_UPDATES.inc(feed, amount=partition.stop_updates)
+            UNKNOWN_STOPS.inc(feed, amount=partition.unknown_stops.total())
+            return partition
+
+        partition = self._last_good.get(feed_url)
+        if partition:
+            logger.warning("Serving %s from %s", feed, partition.feed_time)
+            FEED_STALE.inc(feed)
+            self._stale_feeds.add(feed_url)
+        return partition
+
+    def update(
+        self,
+        now: Optional[datetime] = None,
+        payloads: Optional[dict[str, bytes]] = None,
+    ):
+        """Rebuild the snapshot from the feeds. `now` and `payloads` (feed url
+        -> raw feed) replace the clock and the network when replaying."""
+        with self._generation_lock:
+            self._started_generation += 1
+            generation = self._started_generation
+
+        logger.info("updating (generation %d)...", generation)
+        update_start = time.perf_counter()
+        # Published as last_update along with the snapshot
+        updated_at = now or datetime.now(TZ)
+        now_epoch = int(updated_at.timestamp())
+        self._cycle_started_at = updated_at.timestamp()
+        max_epoch = now_epoch + self._MAX_MINUTES * 60
+
+        # New arrival records over the shared station metadata; the
+        # published snapshot is never modified
+        stations = {
+            id: Station(info, updated_at) for id, info in self._station_info.items()
+        }
 
         routes: defaultdict[str, set[str]] = defaultdict(set)
+        route_stations: defaultdict[str, set[str]] = defaultdict(set)
+        trips = TripIndex()
+        unknown_stop_ids: Counter[str] = Counter()
 
+        # Feeds are fetched in turn and decoded as they arrive, in worker
+        # processes when configured; only the merge below runs here
+        decoded: list[tuple[str, Optional[Future]]] = []
         for feed_url in self._FEED_URLS:
-            mta_data = self._load_mta_feed(feed_url)
+            if self._is_superseded(generation):
+                return
 
-            if not mta_data:
+            payload = self._read_feed(feed_url, payloads)
+            future = (
+                self._decode(feed_url, payload, now_epoch)
+                if payload is not None
+                else None
+            )
+            decoded.append((feed_url, future))
+
+        fresh_feeds = 0
+        stale_feeds = 0
+        for feed_url, future in decoded:
+            partition = self._settle_partition(feed_url, future, payloads is not None)
+            if partition is None:
                 continue
 
-            max_time = self._last_update + timedelta(minutes=self._MAX_MINUTES)
-
-            for entity in mta_data.get_entity():
-                trip = Trip(entity)
-
-                if not trip.is_valid():
+            if feed_url in self._stale_feeds:
+                stale_feeds += 1
+            else:
+                fresh_feeds += 1
+                unknown_stop_ids.update(partition.unknown_stops)
+
+            for (
+                station_id,
+                route_id,
+                direction,
+                epoch,
+                trip_id,
+                stop_id,
+            ) in partition.arrivals:
+                # A stale partition holds arrivals that have since passed
+                if epoch < now_epoch:
                     continue
 
-                direction: Literal["N", "S"] = trip.get_direction()
-                route_id: str = trip.get_route_id().upper()
-
-                for update in entity.trip_update.stop_time_update:
-                    trip_stop = TripStop(update)
-
-                    if (
-                        trip_stop.get_time() < self._last_update
-                        or trip_stop.get_time() > max_time
-                    ):
-                        continue
+                # The trip index keeps every upcoming stop, not only those
+                # inside the arrival window
+                trips.add(trip_id, route_id, direction, station_id, epoch)
 
-                    stop_id: str = trip_stop.get_stop_id()
-
-                    if stop_id not in self._stops_to_stations:
-                        logger.info("Stop %s not found", stop_id)
-                        continue
+                if epoch > max_epoch:
+                    continue
 
-                    station_id = self._stops_to_stations[stop_id]
-                    stations[station_id].add_train(
-                        route_id,
-                        direction,
-                        trip_stop.get_time(),
-                        mta_data.get_timestamp(),
-                    )
+                stations[station_id].add_train(
+                    route_id,
+                    direction,
+                    epoch,
+                    partition.feed_time,
+                    trip_id,
+                )
 
-                    routes[route_id].add(stop_id)
+                routes[route_id].add(stop_id)
+                route_stations[route_id].add(station_id)
 
         # sort by time
+        stale = stale_feeds > 0 and not fresh_feeds
         for id in stations:
             stations[id].sort_trains(self._MAX_TRAINS)
+            stations[id].stale = stale
+        trips.freeze()
+        self._unknown_stops.record(unknown_stop_ids, updated_at.timestamp())
+
+        if self._history:
+            self._history.record(now_epoch, trips)
 
         with self._read_lock:
+            if generation < self._generation:
+                return
             self._routes = routes
+            self._route_stations = route_stations
             self._stations = stations
+            self._trips = trips
+            self._generation = generation
+            self._last_update = updated_at
+
+        UPDATE_SECONDS.observe(time.perf_counter() - update_start)
+
+        if self._checkpoint_file and fresh_feeds:
+            self._write_checkpoint()
+
+    def _is_superseded(self, generation: int) -> bool:
+        if generation == self._started_generation:
+            return False
+        logger.info("Update %d superseded, stopping", generation)
+        return True
+
+    def refresh_if_expired(self):
+        """Refresh stale data for a request without piling up refreshes. With
+        the threader the refresh worker is woken instead. Otherwise one
+        request refreshes and concurrent ones are served the current
+        snapshot."""
+        if not self.is_expired():
+            return
+        if self._THREADED:
+            self.threader.wake()
+        elif self._refresh_lock.acquire(blocking=False):
+            try:
+                with phase("refresh"):
+                    self.update()
+            finally:
+                self._refresh_lock.release()
 
     def last_update(self):
         return self._last_update
 
-    def get_by_point(self, point: Location, limit: int = 5) -> list[SerializedStation]:
-        if self.is_expired():
-            self.update()
+    def generation(self) -> int:
+        """Increases every time a new snapshot is published."""
+        return self._generation
+
+    def _candidates(self, query: Optional[StationQuery]) -> Optional[list[Station]]:
+        """Stations a point query ranks: with a route filter only stations
+        served by one of the routes, otherwise None for every station,
+        searched through the spatial index. Call with the read lock held."""
+        if query and query.routes is not None:
+            return [
+                self._stations[id]
+                for id in set().union(
+                    *(self._route_stations.get(r, ()) for r in query.routes)
+                )
+            ]
+        return None
 
-        with self._read_lock:
-            sortable_stations = copy.deepcopy(self._stations).values()
+    def get_by_point(
+        self, point: Location, limit: int = 5, query: Optional[StationQuery] = None
+    ) -> list[SerializedStation]:
+        """The `limit` stations closest to `point`."""
+        return self.get_by_points([point], limit, query)[0]
 
-        sorted_stations = sorted(
-            sortable_stations, key=lambda s: distance(s.d["location"], point)
-        )
-        serialized_stations = map(lambda s: s.serialize(), sorted_stations)
+    def get_by_points(
+        self,
+        points: list[Location],
+        limit: int = 5,
+        query: Optional[StationQuery] = None,
+    ) -> list[list[SerializedStation]]:
+        """The `limit` stations closest to each point, read from one snapshot.
+        A station near several points is serialized once and shared."""
+        self.refresh_if_expired()
 
-        return list(islice(serialized_stations, limit))
+        with self._read_lock:
+            all_stations = self._stations
+            candidates = self._candidates(query)
+
+        serialized: dict[str, SerializedStation] = {}
+        out: list[list[SerializedStation]] = []
+        for point in points:
+            with phase("nearest_stations"):
+                if candidates is None:
+                    nearest = [
+                        all_stations[id]
+                        for id in self._station_index.nearest(point, limit)
+                    ]
+                else:
+                    nearest = nsmallest(
+                        limit,
+                        candidates,
+                        key=lambda s: distance(s.info.location, point),
+                    )
+            stations: list[SerializedStation] = []
+            with phase("station_serialize"):
+                for station in nearest:
+                    if station.info.id not in serialized:
+                        serialized[station.info.id] = station.serialize(query)
+                    stations.append(serialized[station.info.id])
+            out.append(stations)
+
+        return out
 
     def get_routes(self) -> list[str]:
         return list(self._routes.keys())
 
-    def get_stations_of_route(self, route: str) -> list[SerializedStation]:
+    def get_stations_of_route(
+        self, route: str, query: Optional[StationQuery] = None
+    ) -> list[SerializedStation]:
         route = route.upper()
 
-        if self.is_expired():
-            self.update()
+        self.refresh_if_expired()
 
-        with self._read_lock:
-            out = [
-                self._stations[self._stops_to_stations[k]].serialize()
-                for k in self._routes[route]
-            ]
+        # Every station on the route by the schedule, whether or not a train
+        # is due there now. Routes it doesn't know, such as other agencies',
+        # list the stations their trains currently serve. A station the
+        # route serves under several stop ids is listed once
+        with self._read_lock, phase("station_serialize"):
+            station_ids = (
+                self._scheduled_route_stations.get(route) or self._route_stations[route]
+            )
+            out = [self._stations[id].serialize(query) for id in station_ids]
 
         out.sort(key=lambda x: x["name"])
         return out
 
-    def get_by_id(self, ids: list[str]) -> list[SerializedStation]:
-        if self.is_expired():
-            self.update()
+    def get_by_id(
+        self, ids: list[str], query: Optional[StationQuery] = None
+    ) -> list[SerializedStation]:
+        self.refresh_if_expired()
+
+        with self._read_lock, phase("station_serialize"):
+            out = [self._stations[k].serialize(query) for k in ids]
+
+        return out
+
+    def get_trips(self) -> TripIndex:
+        """Every trip of the current snapshot. Frozen, so safe to read
+        without the lock."""
+        self.refresh_if_expired()
+
+        with self._read_lock:
+            return self._trips
+
+    def get_trip(self, trip_id: str) -> Optional[TripTimeline]:
+        self.refresh_if_expired()
 
         with self._read_lock:
-            out = [self._stations[k].serialize() for k in ids]
+            return self._trips.get(trip_id)
 
+    def get_travel_time(
+        self, trip_id: str, origin: str, destination: str
+    ) -> Optional[tuple[datetime, datetime]]:
+        """When `trip_id` leaves station `origin` and reaches station
+        `destination`."""
+        self.refresh_if_expired()
+
+        with self._read_lock:
+            times = self._trips.travel_time(trip_id, origin, destination)
+
+        if times is None:
+            return None
+        return datetime.fromtimestamp(times[0], TZ), datetime.fromtimestamp(
+            times[1], TZ
+        )
+
+    def get_headway_stats(
+        self,
+        station_id: Optional[str] = None,
+        route: Optional[str] = None,
+        direction: Optional[Literal["N", "S"]] = None,
+    ) -> list[HeadwayStats]:
+        if not self._history:
+            return []
+        return self._history.stats(station_id, route, direction)
+
+    def get_unknown_stops(self, limit: int = 20) -> list[UnknownStop]:
+        return self._unknown_stops.top(limit)
+
+    def get_feed_status(self) -> list[FeedStatus]:
+        out: list[FeedStatus] = []
+        for feed_url in self._FEED_URLS:
+            breaker = self._breakers[feed_url]
+            partition = self._last_good.get(feed_url)
+            out.append(
+                FeedStatus(
+                    feed=feed_name(feed_url),
+                    source=self._feed_sources[feed_url].name,
+                    state=breaker.state,
+                    consecutive_failures=breaker.consecutive_failures,
+                    retry_in=breaker.seconds_until_retry(),
+                    feed_time=partition.feed_time if partition else None,
+                    last_success=(
+                        datetime.fromtimestamp(partition.fetched_at, TZ)
+                        if partition
+                        else None
+                    ),
+                    stale=feed_url in self._stale_feeds,
+                )
+            )
         return out
 
+    def get_nearest_station_ids(self, point: Location, limit: int = 5) -> list[str]:
+        return self._station_index.nearest(point, limit)
+
+    def get_station_location(self, station_id: str) -> tuple[float, float]:
+        return self._station_info[station_id].location
+
+    def get_station_name(self, station_id: str) -> str:
+        return self._station_info[station_id].name
+
+    def has_station(self, station_id: str) -> bool:
+        return station_id in self._station_info
+
+    def get_station_of_stop(self, stop_id: str) -> Optional[str]:
+        return self._stops_to_stations.get(stop_id)
+
     def is_expired(self) -> bool:
         if self._THREADED and self.threader and self.threader.restart_if_dead():
             return False
@@ -277,52 +940,65 @@ class Mtapi(object):
 
 
 class MtapiThreader(object):
-
-    LOCK_TIMEOUT = 300
-    update_lock = threading.Lock()
-    update_lock_time = datetime.now()
+    """Runs every refresh on a single long-lived thread. A refresh that
+    overruns the interval delays the next one rather than overlapping it."""
 
     def __init__(self, mtapi: Mtapi, expires_seconds: int = 60):
         self.mtapi = mtapi
         self.EXPIRES_SECONDS = expires_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.update_thread: Optional[threading.Thread] = None
 
-    def start_timer(self):
+    def start_timer(self, update_immediately: bool = False):
         """Start a long-lived thread to loop infinitely and trigger updates at
         some regular interval."""
 
         logger.info("Starting update thread...")
-        self.timer_thread = threading.Thread(target=self.update_timer)
-        self.timer_thread.daemon = True
-        self.timer_thread.start()
-
-    def update_timer(self):
-        """This method runs in its own thread. Run feed updates in short-lived
-        threads."""
-        while True:
-            sleep(self.EXPIRES_SECONDS)
-            self.update_thread = threading.Thread(target=self.locked_update)
-            self.update_thread.start()
+        self._stop.clear()
+        self.update_thread = threading.Thread(
+            target=self.update_timer, args=(update_immediately,), name="mtapi-update"
+        )
+        self.update_thread.daemon = True
+        self.update_thread.start()
 
-    def locked_update(self):
-        if not self.update_lock.acquire(False):
-            logger.info("Update locked!")
+    def update_timer(self, update_immediately: bool = False):
+        """This method runs in its own thread."""
+        next_update = time.monotonic()
+        if not update_immediately:
+            next_update += self.EXPIRES_SECONDS
 
-            lock_age = datetime.now() - self.update_lock_time
-            if lock_age.total_seconds() < self.LOCK_TIMEOUT:
+        while True:
+            self._wake.wait(max(next_update - time.monotonic(), 0))
+            if self._stop.is_set():
                 return
-            else:
-                self.update_lock = threading.Lock()
-                logger.warning("Cleared expired update lock")
-
-        self.update_lock_time = datetime.now()
-
-        self.mtapi.update()
-
-        self.update_lock.release()
+            self._wake.clear()
+
+            started = time.monotonic()
+            try:
+                self.mtapi.update()
+            except Exception:
+                logger.exception("Update failed")
+            # Wakes that arrived during the refresh are already served by it
+            self._wake.clear()
+
+            next_update = started + self.EXPIRES_SECONDS
+            overrun = time.monotonic() - next_update
+            if overrun > 0:
+                logger.warning("Update overran its interval by %.1fs", overrun)
+
+    def wake(self):
+        """Refresh now instead of at the next interval. Does nothing while a
+        refresh is running."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
 
     def restart_if_dead(self):
-        if not self.timer_thread.is_alive():
-            logger.warning("Timer died")
+        if self.update_thread is None or not self.update_thread.is_alive():
+            logger.warning("Update thread died")
             self.start_timer()
             return True
 
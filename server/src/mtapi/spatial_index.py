@@ -0,0 +1,91 @@
+"""
+Uniform grid over station locations, so nearest station queries only look at
+the cells around the query point instead of every station.
+"""
+
+import math
+from heapq import heappush, heappushpop
+from typing import Iterable
+
+# Stations per cell the grid is sized for
+STATIONS_PER_CELL = 4
+
+
+class GridIndex:
+    """Nearest neighbours by Euclidean distance in degrees, as
+    mtapi.distance measures it. Ties go to the earlier inserted id, as
+    heapq.nsmallest breaks them."""
+
+    def __init__(self, points: Iterable[tuple[str, tuple[float, float]]]):
+        entries = [(id, lat, lng) for id, (lat, lng) in points]
+        self._size = len(entries)
+        self._cells: dict[tuple[int, int], list[tuple[int, str, float, float]]] = {}
+        if not entries:
+            self._cell_size = 1.0
+            self._bounds = (0, 0, -1, -1)
+            return
+
+        min_lat = min(e[1] for e in entries)
+        max_lat = max(e[1] for e in entries)
+        min_lng = min(e[2] for e in entries)
+        max_lng = max(e[2] for e in entries)
+        area = max(max_lat - min_lat, 1e-6) * max(max_lng - min_lng, 1e-6)
+        self._cell_size = math.sqrt(area * STATIONS_PER_CELL / len(entries))
+
+        for order, (id, lat, lng) in enumerate(entries):
+            self._cells.setdefault(self._cell(lat, lng), []).append(
+                (order, id, lat, lng)
+            )
+        rows = [row for row, _ in self._cells]
+        cols = [col for _, col in self._cells]
+        self._bounds = (min(rows), min(cols), max(rows), max(cols))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _cell(self, lat: float, lng: float) -> tuple[int, int]:
+        return math.floor(lat / self._cell_size), math.floor(lng / self._cell_size)
+
+    def _ring(self, row: int, col: int, r: int) -> Iterable[tuple[int, int]]:
+        """Occupied-area cells at Chebyshev distance `r` from (row, col)."""
+        min_row, min_col, max_row, max_col = self._bounds
+        cols = range(max(col - r, min_col), min(col + r, max_col) + 1)
+        for ring_row in (row - r, row + r) if r else (row,):
+            if min_row <= ring_row <= max_row:
+                for ring_col in cols:
+                    yield ring_row, ring_col
+        if r:
+            rows = range(max(row - r + 1, min_row), min(row + r - 1, max_row) + 1)
+            for ring_col in (col - r, col + r):
+                if min_col <= ring_col <= max_col:
+                    for ring_row in rows:
+                        yield ring_row, ring_col
+
+    def nearest(self, point: tuple[float, float] | list[float], k: int) -> list[str]:
+        """Ids of the `k` points closest to `point`, closest first."""
+        if k <= 0 or not self._size:
+            return []
+        lat, lng = point
+        row, col = self._cell(lat, lng)
+        min_row, min_col, max_row, max_col = self._bounds
+        # Rings closer than the occupied area are empty; rings past it
+        # can't hold anything
+        first = max(min_row - row, row - max_row, min_col - col, col - max_col, 0)
+        last = max(row - min_row, max_row - row, col - min_col, max_col - col)
+
+        # Max heap of the best k so far, as (-distance², -order, id)
+        best: list[tuple[float, int, str]] = []
+        for r in range(first, last + 1):
+            for cell in self._ring(row, col, r):
+                for order, id, station_lat, station_lng in self._cells.get(cell, ()):
+                    d = (station_lat - lat) ** 2 + (station_lng - lng) ** 2
+                    item = (-d, -order, id)
+                    if len(best) < k:
+                        heappush(best, item)
+                    elif item > best[0]:
+                        heappushpop(best, item)
+            # Unvisited cells are at least r cells from the query point
+            if len(best) == k and -best[0][0] < (r * self._cell_size) ** 2:
+                break
+
+        return [id for _, _, id in sorted(best, reverse=True)]
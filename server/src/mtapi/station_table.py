@@ -0,0 +1,114 @@
+"""
+Packed binary station table, an alternative to stations.json that loads
+without parsing JSON.
+
+Layout (little endian):
+    header
+    station records  fixed width, in station id order
+    stop records     fixed width, grouped by station
+    string pool      utf-8, referenced by (offset, length)
+"""
+
+import mmap, struct
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+from src.string_pool import StringPoolWriter, read_string
+
+MAGIC = b"MSTB"
+VERSION = 1
+
+# magic, version, station count, stop count, pool size
+HEADER = struct.Struct("<4sHIII")
+# id, name, lat, lng, first stop, stop count
+STATION = struct.Struct("<IHIHddIH")
+# stop id, lat, lng
+STOP = struct.Struct("<IHdd")
+
+
+class StationRecord(NamedTuple):
+    id: str
+    name: str
+    location: tuple[float, float]
+    # Stop coordinates are stored, but nothing reads them
+    stops: tuple[str, ...]
+
+
+def write_station_table(stations: dict, out_path: Path):
+    """`stations` is the stations.json structure: id -> StationDict."""
+    pool = StringPoolWriter()
+    station_records = bytearray()
+    stop_records = bytearray()
+    stop_count = 0
+
+    for station_id in sorted(stations):
+        station = stations[station_id]
+        stops = station["stops"]
+        station_records += STATION.pack(
+            *pool.add(station["id"]),
+            *pool.add(station["name"]),
+            station["location"][0],
+            station["location"][1],
+            stop_count,
+            len(stops),
+        )
+        for stop_id in sorted(stops):
+            stop_records += STOP.pack(*pool.add(stop_id), *stops[stop_id])
+            stop_count += 1
+
+    pool_data = pool.getvalue()
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(stations), stop_count, len(pool_data)))
+        f.write(station_records)
+        f.write(stop_records)
+        f.write(pool_data)
+    tmp_path.replace(out_path)
+
+
+class StationTable:
+    """Read-only view over a station table file. The file is mapped rather than
+    read, and records are decoded straight into StationRecords as they are
+    iterated, without an intermediate StationDict."""
+
+    def __init__(self, buf: mmap.mmap | bytes):
+        self._buf = buf
+        magic, version, self._station_count, stop_count, _ = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a version %d station table" % VERSION)
+        self._stations_start = HEADER.size
+        self._stops_start = self._stations_start + self._station_count * STATION.size
+        self._pool_start = self._stops_start + stop_count * STOP.size
+
+    @staticmethod
+    def open(path: Path) -> "StationTable":
+        with open(path, "rb") as f:
+            return StationTable(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return self._station_count
+
+    def __iter__(self) -> Iterator[StationRecord]:
+        for i in range(self._station_count):
+            yield self.record(i)
+
+    def _string(self, offset: int, length: int) -> str:
+        return read_string(self._buf, self._pool_start, offset, length)
+
+    def record(self, i: int) -> StationRecord:
+        """Decode the i'th station."""
+        id_offset, id_length, name_offset, name_length, lat, lng, first, count = (
+            STATION.unpack_from(self._buf, self._stations_start + i * STATION.size)
+        )
+        stops = tuple(
+            self._string(
+                *STOP.unpack_from(self._buf, self._stops_start + j * STOP.size)[:2]
+            )
+            for j in range(first, first + count)
+        )
+        return StationRecord(
+            self._string(id_offset, id_length),
+            self._string(name_offset, name_length),
+            (lat, lng),
+            stops,
+        )
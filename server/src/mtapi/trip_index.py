@@ -0,0 +1,99 @@
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Iterator, Literal, Optional
+
+
+@dataclass(frozen=True)
+class TripStopTime:
+    station_id: str
+    epoch: int
+
+
+class TripTimeline:
+    """Upcoming stops of a single trip, ordered by arrival time."""
+
+    __slots__ = ("trip_id", "route_id", "direction", "station_ids", "epochs", "_lookup")
+
+    def __init__(self, trip_id: str, route_id: str, direction: Literal["N", "S"]):
+        self.trip_id = trip_id
+        self.route_id = route_id
+        self.direction: Literal["N", "S"] = direction
+        self.station_ids: list[str] = []
+        self.epochs: array[int] = array("q")
+        # (station_id, position) sorted by station_id, built by freeze()
+        self._lookup: list[tuple[str, int]] = []
+
+    def add(self, station_id: str, epoch: int):
+        self.station_ids.append(station_id)
+        self.epochs.append(epoch)
+
+    def freeze(self):
+        order = sorted(range(len(self.epochs)), key=self.epochs.__getitem__)
+        self.station_ids = [self.station_ids[i] for i in order]
+        self.epochs = array("q", (self.epochs[i] for i in order))
+        self._lookup = sorted((s, i) for i, s in enumerate(self.station_ids))
+
+    def position_of(self, station_id: str, after: int = -1) -> Optional[int]:
+        i = bisect_left(self._lookup, (station_id, after + 1))
+        if i < len(self._lookup) and self._lookup[i][0] == station_id:
+            return self._lookup[i][1]
+        return None
+
+    def next_stop_index(self, now_epoch: int) -> Optional[int]:
+        """Position of the first stop the train has not reached yet."""
+        i = bisect_left(self.epochs, now_epoch)
+        return i if i < len(self.epochs) else None
+
+    def stops(self) -> list[TripStopTime]:
+        return [TripStopTime(s, e) for s, e in zip(self.station_ids, self.epochs)]
+
+
+class TripIndex:
+    """Trips of a single snapshot keyed by trip_id. Filled during
+    Mtapi.update and frozen before it is published."""
+
+    def __init__(self):
+        self._trips: dict[str, TripTimeline] = {}
+
+    def __len__(self) -> int:
+        return len(self._trips)
+
+    def __iter__(self) -> Iterator[TripTimeline]:
+        return iter(self._trips.values())
+
+    def add(
+        self,
+        trip_id: str,
+        route_id: str,
+        direction: Literal["N", "S"],
+        station_id: str,
+        epoch: int,
+    ):
+        timeline = self._trips.get(trip_id)
+        if timeline is None:
+            timeline = self._trips[trip_id] = TripTimeline(trip_id, route_id, direction)
+        timeline.add(station_id, epoch)
+
+    def freeze(self):
+        for timeline in self._trips.values():
+            timeline.freeze()
+
+    def get(self, trip_id: str) -> Optional[TripTimeline]:
+        return self._trips.get(trip_id)
+
+    def travel_time(
+        self, trip_id: str, origin: str, destination: str
+    ) -> Optional[tuple[int, int]]:
+        """(departure, arrival) epochs of `trip_id` between two stations, or None
+        if the trip doesn't call at origin before destination."""
+        timeline = self._trips.get(trip_id)
+        if timeline is None:
+            return None
+        start = timeline.position_of(origin)
+        if start is None:
+            return None
+        end = timeline.position_of(destination, after=start)
+        if end is None:
+            return None
+        return timeline.epochs[start], timeline.epochs[end]
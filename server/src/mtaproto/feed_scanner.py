@@ -0,0 +1,213 @@
+"""
+Selective decoder for GTFS-realtime feeds with the NYCT extensions.
+
+Reads the protobuf wire format directly and keeps only what Mtapi uses: the
+header timestamp and, for every trip update, the trip id, route id, NYCT
+direction, GTFS direction id and each stop's id and arrival (or departure)
+time. Every other
+field, vehicle positions and alerts included, is skipped by advancing the
+offset, without materializing it.
+
+Field numbers, from gtfs-realtime.proto and nyct-subway.proto:
+    FeedMessage     header = 1, entity = 2
+    FeedHeader      timestamp = 3
+    FeedEntity      trip_update = 3
+    TripUpdate      trip = 1, stop_time_update = 2
+    TripDescriptor  trip_id = 1, route_id = 5, direction_id = 6,
+                    nyct_trip_descriptor = 1001
+    NyctTripDescriptor  direction = 3
+    StopTimeUpdate  arrival = 2, departure = 3, stop_id = 4
+    StopTimeEvent   time = 2
+"""
+
+from dataclasses import dataclass, field
+from typing import Literal, TypeAlias
+
+VARINT, FIXED64, LENGTH_DELIMITED, FIXED32 = 0, 1, 2, 5
+
+# NyctTripDescriptor.Direction, by the first letter of its name. Unset and
+# unknown values read as NORTH, the enum's default, as protobuf does.
+_DIRECTIONS = {1: "N", 2: "E", 3: "S", 4: "W"}
+
+# stop id, arrival epoch (0 if the update has no time)
+ScannedStop: TypeAlias = tuple[str, int]
+# trip id, route id, NYCT direction, direction id (-1 if unset), stops
+ScannedTrip: TypeAlias = tuple[
+    str, str, Literal["N", "E", "S", "W"], int, list[ScannedStop]
+]
+
+
+class DecodeError(ValueError):
+    pass
+
+
+@dataclass
+class ScannedFeed:
+    timestamp: int = 0
+    entity_count: int = 0
+    trips: list[ScannedTrip] = field(default_factory=list)
+
+
+def _varint(buf: bytes, pos: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _skip(buf: bytes, pos: int, wire_type: int) -> int:
+    if wire_type == VARINT:
+        while buf[pos] & 0x80:
+            pos += 1
+        return pos + 1
+    if wire_type == LENGTH_DELIMITED:
+        length, pos = _varint(buf, pos)
+        return pos + length
+    if wire_type == FIXED64:
+        return pos + 8
+    if wire_type == FIXED32:
+        return pos + 4
+    raise DecodeError(f"Unsupported wire type {wire_type}")
+
+
+def _int64(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _header_timestamp(buf: bytes, pos: int, end: int) -> int:
+    timestamp = 0
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == (3 << 3 | VARINT):
+            timestamp, pos = _varint(buf, pos)
+        else:
+            pos = _skip(buf, pos, key & 7)
+    return timestamp
+
+
+def _direction(buf: bytes, pos: int, end: int) -> str:
+    direction = "N"
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == (3 << 3 | VARINT):
+            value, pos = _varint(buf, pos)
+            direction = _DIRECTIONS.get(value, "N")
+        else:
+            pos = _skip(buf, pos, key & 7)
+    return direction
+
+
+def _event_time(buf: bytes, pos: int, end: int) -> int:
+    time = 0
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == (2 << 3 | VARINT):
+            value, pos = _varint(buf, pos)
+            time = _int64(value)
+        else:
+            pos = _skip(buf, pos, key & 7)
+    return time
+
+
+def _stop(buf: bytes, pos: int, end: int) -> ScannedStop:
+    stop_id = ""
+    arrival = departure = 0
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key & 7 != LENGTH_DELIMITED:
+            pos = _skip(buf, pos, key & 7)
+            continue
+        length, pos = _varint(buf, pos)
+        field_number = key >> 3
+        if field_number == 4:
+            stop_id = buf[pos : pos + length].decode()
+        elif field_number == 2:
+            arrival = _event_time(buf, pos, pos + length)
+        elif field_number == 3:
+            departure = _event_time(buf, pos, pos + length)
+        pos += length
+    return stop_id, arrival or departure
+
+
+def _trip_update(buf: bytes, pos: int, end: int) -> ScannedTrip:
+    trip_id = route_id = ""
+    direction = "N"
+    direction_id = -1
+    stops: list[ScannedStop] = []
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key & 7 != LENGTH_DELIMITED:
+            pos = _skip(buf, pos, key & 7)
+            continue
+        length, pos = _varint(buf, pos)
+        field_end = pos + length
+        field_number = key >> 3
+        if field_number == 2:
+            stops.append(_stop(buf, pos, field_end))
+        elif field_number == 1:
+            # TripDescriptor, read inline
+            while pos < field_end:
+                key, pos = _varint(buf, pos)
+                if key == (6 << 3 | VARINT):
+                    direction_id, pos = _varint(buf, pos)
+                    continue
+                if key & 7 != LENGTH_DELIMITED:
+                    pos = _skip(buf, pos, key & 7)
+                    continue
+                length, pos = _varint(buf, pos)
+                field_number = key >> 3
+                if field_number == 1:
+                    trip_id = buf[pos : pos + length].decode()
+                elif field_number == 5:
+                    route_id = buf[pos : pos + length].decode()
+                elif field_number == 1001:
+                    direction = _direction(buf, pos, pos + length)
+                pos += length
+        pos = field_end
+    return trip_id, route_id, direction, direction_id, stops  # type: ignore
+
+
+def scan_feed(payload: bytes) -> ScannedFeed:
+    """Decode the parts of a FeedMessage Mtapi uses. Raises DecodeError if the
+    payload isn't a well formed protobuf message."""
+    feed = ScannedFeed()
+    buf = payload
+    end = len(buf)
+    pos = 0
+    try:
+        while pos < end:
+            key, pos = _varint(buf, pos)
+            if key & 7 != LENGTH_DELIMITED:
+                pos = _skip(buf, pos, key & 7)
+                continue
+            length, pos = _varint(buf, pos)
+            field_end = pos + length
+            if field_end > end:
+                raise DecodeError("Truncated message")
+
+            field_number = key >> 3
+            if field_number == 2:
+                feed.entity_count += 1
+                # FeedEntity: only its trip update is read
+                while pos < field_end:
+                    key, pos = _varint(buf, pos)
+                    if key == (3 << 3 | LENGTH_DELIMITED):
+                        length, pos = _varint(buf, pos)
+                        feed.trips.append(_trip_update(buf, pos, pos + length))
+                        pos += length
+                    else:
+                        pos = _skip(buf, pos, key & 7)
+            elif field_number == 1:
+                feed.timestamp = _header_timestamp(buf, pos, field_end)
+            pos = field_end
+    except IndexError:
+        raise DecodeError("Truncated message")
+
+    if pos != end:
+        raise DecodeError("Truncated message")
+    return feed
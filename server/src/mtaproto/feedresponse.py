@@ -6,6 +6,13 @@ from datetime import datetime
 TZ = timezone("US/Eastern")
 
 
+def normalize_route_id(route_id: str) -> str:
+    # The 42 St shuttle is published as GS but signed as S
+    if route_id == "GS":
+        return "S"
+    return route_id
+
+
 class FeedResponse(object):
 
     def __init__(self, response_string: str):
@@ -27,10 +34,7 @@ class Trip(object):
         self._pb_data = pb_data
 
     def get_route_id(self) -> str:
-        if self._pb_data.trip_update.trip.route_id == "GS":  # type: ignore
-            return "S"
-        else:
-            return self._pb_data.trip_update.trip.route_id  # type: ignore
+        return normalize_route_id(self._pb_data.trip_update.trip.route_id)  # type: ignore
 
     def get_direction(self) -> Literal["N", "S"]:
         trip_meta = self._pb_data.trip_update.trip.Extensions[  # type: ignore
@@ -47,8 +51,10 @@ class TripStop(object):
         self._pb_data = pb_data
 
     def get_time(self) -> datetime:
-        raw_time = self._pb_data.arrival.time or self._pb_data.departure.time  # type: ignore
-        return datetime.fromtimestamp(raw_time, TZ)  # type: ignore
+        return datetime.fromtimestamp(self.get_epoch(), TZ)  # type: ignore
+
+    def get_epoch(self) -> int:
+        return self._pb_data.arrival.time or self._pb_data.departure.time  # type: ignore
 
     def get_stop_id(self) -> str:
         return str(self._pb_data.stop_id[:3])  # type: ignore
@@ -0,0 +1,88 @@
+"""
+Synthetic NYCT GTFS-RT feeds shaped like the real ones, for benchmarks and
+offline testing.
+"""
+
+import random
+from typing import Optional
+
+from src.mtaproto import nyct_subway_pb2
+
+# Feed url suffix -> routes published in that feed
+NYCT_FEED_ROUTES: dict[str, list[str]] = {
+    "nyct%2Fgtfs": ["1", "2", "3", "4", "5", "6", "7", "GS"],
+    "nyct%2Fgtfs-l": ["L"],
+    "nyct%2Fgtfs-nqrw": ["N", "Q", "R", "W"],
+    "nyct%2Fgtfs-bdfm": ["B", "D", "F", "M"],
+    "nyct%2Fgtfs-ace": ["A", "C", "E"],
+    "nyct%2Fgtfs-si": ["SI"],
+    "nyct%2Fgtfs-jz": ["J", "Z"],
+    "nyct%2Fgtfs-g": ["G"],
+}
+
+NORTH = nyct_subway_pb2.NyctTripDescriptor.Direction.Value("NORTH")
+SOUTH = nyct_subway_pb2.NyctTripDescriptor.Direction.Value("SOUTH")
+
+
+def routes_for_feed(feed_url: str) -> list[str]:
+    return NYCT_FEED_ROUTES.get(feed_url.rsplit("/", 1)[-1], [])
+
+
+def _route_stops(stop_ids: list[str], route_id: str, rng: random.Random) -> list[str]:
+    # NYCT stop ids mostly start with their line's letter or number
+    stops = [s for s in stop_ids if s[0] == route_id[0]]
+    if len(stops) < 10:
+        start = rng.randrange(max(len(stop_ids) - 30, 1))
+        stops = stop_ids[start : start + 30]
+    return stops
+
+
+def synthetic_feed(
+    stop_ids: list[str],
+    route_ids: list[str],
+    now: int,
+    trips_per_route: int = 40,
+    seed: Optional[int] = 0,
+    timestamp: Optional[int] = None,
+) -> bytes:
+    """A serialized FeedMessage with `trips_per_route` trips per route, each
+    with a trip update over the route's stops and a vehicle position, like
+    the real feeds carry."""
+    rng = random.Random(seed)
+    message = nyct_subway_pb2.gtfs__realtime__pb2.FeedMessage()
+    message.header.gtfs_realtime_version = "1.0"
+    message.header.timestamp = timestamp or now
+
+    for route_id in route_ids:
+        stops = _route_stops(stop_ids, route_id, rng)
+        for t in range(trips_per_route):
+            northbound = t % 2 == 0
+            trip_id = f"{rng.randrange(1_000_000):06d}_{route_id}..{'N' if northbound else 'S'}"
+            ordered = stops if northbound else stops[::-1]
+            first = rng.randrange(len(ordered))
+            # Some stops of each trip are already in the past
+            arrival = now - rng.randrange(0, 300)
+
+            entity = message.entity.add()
+            entity.id = f"{route_id}{t}"
+            trip = entity.trip_update.trip
+            trip.trip_id = trip_id
+            trip.route_id = route_id
+            trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].direction = (
+                NORTH if northbound else SOUTH
+            )
+            for stop_id in ordered[first:]:
+                update = entity.trip_update.stop_time_update.add()
+                update.stop_id = stop_id + ("N" if northbound else "S")
+                update.arrival.time = arrival
+                update.departure.time = arrival + 30
+                arrival += rng.randrange(60, 180)
+
+            vehicle = message.entity.add()
+            vehicle.id = f"{route_id}{t}v"
+            vehicle.vehicle.trip.trip_id = trip_id
+            vehicle.vehicle.trip.route_id = route_id
+            vehicle.vehicle.stop_id = ordered[first]
+            vehicle.vehicle.timestamp = now
+
+    return message.SerializeToString()
@@ -0,0 +1,101 @@
+"""
+Sampling profiler that can be started and stopped inside the running server.
+
+Every `interval` seconds the stack of each thread is captured from
+sys._current_frames(). Samples are written in the collapsed stack format
+("thread;outer;...;inner count" per line) that flamegraph.pl and speedscope
+read directly.
+"""
+
+import logging, sys, threading, time
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Thread name prefix -> label used as the root frame of its stacks
+THREAD_LABELS = {
+    "mtapi-update": "mtapi-update",
+    "AnyIO worker thread": "request",
+    "MainThread": "event-loop",
+}
+
+
+def _thread_label(name: str) -> str:
+    for prefix, label in THREAD_LABELS.items():
+        if name.startswith(prefix):
+            return label
+    return name
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+    names: list[str] = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_qualname} ({Path(code.co_filename).name})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, out_dir: Path, interval: float = 0.01):
+        self.out_dir = out_dir
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.out_path: Optional[Path] = None
+        self.deadline: Optional[float] = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float) -> Optional[Path]:
+        """Sample for `seconds`, then write the profile. Returns the path it
+        will be written to, or None if a profile is already running."""
+        with self._lock:
+            if self.is_running():
+                return None
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            self.out_path = self.out_dir / f"profile-{int(time.time())}.collapsed"
+            self.deadline = time.monotonic() + seconds
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(self.out_path, self.deadline), daemon=True
+            )
+            self._thread.start()
+            logger.warning("Profiling for %ss into %s", seconds, self.out_path)
+            return self.out_path
+
+    def stop(self) -> Optional[Path]:
+        """Stop early and wait for the profile to be written."""
+        thread = self._thread
+        if thread is None:
+            return None
+        self._stop.set()
+        thread.join()
+        return self.out_path
+
+    def _run(self, out_path: Path, deadline: float):
+        own_ident = threading.get_ident()
+        samples: Counter[str] = Counter()
+        names: dict[int, str] = {}
+
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            if not names.keys() >= frames.keys():
+                names = {t.ident: t.name for t in threading.enumerate() if t.ident}
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+                label = _thread_label(names.get(ident, str(ident)))
+                samples[f"{label};{_collapse(frame)}"] += 1
+            del frames
+            self._stop.wait(self.interval)
+
+        with open(out_path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.warning("Wrote %d stacks to %s", len(samples), out_path)
@@ -0,0 +1,130 @@
+"""
+Per-request phase timing, returned in a Server-Timing header.
+
+Code doing a distinct part of a request's work, in main.py or the services
+it calls, wraps it in `phase(name)`. While a request is timed its
+RequestTimings sits in a context variable, which follows the request into
+the worker thread running its endpoint; phases add their durations to it,
+and repeated phases accumulate. Outside a timed request `phase` returns a
+shared no-op context manager, so instrumented code costs a context
+variable lookup when timing is disabled.
+
+TimedRoute marks when each endpoint returns, so the time FastAPI then takes
+to validate and encode the response is reported as the `serialize` phase.
+"""
+
+import functools, inspect, time
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from fastapi.routing import APIRoute
+
+from src.metrics import Histogram
+
+REQUEST_PHASE_SECONDS = Histogram(
+    "http_request_phase_seconds",
+    "Time spent in each phase of a request, by route",
+    ["route", "phase"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+class RequestTimings:
+    __slots__ = ("start", "phases", "endpoint_end")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Phase -> seconds, in the order phases first ran
+        self.phases: dict[str, float] = {}
+        self.endpoint_end: Optional[float] = None
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def finish(self) -> dict[str, float]:
+        """Every phase, with serialize and total, once the response started."""
+        end = time.perf_counter()
+        phases = dict(self.phases)
+        if self.endpoint_end is not None:
+            phases["serialize"] = end - self.endpoint_end
+        phases["total"] = end - self.start
+        return phases
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+class _Phase:
+    __slots__ = ("_timings", "_name", "_start")
+
+    def __init__(self, timings: RequestTimings, name: str):
+        self._timings = timings
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self._timings.add(self._name, time.perf_counter() - self._start)
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name: str) -> _Phase | _NoPhase:
+    """Time the enclosed block as phase `name` of the current request."""
+    timings = _current.get()
+    return _NO_PHASE if timings is None else _Phase(timings, name)
+
+
+def start_request() -> RequestTimings:
+    """Time the current request. Call before handing it to the app."""
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def server_timing(phases: dict[str, float]) -> str:
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items()
+    )
+
+
+def record(route: str, phases: dict[str, float]):
+    for name, seconds in phases.items():
+        REQUEST_PHASE_SECONDS.observe(seconds, route, name)
+
+
+def _timed_endpoint(endpoint: Callable) -> Callable:
+    @functools.wraps(endpoint)
+    def timed(*args, **kwargs):
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            timings = _current.get()
+            if timings is not None:
+                timings.endpoint_end = time.perf_counter()
+
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """Marks when the endpoint returns, for the serialize phase. Only sync
+    endpoints are wrapped; the server has no async ones."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = _timed_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
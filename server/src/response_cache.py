@@ -0,0 +1,151 @@
+"""
+Encoded response bodies of hot endpoints, kept for one snapshot generation.
+
+A body is rendered on the first request for a url after each refresh and
+compressed at most once per encoding (gzip, and brotli when the brotli package
+is installed). Responses carry a weak ETag of the snapshot generation, so a
+client polling inside one refresh window gets a 304 without the endpoint
+doing any work. Generations restart at zero with the process, so the tag also
+carries a nonce drawn at startup, and tags from before a restart never match.
+"""
+
+import gzip, secrets, threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.metrics import Counter
+from src.request_timing import phase
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RESPONSE_CACHE_REQUESTS = Counter(
+    "response_cache_requests_total",
+    "Cached endpoint requests by result",
+    ["result"],
+)
+
+
+def accepted_encodings(header: str) -> set[str]:
+    encodings: set[str] = set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if q > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def _if_none_match_tags(header: str) -> set[str]:
+    """Opaque tags of an If-None-Match header, weak or not, and "*"."""
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")} - {""}
+
+
+class _Entry:
+    __slots__ = ("body", "encoded")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.encoded: dict[str, bytes] = {}
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 512, min_compress_bytes: int = 512):
+        self._max_entries = max_entries
+        self._min_compress_bytes = min_compress_bytes
+        self._generation = -1
+        self._boot = secrets.token_hex(4)
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def respond(
+        self, request: Request, generation: int, render: Callable[[], Any]
+    ) -> Response:
+        """Respond with the body `render` returns for this url, rendering it
+        only if it isn't cached for `generation`."""
+        opaque_tag = f'"{self._boot}-{generation}"'
+        headers = {"ETag": f"W/{opaque_tag}", "Vary": "Accept-Encoding"}
+        if_none_match = _if_none_match_tags(request.headers.get("if-none-match", ""))
+        if opaque_tag in if_none_match:
+            RESPONSE_CACHE_REQUESTS.inc("not_modified")
+            return Response(status_code=304, headers=headers)
+
+        key = f"{request.url.path}?{request.url.query}"
+        entry = self._get(key, generation)
+        if entry is None:
+            RESPONSE_CACHE_REQUESTS.inc("miss")
+            with phase("render"):
+                content = render()
+            with phase("encode"):
+                entry = _Entry(JSONResponse(jsonable_encoder(content)).body)
+            self._put(key, generation, entry)
+        else:
+            RESPONSE_CACHE_REQUESTS.inc("hit")
+        if "*" in if_none_match:
+            # Only once the body rendered, so a missing resource stays a 404
+            return Response(status_code=304, headers=headers)
+
+        encoding = self._choose_encoding(
+            request.headers.get("accept-encoding", ""), entry
+        )
+        if encoding is None:
+            return Response(entry.body, media_type="application/json", headers=headers)
+
+        body = entry.encoded.get(encoding)
+        if body is None:
+            # Concurrent first requests may both compress, which is harmless
+            with phase("compress"):
+                body = entry.encoded[encoding] = self._compress(encoding, entry.body)
+        headers["Content-Encoding"] = encoding
+        return Response(body, media_type="application/json", headers=headers)
+
+    def _choose_encoding(self, accept_encoding: str, entry: _Entry) -> Optional[str]:
+        if len(entry.body) < self._min_compress_bytes:
+            return None
+        accepted = accepted_encodings(accept_encoding)
+        if brotli and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    @staticmethod
+    def _compress(encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=5)
+        return gzip.compress(body, compresslevel=6, mtime=0)
+
+    def _get(self, key: str, generation: int) -> Optional[_Entry]:
+        with self._lock:
+            if generation != self._generation:
+                return None
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key: str, generation: int, entry: _Entry):
+        with self._lock:
+            if generation < self._generation:
+                return
+            if generation > self._generation:
+                # Bodies of older snapshots are never served again
+                self._entries.clear()
+                self._generation = generation
+            self._entries[key] = entry
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,33 @@
+import struct
+
+# (offset, length) reference into a string pool
+STRING_REF = struct.Struct("<IH")
+
+
+class StringPoolWriter:
+    """Accumulates deduplicated utf-8 strings for a packed binary file."""
+
+    def __init__(self):
+        self._offsets: dict[str, tuple[int, int]] = {}
+        self._data = bytearray()
+
+    def add(self, s: str) -> tuple[int, int]:
+        if s in self._offsets:
+            return self._offsets[s]
+        encoded = s.encode()
+        if len(encoded) > 0xFFFF:
+            raise ValueError(f"String too long for pool: {s[:32]}...")
+        ref = (len(self._data), len(encoded))
+        self._offsets[s] = ref
+        self._data += encoded
+        return ref
+
+    def getvalue(self) -> bytes:
+        return bytes(self._data)
+
+
+def read_string(
+    buf: bytes | memoryview, pool_start: int, offset: int, length: int
+) -> str:
+    start = pool_start + offset
+    return bytes(buf[start : start + length]).decode()
@@ -0,0 +1,39 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from bench.fixtures import load_fixtures
+from src.mtapi.mtapi import Mtapi
+
+STATIONS_FILE = Path(__file__).resolve().parent.parent / "data" / "stations.json"
+
+
+@pytest.fixture(scope="session")
+def stations_file() -> Path:
+    return STATIONS_FILE
+
+
+@pytest.fixture(scope="session")
+def feeds() -> dict[str, bytes]:
+    """Synthetic feed payloads by url, timed around the start of the session."""
+    return load_fixtures(STATIONS_FILE)
+
+
+@pytest.fixture
+def make_mtapi(monkeypatch, feeds):
+    """Builds unthreaded Mtapis whose feeds come from `payloads` (the
+    synthetic feeds by default) instead of the network."""
+
+    def make(payloads: dict[str, bytes] = feeds, **kwargs) -> Mtapi:
+        monkeypatch.setattr(
+            Mtapi, "_fetch_mta_feed", lambda self, url: payloads.get(url)
+        )
+        return Mtapi(STATIONS_FILE, **kwargs)
+
+    return make
+
+
+@pytest.fixture
+def now() -> int:
+    return int(time.time())
@@ -0,0 +1,90 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from src.admission import AdmissionController, EndpointClass
+
+
+class _App:
+    """A `slow` endpoint of endpoint class "slow" that holds its slot until
+    `release` is set, and an `other` endpoint of an unconfigured class."""
+
+    def __init__(self, *endpoint_classes: EndpointClass):
+        self.entered = threading.Semaphore(0)
+        self.release = threading.Event()
+        self.admission = admission = AdmissionController(endpoint_classes)
+        app = FastAPI()
+
+        @app.get("/slow", dependencies=[Depends(admission.limit("slow"))])
+        def slow():
+            self.entered.release()
+            self.release.wait(5)
+            return {}
+
+        @app.get("/other", dependencies=[Depends(admission.limit("other"))])
+        def other():
+            return {}
+
+        self.app = app
+        self.pool = ThreadPoolExecutor(4)
+
+    def get(self, path: str):
+        """Request `path` from another thread, as a separate client would."""
+        return self.pool.submit(lambda: TestClient(self.app).get(path))
+
+    def hold(self):
+        """Occupy a slot of "slow" until `release` is set."""
+        held = self.get("/slow")
+        assert self.entered.acquire(timeout=5)
+        return held
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    app = _App(EndpointClass("slow", concurrency=1, queue=0))
+    held = app.hold()
+
+    response = TestClient(app.app).get("/slow")
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    app.release.set()
+    assert held.result().status_code == 200
+
+
+def test_queued_request_times_out_with_503():
+    app = _App(EndpointClass("slow", concurrency=1, queue=1, queue_timeout=0.05))
+    held = app.hold()
+
+    response = TestClient(app.app).get("/slow")
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    app.release.set()
+    assert held.result().status_code == 200
+
+
+def test_queued_request_gets_the_freed_slot():
+    app = _App(EndpointClass("slow", concurrency=1, queue=1, queue_timeout=5))
+    held = app.hold()
+
+    queued = app.get("/slow")
+    waiters = app.admission._limiters["slow"]._waiters
+    deadline = time.monotonic() + 5
+    while not waiters and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert waiters
+    app.release.set()
+
+    assert held.result().status_code == 200
+    assert queued.result().status_code == 200
+
+
+def test_unconfigured_classes_are_unlimited():
+    app = _App(EndpointClass("slow", concurrency=1, queue=0))
+    held = app.hold()
+
+    assert TestClient(app.app).get("/other").status_code == 200
+    app.release.set()
+    held.result()
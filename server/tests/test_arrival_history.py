@@ -0,0 +1,68 @@
+import math, statistics
+
+import pytest
+
+from src.mtapi.arrival_history import ArrivalHistory, RingBuffer, RollingStats
+from src.mtapi.trip_index import TripIndex
+
+
+def _snapshot(*trips: tuple[str, int]) -> TripIndex:
+    """Northbound 1 trips predicted at station 127, as (trip id, epoch)."""
+    index = TripIndex()
+    for trip_id, epoch in trips:
+        index.add(trip_id, "1", "N", "127", epoch)
+    index.freeze()
+    return index
+
+
+def test_ring_buffer_keeps_the_newest_values():
+    buffer = RingBuffer(3)
+    evicted = [buffer.push(v) for v in (1, 2, 3, 4, 5)]
+
+    assert evicted == [None, None, None, 1, 2]
+    assert list(buffer) == [3, 4, 5]
+    assert len(buffer) == 3
+
+
+def test_rolling_stats_cover_the_window():
+    stats = RollingStats(4)
+    assert stats.mean() is None and stats.variance() is None
+
+    values = [120, 300, 240, 600, 180, 360]
+    for v in values:
+        stats.push(v)
+
+    assert stats.mean() == pytest.approx(statistics.mean(values[-4:]))
+    assert stats.variance() == pytest.approx(statistics.variance(values[-4:]))
+
+
+def test_trips_leaving_the_predictions_are_arrivals():
+    history = ArrivalHistory()
+    history.record(0, _snapshot(("A", 100), ("B", 400), ("C", 700)))
+    history.record(200, _snapshot(("B", 460), ("C", 700)))
+    history.record(500, _snapshot(("C", 760)))
+    history.record(800, _snapshot())
+
+    [stats] = history.stats("127")
+
+    assert (stats.route, stats.direction) == ("1", "N")
+    # Headways 360 and 300
+    assert stats.samples == 2
+    assert stats.mean_headway_seconds == pytest.approx(330)
+    assert stats.headway_stdev_seconds == pytest.approx(math.sqrt(1800))
+    # A arrived as first predicted, B and C a minute late
+    assert stats.mean_drift_seconds == pytest.approx(40)
+    assert stats.last_arrival == 760
+
+
+def test_dropped_trips_are_not_arrivals():
+    history = ArrivalHistory()
+    history.record(0, _snapshot(("A", 100), ("D", 2000)))
+    history.record(300, _snapshot())
+
+    [stats] = history.stats()
+
+    assert stats.samples == 0
+    assert stats.last_arrival == 100
+    assert history.stats(route="2") == []
+    assert history.stats(direction="S") == []
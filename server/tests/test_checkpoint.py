@@ -0,0 +1,61 @@
+import threading
+
+from src.mtapi.checkpoint import HEADER, read_checkpoint, write_checkpoint
+
+
+def test_round_trip(make_mtapi, tmp_path):
+    partitions = make_mtapi()._last_good
+    path = tmp_path / "checkpoint.bin"
+
+    write_checkpoint(partitions, path)
+    restored = read_checkpoint(path)
+
+    assert restored is not None
+    assert restored.keys() == partitions.keys()
+    for url, partition in partitions.items():
+        copy = restored[url]
+        assert copy.feed_url == url
+        assert copy.feed_time == partition.feed_time
+        assert copy.fetched_at == partition.fetched_at
+        assert copy.entities == partition.entities
+        assert copy.stop_updates == partition.stop_updates
+        assert list(copy.arrivals) == list(partition.arrivals)
+
+
+def test_unusable_checkpoints_are_ignored(make_mtapi, tmp_path):
+    path = tmp_path / "checkpoint.bin"
+    assert read_checkpoint(path) is None
+
+    write_checkpoint(make_mtapi()._last_good, path)
+    data = path.read_bytes()
+
+    path.write_bytes(b"XXXX" + data[4:])
+    assert read_checkpoint(path) is None
+
+    path.write_bytes(data[: HEADER.size + 10])
+    assert read_checkpoint(path) is None
+
+    path.write_bytes(data[:4])
+    assert read_checkpoint(path) is None
+
+
+def test_restart_serves_checkpointed_snapshot(make_mtapi, feeds, tmp_path):
+    path = tmp_path / "checkpoint.bin"
+    first = make_mtapi(checkpoint_file=path)
+    assert path.exists()
+
+    # Every feed fails after the restart
+    second = make_mtapi({}, checkpoint_file=path)
+    for thread in threading.enumerate():
+        if thread.name == "mtapi-update":
+            thread.join()
+
+    assert set(second.get_routes()) == set(first.get_routes())
+    assert all(status.stale for status in second.get_feed_status())
+    assert second.get_by_id(["127"])[0]["northbound_trains"]
+    assert second.get_by_id(["127"])[0]["stale"]
+    assert not first.get_by_id(["127"])[0]["stale"]
+
+    # Until a refresh reads the feeds again
+    second.update(payloads=feeds)
+    assert not second.get_by_id(["127"])[0]["stale"]
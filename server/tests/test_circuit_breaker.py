@@ -0,0 +1,94 @@
+from src.mtapi.circuit_breaker import BreakerState, CircuitBreaker
+from src.mtapi.mtapi import feed_name
+from src.mtaproto.synthetic import routes_for_feed
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, base_backoff=30)
+    for _ in range(2):
+        breaker.record_failure(now=0)
+        assert breaker.allow(now=0)
+
+    breaker.record_failure(now=0)
+
+    assert breaker.state == BreakerState.OPEN
+    assert not breaker.allow(now=29)
+    assert breaker.seconds_until_retry(now=10) == 20
+
+
+def test_half_open_trial_doubles_backoff_on_failure():
+    breaker = CircuitBreaker(failure_threshold=1, base_backoff=30, max_backoff=100)
+    breaker.record_failure(now=0)
+
+    assert breaker.allow(now=30)
+    assert breaker.state == BreakerState.HALF_OPEN
+    breaker.record_failure(now=30)
+    assert breaker.state == BreakerState.OPEN
+    assert breaker.seconds_until_retry(now=30) == 60
+
+    assert breaker.allow(now=90)
+    breaker.record_failure(now=90)
+    # Capped at max_backoff
+    assert breaker.seconds_until_retry(now=90) == 100
+
+
+def test_success_closes_and_resets_backoff():
+    breaker = CircuitBreaker(failure_threshold=1, base_backoff=30)
+    breaker.record_failure(now=0)
+    assert breaker.allow(now=30)
+
+    breaker.record_success()
+
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.consecutive_failures == 0
+    assert breaker.seconds_until_retry() is None
+    breaker.record_failure(now=100)
+    assert breaker.seconds_until_retry(now=100) == 30
+
+
+def test_serves_last_good_partition_while_feed_fails(make_mtapi, feeds):
+    payloads = dict(feeds)
+    mtapi = make_mtapi(payloads)
+    feed_url = next(url for url in feeds if routes_for_feed(url))
+    routes = set(routes_for_feed(feed_url)) & set(mtapi.get_routes())
+    assert routes
+
+    payloads[feed_url] = None
+    mtapi.update()
+
+    assert routes <= set(mtapi.get_routes())
+    status = {s.feed: s for s in mtapi.get_feed_status()}[feed_name(feed_url)]
+    assert status.stale
+    assert status.state == BreakerState.CLOSED
+    assert status.consecutive_failures == 1
+
+
+def test_open_breaker_stops_fetching(make_mtapi, feeds, monkeypatch):
+    payloads = dict(feeds)
+    mtapi = make_mtapi(payloads)
+    feed_url = next(iter(feeds))
+    payloads[feed_url] = None
+    for _ in range(3):
+        mtapi.update()
+
+    fetched: list[str] = []
+    monkeypatch.setattr(
+        type(mtapi),
+        "_fetch_mta_feed",
+        lambda self, url: fetched.append(url) or payloads.get(url),
+    )
+    mtapi.update()
+
+    assert feed_url not in fetched
+    status = {s.feed: s for s in mtapi.get_feed_status()}[feed_name(feed_url)]
+    assert status.state == BreakerState.OPEN
+    assert status.retry_in > 0
+    assert status.stale
+
+    # A good payload after the backoff closes it again
+    payloads[feed_url] = feeds[feed_url]
+    mtapi._breakers[feed_url]._retry_at = 0
+    mtapi.update()
+    status = {s.feed: s for s in mtapi.get_feed_status()}[feed_name(feed_url)]
+    assert status.state == BreakerState.CLOSED
+    assert not status.stale
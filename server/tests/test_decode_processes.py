@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pytest
+
+from src.mtaproto.feedresponse import TZ
+
+
+@pytest.fixture
+def pooled(make_mtapi):
+    mta = make_mtapi({}, decode_processes=2)
+    yield mta
+    mta._decoder.shutdown()  # type: ignore
+
+
+def test_worker_processes_decode_like_the_server(make_mtapi, pooled, feeds, now):
+    in_process = make_mtapi({})
+    when = datetime.fromtimestamp(now, TZ)
+
+    in_process.update(now=when, payloads=feeds)
+    pooled.update(now=when, payloads=feeds)
+
+    assert pooled._last_good.keys() == feeds.keys()
+    for url, partition in in_process._last_good.items():
+        decoded = pooled._last_good[url]
+        assert list(decoded.arrivals) == list(partition.arrivals)
+        assert decoded.unknown_stops == partition.unknown_stops
+        assert decoded.entities == partition.entities
+    assert pooled.get_by_id(["127"]) == in_process.get_by_id(["127"])
+
+
+def test_worker_decode_errors_only_lose_their_feed(pooled, feeds, now):
+    broken, *others = feeds
+    payloads = {**feeds, broken: b"\xff\xff\xff"}
+
+    pooled.update(now=datetime.fromtimestamp(now, TZ), payloads=payloads)
+
+    assert broken not in pooled._last_good
+    assert pooled._last_good.keys() == set(others)
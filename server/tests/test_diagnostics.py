@@ -0,0 +1,47 @@
+from collections import Counter
+
+from src.mtapi.diagnostics import UnknownStopCollector
+from src.mtapi.feed_source import MTA_FEED_BASE_URL
+from src.mtaproto.synthetic import synthetic_feed
+
+SUBWAY_FEED = MTA_FEED_BASE_URL + "nyct%2Fgtfs"
+
+
+def test_totals_add_up_across_refreshes():
+    collector = UnknownStopCollector()
+    collector.record(Counter({"X01": 3, "X02": 1}), now=100)
+    collector.record(Counter({"X01": 2}), now=200)
+
+    by_stop = {s.stop_id: s for s in collector.top()}
+
+    assert [s.stop_id for s in collector.top()] == ["X01", "X02"]
+    assert (by_stop["X01"].total, by_stop["X01"].last_refresh) == (5, 2)
+    assert by_stop["X01"].last_seen == 200
+    # Not seen in the latest refresh
+    assert (by_stop["X02"].total, by_stop["X02"].last_refresh) == (1, 0)
+    assert by_stop["X02"].last_seen == 100
+    assert len(collector.top(1)) == 1
+
+
+def test_least_frequent_stop_ids_are_evicted():
+    collector = UnknownStopCollector(max_stop_ids=2)
+    collector.record(Counter({"X01": 5, "X02": 3}))
+    collector.record(Counter({"X03": 1}))
+
+    assert [s.stop_id for s in collector.top()] == ["X01", "X02"]
+
+
+def test_update_counts_unknown_stops_of_fresh_feeds(make_mtapi, now):
+    # Timed ahead, so every stop update is upcoming
+    payload = synthetic_feed(["127", "ZZ1"], ["1"], now + 600, trips_per_route=4)
+    mta = make_mtapi({SUBWAY_FEED: payload})
+
+    [stop] = mta.get_unknown_stops()
+    assert stop.stop_id == "ZZ1"
+    assert stop.total == stop.last_refresh > 0
+
+    # Served again from its last good partition, the feed isn't recounted
+    mta.update(payloads={})
+    [again] = mta.get_unknown_stops()
+    assert again.total == stop.total
+    assert again.last_refresh == 0
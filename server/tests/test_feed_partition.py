@@ -0,0 +1,109 @@
+from collections import Counter
+
+import pytest
+
+from src.mtapi.feed_partition import extract_partition
+from src.mtapi.feed_source import MTA_FEED_BASE_URL, FeedSource, subway_source
+from src.mtapi.mtapi import Mtapi
+from src.mtaproto import gtfs_realtime_pb2, nyct_subway_pb2
+from src.mtaproto.feed_scanner import scan_feed
+from src.mtaproto.feedresponse import normalize_route_id
+from src.mtaproto.synthetic import SOUTH, synthetic_feed
+
+SUBWAY_FEED = MTA_FEED_BASE_URL + "nyct%2Fgtfs"
+
+
+@pytest.fixture(scope="module")
+def stops_to_stations(stations_file) -> dict[str, str]:
+    return Mtapi._build_stops_index(Mtapi._load_stations(stations_file))
+
+
+def _protobuf_partition(
+    payload: bytes, stops_to_stations: dict[str, str], now: int
+) -> tuple[list[tuple], Counter[str]]:
+    """The arrivals and unknown stops of a feed, from a full protobuf decode."""
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(payload)
+    arrivals = []
+    unknown_stops: Counter[str] = Counter()
+    for entity in message.entity:
+        if not entity.HasField("trip_update"):
+            continue
+        trip = entity.trip_update.trip
+        nyct = trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor]
+        direction = "S" if nyct.direction == SOUTH else "N"
+        for update in entity.trip_update.stop_time_update:
+            epoch = update.arrival.time or update.departure.time
+            if epoch < now:
+                continue
+            stop_id = update.stop_id[:3]
+            station_id = stops_to_stations.get(stop_id)
+            if station_id is None:
+                unknown_stops[stop_id] += 1
+                continue
+            arrivals.append(
+                (
+                    station_id,
+                    normalize_route_id(trip.route_id),
+                    direction,
+                    epoch,
+                    trip.trip_id,
+                    stop_id,
+                )
+            )
+    return arrivals, unknown_stops
+
+
+def test_matches_protobuf_decoding(feeds, stops_to_stations, now):
+    # Stops missing from the stations file are counted, not served
+    payloads = {
+        **feeds,
+        "unknown": synthetic_feed(["127", "ZZ1", "ZZ2"], ["1"], now),
+    }
+    for url, payload in payloads.items():
+        partition = extract_partition(
+            url, scan_feed(payload), subway_source(), stops_to_stations, now, now
+        )
+        arrivals, unknown_stops = _protobuf_partition(payload, stops_to_stations, now)
+
+        assert arrivals
+        assert sorted(partition.arrivals) == sorted(arrivals)
+        assert partition.unknown_stops == unknown_stops
+        assert bool(unknown_stops) == (url == "unknown")
+        message = gtfs_realtime_pb2.FeedMessage()
+        message.ParseFromString(payload)
+        assert partition.feed_time.timestamp() == message.header.timestamp
+        assert partition.entities == len(message.entity)
+        assert partition.stop_updates == sum(
+            len(e.trip_update.stop_time_update) for e in message.entity
+        )
+
+
+def test_sources_sharing_a_trip_id_stay_apart(make_mtapi, stations_file, now):
+    payload = synthetic_feed(["127", "128", "129"], ["1"], now, trips_per_route=4)
+    subway = subway_source()
+    # Another agency publishing the very same trips
+    other = FeedSource(
+        "other",
+        "http://other.example/",
+        ("feed",),
+        stations_file=stations_file,
+        prefix="X-",
+        stop_id=subway.stop_id,
+        route_id=subway.route_id,
+        direction=subway.direction,
+    )
+    mta = make_mtapi(
+        {SUBWAY_FEED: payload, "http://other.example/feed": payload},
+        feed_sources=[other],
+    )
+
+    trip_ids = [trip[0] for trip in scan_feed(payload).trips]
+    served = [id for id in trip_ids if mta.get_trip(id)]
+    assert served
+    for trip_id in served:
+        subway_trip = mta.get_trip(trip_id)
+        other_trip = mta.get_trip("X-" + trip_id)
+        assert subway_trip and other_trip
+        assert not any(id.startswith("X-") for id in subway_trip.station_ids)
+        assert other_trip.station_ids == ["X-" + id for id in subway_trip.station_ids]
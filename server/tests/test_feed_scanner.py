@@ -0,0 +1,84 @@
+import pytest
+
+from src.mtaproto import gtfs_realtime_pb2, nyct_subway_pb2
+from src.mtaproto.feed_scanner import DecodeError, scan_feed
+from src.mtaproto.synthetic import synthetic_feed
+
+
+def _parsed(payload: bytes) -> gtfs_realtime_pb2.FeedMessage:
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(payload)
+    return message
+
+
+def test_matches_protobuf_decoding(feeds):
+    for url, payload in feeds.items():
+        message = _parsed(payload)
+        feed = scan_feed(payload)
+
+        assert feed.timestamp == message.header.timestamp
+        assert feed.entity_count == len(message.entity)
+
+        expected = []
+        for entity in message.entity:
+            if not entity.HasField("trip_update"):
+                continue
+            trip = entity.trip_update.trip
+            nyct = trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor]
+            direction = nyct_subway_pb2.NyctTripDescriptor.Direction.Name(
+                nyct.direction or 1
+            )[0]
+            stops = [
+                (u.stop_id, u.arrival.time or u.departure.time)
+                for u in entity.trip_update.stop_time_update
+            ]
+            expected.append(
+                (
+                    trip.trip_id,
+                    trip.route_id,
+                    direction,
+                    trip.direction_id if trip.HasField("direction_id") else -1,
+                    stops,
+                )
+            )
+        assert feed.trips == expected, url
+
+
+def test_reads_direction_id_and_departure_only_stops(now):
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = "2.0"
+    message.header.timestamp = now
+    update = message.entity.add(id="1").trip_update
+    update.trip.trip_id = "T1"
+    update.trip.route_id = "1"
+    update.trip.direction_id = 1
+    first = update.stop_time_update.add(stop_id="101")
+    first.departure.time = now + 60
+    second = update.stop_time_update.add(stop_id="102")
+    second.arrival.time = now + 120
+    second.departure.time = now + 150
+    update.stop_time_update.add(stop_id="103")
+
+    feed = scan_feed(message.SerializeToString())
+
+    assert feed.trips == [
+        ("T1", "1", "N", 1, [("101", now + 60), ("102", now + 120), ("103", 0)])
+    ]
+
+
+def test_skips_entities_without_trip_updates(now):
+    payload = synthetic_feed(["101", "102", "103"], ["1"], now, trips_per_route=2)
+    message = _parsed(payload)
+    vehicles = sum(e.HasField("vehicle") for e in message.entity)
+
+    feed = scan_feed(payload)
+
+    assert vehicles > 0
+    assert feed.entity_count == len(message.entity)
+    assert len(feed.trips) == len(message.entity) - vehicles
+
+
+def test_truncated_payload_raises(feeds):
+    payload = next(iter(feeds.values()))
+    with pytest.raises(DecodeError):
+        scan_feed(payload[: len(payload) // 2])
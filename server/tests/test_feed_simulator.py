@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from bench.feed_simulator import FeedSimulator, start_feed_simulator
+from bench.fixtures import load_fixtures, shift_feed
+from src.mtapi.feed_archive import FeedArchiver
+from src.mtapi.mtapi import FEED_PATHS, Mtapi
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def serve(simulator: FeedSimulator) -> str:
+        base_url, server = start_feed_simulator(simulator)
+        servers.append((simulator, server))
+        return base_url
+
+    yield serve
+    for simulator, server in servers:
+        simulator.stop()
+        server.shutdown()
+        server.server_close()
+
+
+def test_mtapi_reads_feeds_from_the_configured_base_url(serve, stations_file):
+    base_url = serve(FeedSimulator(stations_file, scale=0.25))
+
+    mta = Mtapi(stations_file, feed_base_url=base_url)
+
+    statuses = mta.get_feed_status()
+    assert len(statuses) == len(FEED_PATHS)
+    assert not any(s.stale or s.consecutive_failures for s in statuses)
+    assert all(url.startswith(base_url) for url in mta._FEED_URLS)
+    print(
+        {k: len(v.arrivals) for k, v in mta._last_good.items()}, mta.get_by_id(["127"])
+    )
+    assert mta.get_by_id(["127"])[0]["northbound_trains"]
+
+
+def test_failing_feeds_trip_their_breakers(serve, stations_file):
+    base_url = serve(FeedSimulator(stations_file, scale=0.25, error_rate=1))
+
+    mta = Mtapi(stations_file, feed_base_url=base_url)
+
+    assert all(s.consecutive_failures == 1 for s in mta.get_feed_status())
+    assert all(s.feed_time is None for s in mta.get_feed_status())
+
+
+def test_archived_cycles_are_shifted_to_the_present(serve, stations_file, tmp_path):
+    # Recorded an hour ago
+    recorded_at = int(time.time()) - 3600
+    archiver = FeedArchiver(tmp_path)
+    for url, payload in load_fixtures(stations_file).items():
+        archiver.append(url, recorded_at, recorded_at, shift_feed(payload, -3600))
+    archiver.close()
+    simulator = FeedSimulator(stations_file, archive_dir=tmp_path)
+    base_url = serve(simulator)
+
+    mta = Mtapi(stations_file, feed_base_url=base_url)
+
+    assert simulator.respond("/nowhere") == (404, b"")
+    for status in mta.get_feed_status():
+        assert status.feed_time and status.feed_time.timestamp() > recorded_at + 3000
+    assert mta.get_by_id(["127"])[0]["northbound_trains"]
@@ -0,0 +1,61 @@
+import pytest
+
+from src.isochrone import IsochroneService
+
+
+@pytest.fixture
+def mta(make_mtapi):
+    return make_mtapi()
+
+
+@pytest.fixture
+def service(mta):
+    return IsochroneService(mta)
+
+
+def test_search_expands_with_the_budget(mta, service):
+    lat, lng = mta.get_station_location("127")
+
+    near = service.reachable(lat, lng, 5 * 60)
+    far = service.reachable(lat, lng, 30 * 60)
+
+    assert [s.seconds for s in far] == sorted(s.seconds for s in far)
+    assert all(s.seconds <= 30 * 60 for s in far)
+    assert {s.station_id: s.seconds for s in near}.items() <= {
+        s.station_id: s.seconds for s in far
+    }.items()
+    assert len(far) > len(near)
+    # Some stations are only reached by riding
+    assert any(not s.walk_only for s in far)
+
+
+def test_origins_in_one_cell_share_a_search(mta, service):
+    lat, lng = service.cell_center(*mta.get_station_location("127"))
+    size = 0.002
+
+    first = service.reachable(lat, lng, 10 * 60)
+
+    assert service.reachable(lat + size / 4, lng - size / 4, 10 * 60) is first
+    assert service.reachable(lat + size, lng, 10 * 60) is not first
+
+
+def test_new_snapshot_rebuilds_the_network(mta, service, feeds):
+    lat, lng = mta.get_station_location("127")
+    first = service.reachable(lat, lng, 10 * 60)
+
+    mta.update(payloads=feeds)
+
+    assert service.reachable(lat, lng, 10 * 60) is not first
+
+
+def test_network_is_built_outside_the_lock(mta, service, monkeypatch):
+    get_trips = mta.get_trips
+
+    def unlocked_get_trips():
+        assert not service._lock.locked()
+        return get_trips()
+
+    monkeypatch.setattr(mta, "get_trips", unlocked_get_trips)
+    lat, lng = mta.get_station_location("127")
+
+    assert service.reachable(lat, lng, 10 * 60)
@@ -0,0 +1,102 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from bench.fixtures import write_synthetic_gtfs
+from src.gtfs_static.timetable import Timetable, write_timetable
+from src.journey_planner import JourneyPlanner
+from src.mtaproto import gtfs_realtime_pb2, nyct_subway_pb2
+from src.mtaproto.feedresponse import TZ
+from src.mtaproto.synthetic import NORTH, routes_for_feed
+
+# Synthetic trips leave every 6 minutes and take 90 seconds between stops
+HEADWAY = timedelta(minutes=6)
+NOON = TZ.localize(datetime.combine(date.today(), time(12)))
+
+
+@pytest.fixture(scope="module")
+def timetable(tmp_path_factory, stations_file) -> Timetable:
+    out = tmp_path_factory.mktemp("gtfs")
+    write_synthetic_gtfs(stations_file, out / "gtfs.zip")
+    write_timetable(out / "gtfs.zip", out / "timetable.bin")
+    return Timetable.open(out / "timetable.bin")
+
+
+@pytest.fixture
+def planner(timetable, make_mtapi) -> JourneyPlanner:
+    # Without live feeds, so only the timetable is searched
+    return JourneyPlanner(timetable, make_mtapi({}), transfer_seconds=120)
+
+
+def test_single_ride(planner):
+    journeys = planner.plan({"101": 0}, {"110": 0}, NOON)
+
+    assert len(journeys) == 1
+    journey = journeys[0]
+    assert journey.rides == 1
+    assert NOON <= journey.departure < NOON + HEADWAY
+    [leg] = journey.legs
+    assert (leg.mode, leg.route) == ("ride", "1")
+    assert (leg.from_station, leg.to_station) == ("101", "110")
+    assert leg.arrival > leg.departure
+    assert journey.arrival == leg.arrival
+
+
+def test_walking_to_the_origin_delays_boarding(planner):
+    walk = timedelta(minutes=10)
+    journey = planner.plan({"101": int(walk.total_seconds())}, {"110": 0}, NOON)[0]
+
+    assert journey.legs[0].mode == "walk"
+    ride = journey.legs[1]
+    assert ride.departure >= NOON + walk
+    assert ride.departure < NOON + walk + HEADWAY
+
+
+def test_transfer_within_a_station_complex(planner):
+    # 127 groups the 1's stop 127 and the 7's stop 725
+    journeys = planner.plan({"101": 0}, {"720": 0}, NOON)
+
+    journey = journeys[-1]
+    rides = [leg for leg in journey.legs if leg.mode == "ride"]
+    assert journey.rides == 2
+    assert [leg.route for leg in rides] == ["1", "7"]
+    assert rides[0].to_station == rides[1].from_station == "127"
+    assert rides[1].departure >= rides[0].arrival + timedelta(seconds=120)
+
+
+def test_max_rides_limits_transfers(planner):
+    assert planner.plan({"101": 0}, {"720": 0}, NOON, max_rides=1) == []
+
+
+def test_unknown_or_unreachable_stations(planner):
+    assert planner.plan({"nope": 0}, {"110": 0}, NOON) == []
+    assert planner.plan({"101": 0}, {"nope": 0}, NOON) == []
+
+
+def test_live_arrivals_replace_timetable_times(timetable, make_mtapi, feeds):
+    mtapi = make_mtapi({})
+    # The 1 leaving 101 at noon, 2 minutes late at 110
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = "1.0"
+    message.header.timestamp = int(NOON.timestamp()) - 600
+    trip = message.entity.add(id="1").trip_update
+    trip.trip.trip_id = "001200_1..N"
+    trip.trip.route_id = "1"
+    trip.trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].direction = NORTH
+    late = NOON + timedelta(minutes=12, seconds=30)
+    for stop_id, at in (("101N", NOON), ("110N", late)):
+        update = trip.stop_time_update.add(stop_id=stop_id)
+        update.arrival.time = update.departure.time = int(at.timestamp())
+    feed_url = next(url for url in feeds if "1" in routes_for_feed(url))
+    mtapi.update(
+        now=NOON - timedelta(minutes=10),
+        payloads={feed_url: message.SerializeToString()},
+    )
+    planner = JourneyPlanner(timetable, mtapi)
+
+    [journey] = planner.plan({"101": 0}, {"110": 0}, NOON)
+
+    [leg] = journey.legs
+    assert leg.realtime
+    assert leg.trip_id == "001200_1..N"
+    assert leg.arrival == late
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from bench.google_maps_standin import start_google_maps_standin
+from src.google_maps_api.google_maps_api import GoogleMapsService
+from src.location_registry import FixedLocation, LocationRegistry
+
+LOCATIONS = {
+    "office": FixedLocation("office", "Office", (40.7527, -73.9772)),
+    "kiosk": FixedLocation("kiosk", "Kiosk", (40.7061, -74.0087)),
+}
+
+
+@pytest.fixture
+def standin_url():
+    url, server = start_google_maps_standin()
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def down_url():
+    """A Distance Matrix URL nothing listens on."""
+    url, server = start_google_maps_standin()
+    server.shutdown()
+    server.server_close()
+    return url
+
+
+def _complete(registry: LocationRegistry) -> bool:
+    return all(
+        (entry := registry.walking_times(id)) and all(entry[1]) for id in LOCATIONS
+    )
+
+
+def test_walking_times_are_computed_ahead(make_mtapi, standin_url):
+    mta = make_mtapi({})
+    service = GoogleMapsService("key", base_url=standin_url)
+    registry = LocationRegistry(LOCATIONS, mta, service, stations_per_location=3)
+    assert registry.walking_times("office") is None
+
+    assert registry.refresh()
+
+    station_ids, times = registry.walking_times("office")  # type: ignore
+    assert station_ids == mta.get_nearest_station_ids(LOCATIONS["office"].location, 3)
+    assert all(t and t.duration.total_seconds() > 0 for t in times)
+    assert registry.walking_times("elsewhere") is None
+
+
+def test_missing_walking_times_are_fetched_on_retry(make_mtapi, down_url, standin_url):
+    service = GoogleMapsService("key", base_url=down_url)
+    registry = LocationRegistry(LOCATIONS, make_mtapi({}), service)
+
+    assert not registry.refresh()
+    assert registry.walking_times("office")[1] == [None] * 5  # type: ignore
+
+    service.base_url = standin_url
+    assert registry.refresh(refetch=False)
+    assert _complete(registry)
+
+
+def test_refresh_thread_retries_until_complete(make_mtapi, down_url, standin_url):
+    service = GoogleMapsService("key", base_url=down_url)
+    registry = LocationRegistry(
+        LOCATIONS, make_mtapi({}), service, refresh_seconds=60, retry_seconds=0.05
+    )
+    registry.start()
+    try:
+        deadline = time.monotonic() + 5
+        while registry.walking_times("office") is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert not _complete(registry)
+
+        service.base_url = standin_url
+        while not _complete(registry):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        registry.stop()
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+from bench.fixtures import write_synthetic_gtfs
+from src.gtfs_static.route_table import RouteTable, write_route_table
+from src.gtfs_static.schedule import load_static_schedule
+from src.mtapi.feed_source import MTA_FEED_BASE_URL
+from src.mtaproto.feedresponse import TZ
+from src.mtaproto.synthetic import synthetic_feed
+
+SUBWAY_FEED = MTA_FEED_BASE_URL + "nyct%2Fgtfs"
+
+
+def test_route_lists_each_station_once(make_mtapi, now):
+    # 127 and 725 are both stops of station 127
+    payload = synthetic_feed(["127", "725", "128"], ["1"], now, trips_per_route=4)
+    mta = make_mtapi({SUBWAY_FEED: payload})
+
+    names = [station["name"] for station in mta.get_stations_of_route("1")]
+
+    assert sorted(names) == sorted(mta.get_station_name(id) for id in ("127", "128"))
+
+
+def test_route_stations_come_from_the_route_table(make_mtapi, tmp_path, stations_file):
+    gtfs = tmp_path / "gtfs.zip"
+    write_synthetic_gtfs(stations_file, gtfs)
+    write_route_table(load_static_schedule(gtfs), tmp_path / "routes.bin")
+    route_table = RouteTable.open(tmp_path / "routes.bin")
+
+    # No trains are running
+    mta = make_mtapi({}, route_table=route_table)
+
+    station_ids = {
+        mta.get_station_of_stop(s) for s in route_table.get("1").stop_sequences["N"]
+    }
+    names = [station["name"] for station in mta.get_stations_of_route("1")]
+    assert sorted(names) == sorted(mta.get_station_name(id) for id in station_ids)
+
+
+def test_last_update_moves_when_the_snapshot_is_published(make_mtapi, feeds):
+    mta = make_mtapi()
+    published = mta.last_update()
+    seen = []
+
+    def fetch(url):
+        seen.append(mta.last_update())
+        return feeds.get(url)
+
+    mta._fetch_mta_feed = fetch
+    mta.update(now=published + timedelta(minutes=1))
+
+    assert set(seen) == {published}
+    assert mta.last_update() == published + timedelta(minutes=1)
+
+
+def test_snapshots_share_station_metadata(make_mtapi, feeds, now):
+    mta = make_mtapi({})
+    when = datetime.fromtimestamp(now, TZ)
+    mta.update(now=when, payloads=feeds)
+    first = mta._stations
+    trains = first["127"].trains
+    assert trains["N"]
+
+    mta.update(now=when + timedelta(seconds=30), payloads=feeds)
+
+    assert mta._stations is not first
+    for id, station in mta._stations.items():
+        assert station.info is first[id].info
+    # The published snapshot is never modified
+    assert first["127"].trains is trains
+    assert mta._stations["127"].trains is not trains
+
+
+def test_stations_without_trains_share_one_empty_record(make_mtapi, now):
+    payload = synthetic_feed(["127", "128"], ["1"], now + 600, trips_per_route=4)
+    mta = make_mtapi({})
+    when = datetime.fromtimestamp(now, TZ)
+    mta.update(now=when, payloads={SUBWAY_FEED: payload})
+
+    idle = [s for s in mta._stations.values() if not s.route_trains]
+    assert len(idle) == len(mta._stations) - 2
+    assert all(s.trains is idle[0].trains for s in idle)
+    assert all(s.last_update == when for s in idle)
+
+    [station] = mta.get_by_id(["128"])
+    times = [t["time"] for t in station["northbound_trains"]]
+    assert times and times == sorted(times)
+    assert all(t["name"] == "1" and t["trip_id"] for t in station["northbound_trains"])
+    assert len(times) <= mta._MAX_TRAINS
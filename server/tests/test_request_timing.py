@@ -0,0 +1,67 @@
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from src.request_timing import (
+    RequestTimings,
+    TimedRoute,
+    phase,
+    server_timing,
+    start_request,
+)
+
+
+def _app() -> FastAPI:
+    """Timed like main.py, with an endpoint running the `work` phase twice."""
+    app = FastAPI()
+    app.router.route_class = TimedRoute
+
+    @app.middleware("http")
+    async def timed(request: Request, call_next):
+        timings = start_request()
+        response = await call_next(request)
+        response.headers["Server-Timing"] = server_timing(timings.finish())
+        return response
+
+    @app.get("/work")
+    def work():
+        for _ in range(2):
+            with phase("work"):
+                time.sleep(0.02)
+        return {"ok": True}
+
+    return app
+
+
+def _phases(header: str) -> dict[str, float]:
+    phases = {}
+    for entry in header.split(", "):
+        name, duration = entry.split(";dur=")
+        phases[name] = float(duration)
+    return phases
+
+
+def test_phases_are_reported_in_server_timing():
+    response = TestClient(_app()).get("/work")
+
+    phases = _phases(response.headers["Server-Timing"])
+    assert list(phases) == ["work", "serialize", "total"]
+    # Both runs of the phase, in milliseconds
+    assert phases["work"] >= 40
+    assert phases["total"] >= phases["work"] + phases["serialize"]
+
+
+def test_phases_outside_a_request_do_nothing():
+    assert phase("work") is phase("other")
+    with phase("work"):
+        pass
+
+
+def test_server_timing_format():
+    timings = RequestTimings()
+    timings.add("fetch", 0.0015)
+    timings.add("fetch", 0.001)
+
+    assert server_timing(timings.phases) == "fetch;dur=2.50"
+    assert list(timings.finish()) == ["fetch", "total"]
@@ -0,0 +1,102 @@
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from src.response_cache import ResponseCache
+
+
+class _App:
+    """An endpoint serving `items` through a ResponseCache, counting renders."""
+
+    def __init__(self, cache: ResponseCache):
+        self.generation = 1
+        self.items = {"a": ["x"] * 200, "b": ["y"]}
+        self.renders = 0
+        app = FastAPI()
+
+        @app.get("/items/{name}")
+        def item(request: Request, name: str):
+            def render():
+                self.renders += 1
+                if name not in self.items:
+                    raise HTTPException(status_code=404, detail="Not found")
+                return {"name": name, "values": self.items[name]}
+
+            return cache.respond(request, self.generation, render)
+
+        self.client = TestClient(app)
+
+
+@pytest.fixture
+def app() -> _App:
+    return _App(ResponseCache())
+
+
+def test_renders_once_per_generation(app):
+    first = app.client.get("/items/a")
+    second = app.client.get("/items/a")
+
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content
+    assert first.headers["etag"] == second.headers["etag"]
+    assert app.renders == 1
+
+    app.generation += 1
+    third = app.client.get("/items/a")
+    assert app.renders == 2
+    assert third.headers["etag"] != first.headers["etag"]
+
+
+def test_matching_etag_is_not_modified(app):
+    etag = app.client.get("/items/a").headers["etag"]
+
+    response = app.client.get("/items/a", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+    assert app.renders == 1
+
+    response = app.client.get(
+        "/items/a", headers={"If-None-Match": f'"other", {etag.removeprefix("W/")}'}
+    )
+    assert response.status_code == 304
+
+
+def test_etag_changes_with_generation(app):
+    etag = app.client.get("/items/a").headers["etag"]
+    app.generation += 1
+
+    response = app.client.get("/items/a", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_etag_from_before_a_restart_does_not_match(app):
+    etag = app.client.get("/items/a").headers["etag"]
+    restarted = _App(ResponseCache())
+
+    response = restarted.client.get("/items/a", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_wildcard_only_matches_existing_resources(app):
+    headers = {"If-None-Match": "*"}
+    assert app.client.get("/items/a", headers=headers).status_code == 304
+    assert app.client.get("/items/missing", headers=headers).status_code == 404
+
+
+def test_compresses_large_bodies_when_accepted(app):
+    response = app.client.get("/items/a", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["values"] == app.items["a"]
+
+    raw = app.client.get("/items/a", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers
+    assert raw.json() == response.json()
+
+    small = app.client.get("/items/b", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.mtapi.mtapi import Station, StationInfo, StationQuery
+from src.mtaproto.feedresponse import TZ
+
+NOW = datetime(2026, 1, 5, 12, 0, tzinfo=TZ)
+EPOCH = int(NOW.timestamp())
+
+
+@pytest.fixture
+def station() -> Station:
+    station = Station(StationInfo("127", "Times Sq-42 St", (40.75, -73.98), ()), NOW)
+    # Route 1 every 2 minutes, 2 every 3 and 3 every 5, both ways
+    for route, every in (("1", 120), ("2", 180), ("3", 300)):
+        for direction in ("N", "S"):
+            for i in range(1, 5):
+                station.add_train(
+                    route, direction, EPOCH + i * every, NOW, f"{route}{direction}{i}"
+                )
+    station.sort_trains(max_trains=3)
+    return station
+
+
+def _epochs(station: Station, direction, query: StationQuery) -> list[int]:
+    return [a.epoch for a in station.select_trains(direction, query, NOW)]
+
+
+def test_route_filter_keeps_the_route_trains_beyond_the_merged_list(station):
+    merged = [a.route_id for a in station.trains["N"]]
+    assert "3" not in merged
+
+    trains = station.select_trains("N", StationQuery(routes=frozenset({"3"})), NOW)
+
+    assert [a.route_id for a in trains] == ["3", "3", "3"]
+    assert [a.epoch for a in trains] == [EPOCH + 300, EPOCH + 600, EPOCH + 900]
+
+
+def test_route_filter_merges_routes_soonest_first(station):
+    epochs = _epochs(station, "S", StationQuery(routes=frozenset({"2", "3"})))
+
+    assert epochs == [EPOCH + 180, EPOCH + 300, EPOCH + 360]
+
+
+def test_direction_filter_empties_the_other_direction(station):
+    query = StationQuery(direction="N")
+
+    assert _epochs(station, "S", query) == []
+    assert _epochs(station, "N", query) == [a.epoch for a in station.trains["N"]]
+
+
+def test_horizon_includes_trains_due_at_its_end(station):
+    query = StationQuery(horizon=timedelta(minutes=3))
+
+    # 120 and 180 are within, 240 is past it
+    assert _epochs(station, "N", query) == [EPOCH + 120, EPOCH + 180]
+    assert _epochs(station, "N", StationQuery(horizon=timedelta(0))) == []
+
+
+def test_filters_combine(station):
+    query = StationQuery(
+        routes=frozenset({"1"}), direction="S", horizon=timedelta(minutes=5)
+    )
+
+    assert _epochs(station, "S", query) == [EPOCH + 120, EPOCH + 240]
+    assert _epochs(station, "N", query) == []
+
+
+def test_route_filter_limits_point_queries_to_the_route(make_mtapi):
+    mta = make_mtapi()
+    point = mta.get_station_location("127")
+    query = StationQuery(routes=frozenset({"L"}))
+
+    stations = mta.get_by_point(point, limit=3, query=query)
+
+    assert stations
+    for station in stations:
+        assert "L" in station["routes"]
+        assert {t["name"] for t in station["northbound_trains"]} <= {"L"}
+        assert {t["name"] for t in station["southbound_trains"]} <= {"L"}